@@ -7,80 +7,90 @@ import argparse
 import logging
 import os
 import asyncio
-from pathlib import Path
 from dotenv import load_dotenv
 
+from src import __version__
+from src.utils import CachedTimeFormatter
+
 # 加载.env文件
 load_dotenv()
 
-# 添加src目录到Python路径
-sys.path.insert(0, str(Path(__file__).parent / "src"))
-
-# 现在可以导入src模块
-from src.app import AzRayApp  # noqa: E402
+# 命令行解析器在模块级构建一次
+PARSER = argparse.ArgumentParser(
+    description="Azure V2Ray自动化部署和健康监控系统"
+)
+PARSER.add_argument(
+    "-v", "--verbose",
+    action="store_true",
+    help="启用详细日志输出"
+)
+PARSER.add_argument(
+    "--recreate",
+    action="store_true",
+    help="删除现有容器实例并重新创建（保留存储账户和其他资源）"
+)
+PARSER.add_argument(
+    "--version",
+    action="version",
+    version=f"%(prog)s {__version__}"
+)
+
+
+# 日志处理器在模块级构建一次，重复调用setup_logging时复用
+_LOG_HANDLER = logging.StreamHandler(sys.stdout)
+_LOG_HANDLER.setFormatter(
+    CachedTimeFormatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+)
 
 
 def setup_logging(verbose: bool = False):
-    """设置日志配置"""
+    """设置日志配置（可重复调用，再次调用时仅更新日志级别）"""
     level = logging.DEBUG if verbose else logging.INFO
 
-    # 如果环境变量中有LOG_LEVEL，优先使用
-    if "LOG_LEVEL" in os.environ:
-        level_str = os.environ["LOG_LEVEL"].upper()
-        if level_str == "DEBUG":
-            level = logging.DEBUG
-        elif level_str == "INFO":
-            level = logging.INFO
-        elif level_str == "WARNING":
-            level = logging.WARNING
-        elif level_str == "ERROR":
-            level = logging.ERROR
-
-    logging.basicConfig(
-        level=level,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        handlers=[logging.StreamHandler(sys.stdout)]
+    # 如果环境变量中有合法的LOG_LEVEL，优先使用
+    level = logging.getLevelNamesMapping().get(
+        os.environ.get("LOG_LEVEL", "").upper(), level
     )
 
+    root = logging.getLogger()
+    if _LOG_HANDLER not in root.handlers:
+        logging.basicConfig(
+            handlers=[_LOG_HANDLER],
+            # 入口统一负责日志配置，覆盖任何在导入期间安装的处理器
+            force=True
+        )
+    root.setLevel(level)
 
-async def run_app():
-    """运行应用的异步函数"""
-    app = AzRayApp()
 
+def _event_loop_runner():
+    """获取事件循环运行函数，优先使用uvloop，不可用时退回标准asyncio"""
     try:
-        # 设置信号处理
-        app.setup_signal_handlers()
+        import uvloop
+    except ImportError:
+        return asyncio.run
+    return uvloop.run
+
 
-        # 初始化并启动
-        await app.initialize()
-        await app.start()
+async def run_app():
+    """运行应用的异步函数"""
+    # 延迟导入：解析参数（如--help）时无需加载Azure SDK
+    from src.app import AzRayApp
 
+    try:
+        # 退出上下文时自动停止应用（信号处理器在run_forever()中注册）
+        async with AzRayApp() as app:
+            await app.run_forever()
     except KeyboardInterrupt:
         logging.info("收到中断信号")
     except Exception as e:
-        logging.error(f"应用运行失败: {e}")
+        logging.error("应用运行失败: %s", e)
         sys.exit(1)
-    finally:
-        await app.stop()
 
 
 def main():
     """主函数"""
-    parser = argparse.ArgumentParser(
-        description="Azure V2Ray自动化部署和健康监控系统"
-    )
-    parser.add_argument(
-        "-v", "--verbose",
-        action="store_true",
-        help="启用详细日志输出"
-    )
-    parser.add_argument(
-        "--recreate",
-        action="store_true",
-        help="删除现有容器实例并重新创建（保留存储账户和其他资源）"
-    )
-
-    args = parser.parse_args()
+    # 先解析参数：--help/--version在此直接退出，不会导入应用模块
+    args = PARSER.parse_args()
 
     # 设置日志
     setup_logging(args.verbose)
@@ -93,12 +103,12 @@ def main():
 
     # 运行应用
     try:
-        asyncio.run(run_app())
+        _event_loop_runner()(run_app())
     except KeyboardInterrupt:
         logging.info("收到中断信号，正在退出...")
         sys.exit(0)
     except Exception as e:
-        logging.error(f"应用运行时出现错误: {e}")
+        logging.error("应用运行时出现错误: %s", e)
         sys.exit(1)
 
 
@@ -1,10 +1,14 @@
 """AZ-Ray: Azure V2Ray Proxy Solution"""
 
-from .app import AzRayApp
-from .config import Config
-from .azure_manager import AzureManager
-from .v2ray_manager import V2RayManager
-from .health_monitor import HealthMonitor
+import importlib
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from .app import AzRayApp
+    from .config import Config
+    from .azure_manager import AzureManager
+    from .v2ray_manager import V2RayManager
+    from .health_monitor import HealthMonitor
 
 __version__ = "1.0.0"
 __author__ = "AZ-Ray Development Team"
@@ -16,3 +20,21 @@ __all__ = [
     "V2RayManager",
     "HealthMonitor"
 ]
+
+# 导出名称 -> 所在子模块，首次访问时才导入（避免加载Azure SDK拖慢启动）
+_LAZY_EXPORTS = {
+    "AzRayApp": ".app",
+    "Config": ".config",
+    "AzureManager": ".azure_manager",
+    "V2RayManager": ".v2ray_manager",
+    "HealthMonitor": ".health_monitor",
+}
+
+
+def __getattr__(name: str) -> Any:
+    module_name = _LAZY_EXPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module_name, __name__), name)
+    globals()[name] = value
+    return value
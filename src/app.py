@@ -1,136 +1,234 @@
 import asyncio
 import logging
 import signal
-from typing import Optional
+from typing import Optional, Union
 
-from .azure_manager import AzureManager
-from .v2ray_manager import V2RayManager
-from .health_monitor import HealthMonitor
-from .config import Config
+from .config import Config, domain_file_digest
 from .file_watcher import FileWatcher
 
 logger = logging.getLogger(__name__)
 
 
+class _NullFileWatcher:
+    """未配置域名文件时使用的空监控器"""
+
+    __slots__ = ()
+
+    async def run(self):
+        pass
+
+    async def stop(self):
+        pass
+
+
 class AzRayApp:
     """主应用程序类"""
 
+    __slots__ = (
+        "config",
+        "azure_manager",
+        "v2ray_manager",
+        "health_monitor",
+        "file_watcher",
+        "_components",
+        "running",
+        "_stop_event",
+        "_stop_lock",
+        "_http_session",
+    )
+
     def __init__(self):
+        # 延迟导入重量级模块（Azure SDK、aiohttp），仅在创建应用时加载
+        from .azure_manager import AzureManager
+        from .v2ray_manager import V2RayManager
+        from .health_monitor import HealthMonitor
+
         self.config = Config()
-        self.azure_manager: Optional[AzureManager] = None
-        self.v2ray_manager: Optional[V2RayManager] = None
-        self.health_monitor: Optional[HealthMonitor] = None
-        self.file_watcher: Optional[FileWatcher] = None
+        # 各组件构造函数均为轻量同步操作，异步初始化在initialize()中完成
+        self.azure_manager = AzureManager(self.config)
+        self.v2ray_manager = V2RayManager(self.config, self.azure_manager)
+        self.health_monitor = HealthMonitor(
+            self.config,
+            self.azure_manager,
+            self.v2ray_manager
+        )
+        self.file_watcher: Union[FileWatcher, _NullFileWatcher] = (
+            FileWatcher(self.config.domain_file, self._on_domain_file_changed)
+            if self.config.domain_file
+            else _NullFileWatcher()
+        )
+        # 停止顺序：健康监控排在首位，确保其任务先被取消，不会在停止过程中重启V2Ray
+        self._components = (self.health_monitor, self.file_watcher, self.v2ray_manager)
         self.running = False
+        self._stop_event: Optional[asyncio.Event] = None
+        self._stop_lock = asyncio.Lock()
+        self._http_session = None
+
+    async def __aenter__(self) -> "AzRayApp":
+        try:
+            await self.initialize()
+        except BaseException:
+            # 初始化失败时不会进入__aexit__，在此释放Azure客户端
+            await self.azure_manager.close()
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        await self.stop()
+        await self.azure_manager.close()
 
     async def initialize(self):
         """初始化所有组件"""
         logger.info("正在初始化AZ-Ray应用...")
 
         try:
-            # 初始化Azure管理器
-            self.azure_manager = AzureManager(self.config)
+            # 初始化Azure客户端
             await self.azure_manager.initialize()
 
             # 确保Azure资源存在
             await self.azure_manager.ensure_resources()
 
-            # 初始化V2Ray管理器
-            self.v2ray_manager = V2RayManager(self.config, self.azure_manager)
+            # 初始化V2Ray管理器（依赖容器IP）
             await self.v2ray_manager.initialize()
 
-            # 初始化健康监控
-            self.health_monitor = HealthMonitor(
-                self.config,
-                self.azure_manager,
-                self.v2ray_manager
-            )
-
-            # 初始化域名文件监控
-            if self.config.domain_file:
-                self.file_watcher = FileWatcher(
-                    self.config.domain_file,
-                    self._on_domain_file_changed
-                )
+            # 创建经由本地SOCKS5代理的共享HTTP会话，注入到需要访问外网的组件
+            self._http_session = self._create_http_session()
+            self.health_monitor.http_session = self._http_session
 
             logger.info("所有组件初始化完成")
 
         except Exception as e:
-            logger.error(f"初始化失败: {e}")
+            logger.error("初始化失败: %s", e)
             raise
 
-    async def start(self):
-        """启动应用"""
+    async def run_forever(self):
+        """启动应用并保持运行，直到收到停止通知
+
+        各后台服务在同一个TaskGroup中运行：任一服务异常退出时，其余服务随之取消，
+        异常向上传播，不会出现部分服务已停止而应用仍挂起的情况。
+        """
         if self.running:
             logger.warning("应用已在运行")
             return
 
         logger.info("正在启动AZ-Ray应用...")
         self.running = True
+        # 必须在运行中的事件循环内创建
+        self._stop_event = asyncio.Event()
+        self._install_signal_handlers()
 
         try:
-            # 启动V2Ray代理
-            await self.v2ray_manager.start()
-
-            # 启动健康监控
-            await self.health_monitor.start()
-
-            # 启动域名文件监控
-            if self.file_watcher:
-                await self.file_watcher.start()
-
-            logger.info(f"AZ-Ray应用已启动，SOCKS5代理监听端口: {self.config.socks5_port}")
-
-            # 保持运行
-            while self.running:
-                await asyncio.sleep(1)
-
-        except Exception as e:
-            logger.error(f"运行时错误: {e}")
+            async with asyncio.TaskGroup() as tg:
+                # V2Ray代理与域名文件监控互不依赖，并发启动
+                tg.create_task(self.file_watcher.run())
+                tg.create_task(self._stop_when_requested(self._stop_event))
+                await self.v2ray_manager.start()
+
+                # V2Ray启动期间可能已收到停止通知，此时不再启动健康监控
+                if self.running:
+                    # 健康监控的首次检查依赖V2Ray已运行，需在其后启动
+                    tg.create_task(self.health_monitor.run())
+                    logger.info("AZ-Ray应用已启动，SOCKS5代理监听端口: %s", self.config.socks5_port)
+
+        except* Exception as eg:
+            for e in eg.exceptions:
+                logger.error("运行时错误: %s", e)
             raise
 
+    async def _stop_when_requested(self, stop_event: asyncio.Event):
+        """收到停止通知后停止各组件，使TaskGroup中的服务随之退出"""
+        await stop_event.wait()
+        await self.stop()
+
     async def stop(self):
-        """停止应用"""
-        if not self.running:
+        """停止应用（可重复调用，并发调用会等待首次停止完成）
+
+        应用已停止且没有进行中的停止时直接返回，该路径不会让出事件循环。
+        """
+        if not self.running and not self._stop_lock.locked():
             return
 
-        logger.info("正在停止AZ-Ray应用...")
-        self.running = False
+        async with self._stop_lock:
+            if not self.running:
+                return
 
-        # 停止健康监控
-        if self.health_monitor:
-            await self.health_monitor.stop()
+            logger.info("正在停止AZ-Ray应用...")
+            self.running = False
+            if self._stop_event:
+                self._stop_event.set()
 
-        # 停止域名文件监控
-        if self.file_watcher:
-            await self.file_watcher.stop()
+            # 健康监控、域名文件监控和V2Ray相互独立，并发停止
+            results = await asyncio.gather(
+                *(c.stop() for c in self._components), return_exceptions=True
+            )
+            for component, result in zip(self._components, results):
+                if isinstance(result, Exception):
+                    logger.error("停止%s失败: %s", type(component).__name__, result)
 
-        # 停止V2Ray
-        if self.v2ray_manager:
-            await self.v2ray_manager.stop()
+            if self._http_session is not None:
+                await self._http_session.close()
+                self._http_session = None
 
-        logger.info("AZ-Ray应用已停止")
+            logger.info("AZ-Ray应用已停止")
 
     async def _on_domain_file_changed(self):
         """域名文件变更回调"""
         try:
+            # 编辑器保存时常多次写入，内容与Config上次解析的相同则跳过重载和V2Ray重启
+            # （在线程中读取文件，不阻塞事件循环）
+            file_hash = await asyncio.to_thread(self._hash_domain_file)
+            if file_hash == self.config.domain_file_hash:
+                logger.debug("域名文件内容未变化，跳过重新加载")
+                return
+
             logger.info("检测到域名文件变更，正在重新加载...")
             
-            # 重新加载域名列表
-            self.config.reload_domain_list()
+            # 重新加载域名列表（内容已确认变化，不依赖修改时间判断）
+            self.config.reload_domain_list(force=True)
             
             # 异步重启V2Ray（使用新的域名列表）
-            if self.v2ray_manager:
-                await self.v2ray_manager.restart()
+            await self.v2ray_manager.restart()
                 
         except Exception as e:
-            logger.error(f"处理域名文件变更失败: {e}")
-
-    def setup_signal_handlers(self):
-        """设置信号处理器"""
-        def signal_handler(signum, frame):
-            logger.info(f"收到信号 {signum}，正在优雅关闭...")
-            asyncio.create_task(self.stop())
-
-        signal.signal(signal.SIGINT, signal_handler)
-        signal.signal(signal.SIGTERM, signal_handler)
+            logger.error("处理域名文件变更失败: %s", e)
+
+    def _create_http_session(self):
+        """创建经由本地SOCKS5代理、连接可复用的aiohttp会话"""
+        import aiohttp
+        from aiohttp_socks import ProxyConnector
+
+        return aiohttp.ClientSession(
+            connector=ProxyConnector.from_url(
+                f"socks5://127.0.0.1:{self.config.socks5_port}",
+                limit=10,
+                keepalive_timeout=60,
+            ),
+            timeout=aiohttp.ClientTimeout(total=30),
+        )
+
+    def _hash_domain_file(self) -> Optional[bytes]:
+        """计算域名文件内容的哈希，文件不可读时返回None"""
+        try:
+            with open(self.config.domain_file, "rb") as f:
+                return domain_file_digest(f.read())
+        except OSError:
+            return None
+
+    def _install_signal_handlers(self):
+        """在运行中的事件循环上注册信号处理器"""
+        loop = asyncio.get_running_loop()
+
+        def signal_handler(signum):
+            logger.info("收到信号 %s，正在优雅关闭...", signum)
+            if self._stop_event:
+                self._stop_event.set()
+
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, signal_handler, sig)
+            except NotImplementedError:
+                # Windows事件循环不支持add_signal_handler，退回到signal.signal
+                signal.signal(
+                    sig,
+                    lambda signum, frame: loop.call_soon_threadsafe(signal_handler, signum),
+                )
@@ -1,23 +1,133 @@
+import asyncio
 import json
 import logging
-import os
 import hashlib
-from typing import Optional, Dict, Any
-from azure.identity import ClientSecretCredential
-from azure.mgmt.containerinstance import ContainerInstanceManagementClient
-from azure.mgmt.resource import ResourceManagementClient
-from azure.mgmt.storage import StorageManagementClient
-from azure.storage.fileshare import ShareFileClient, ShareClient
-from azure.core.exceptions import ResourceNotFoundError
+import time
+from functools import cached_property
+from typing import Any, Dict, Optional, Tuple
+
+import aiohttp
+from azure.core.pipeline.transport import AioHttpTransport
+from azure.identity import TokenCachePersistenceOptions
+from azure.identity.aio import ClientSecretCredential
+from azure.mgmt.core.polling.async_arm_polling import AsyncARMPolling
+from azure.mgmt.containerinstance.aio import ContainerInstanceManagementClient
+from azure.mgmt.resource.resources.aio import ResourceManagementClient
+from azure.mgmt.storage.aio import StorageManagementClient
+from azure.storage.fileshare import ContentSettings
+from azure.storage.fileshare.aio import ShareClient, ShareFileClient, ShareServiceClient
+from azure.core.exceptions import (
+    ClientAuthenticationError,
+    HttpResponseError,
+    ResourceExistsError,
+    ResourceNotFoundError,
+    ServiceRequestError,
+    ServiceResponseError,
+)
+
+try:
+    import orjson
+except ImportError:  # 未安装orjson时退回标准库json
+    orjson = None  # type: ignore[assignment]
 
 from .config import Config
+from .key_cache import StorageKeyCache
 from .utils import retry_with_backoff
 
 logger = logging.getLogger(__name__)
 
+# 长时间运行操作（LRO）的默认轮询间隔（秒）；SDK默认30秒，服务端返回Retry-After时以其为准
+LRO_POLLING_INTERVAL = 2
+
+# 文件上传的分段大小（Azure Files单次写入范围的上限），小于该值的配置一次写入完成
+FILE_UPLOAD_RANGE_SIZE = 4 * 1024 * 1024
+# 文件超过一个分段时并发上传的分段数
+FILE_UPLOAD_CONCURRENCY = 4
+
+# 容器列表缓存的有效期（秒）
+CONTAINER_LIST_TTL = 30.0
+# 共享连接池的总连接数和单主机连接数下限（并发上限配置得更高时随之放大，避免在连接池上排队）
+HTTP_POOL_SIZE = 32
+HTTP_POOL_PER_HOST = 16
+# 本地缓存的存储账户密钥在该时间（秒）内保存的，视为账户可用，启动时跳过存储账户检查
+STORAGE_STATE_MAX_AGE = 60 * 60
+
+# Azure请求重试的随机抖动比例：延迟在1到1.5倍退避时间之间，避免多个请求同时重试再次触发限流
+RETRY_JITTER = 0.5
+
+# 可能可重试的Azure错误类型：网络请求失败、响应读取失败及HTTP错误响应（由_is_transient_azure_error进一步筛选）
+TRANSIENT_AZURE_ERRORS = (ServiceRequestError, ServiceResponseError, HttpResponseError)
+# 可重试的HTTP状态码（另加所有5xx）：请求超时和限流
+TRANSIENT_HTTP_STATUS = frozenset({408, 429})
+
+
+def _is_transient_azure_error(error: Exception) -> bool:
+    """判断Azure错误是否可重试：网络错误，或状态码为408/429/5xx的错误响应（其余4xx重试无意义）"""
+    if isinstance(error, HttpResponseError):
+        status = error.status_code
+        return status is not None and (status in TRANSIENT_HTTP_STATUS or status >= 500)
+    return isinstance(error, (ServiceRequestError, ServiceResponseError))
+
+
+def _is_retryable_file_share_error(error: Exception) -> bool:
+    """判断文件共享创建是否可重试：瞬时错误，以及认证失败（刷新密钥或等待文件服务后重试）"""
+    return isinstance(error, ClientAuthenticationError) or _is_transient_azure_error(error)
+
+
+def _retry_after_seconds(error: Exception) -> Optional[float]:
+    """读取Azure错误响应中的Retry-After（秒），没有或无法解析时返回None"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    value = response.headers.get("retry-after")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None  # HTTP日期格式，退回指数退避
+
+
+class _DropAll(logging.Filter):
+    """丢弃所有日志记录"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return False
+
+
+# 仅保留WARNING及以上级别的第三方记录器
+_QUIET_LOGGERS = (
+    "azure.core",  # Azure Core（含HTTP管道）
+    "azure.identity",  # Azure Identity
+    "azure.mgmt",  # Azure管理客户端
+    "azure.storage",  # Azure存储
+    "urllib3",  # urllib3（Azure SDK内部使用）
+    "msal",
+)
+_LOGS_SUPPRESSED = False
+
+
+def _suppress_azure_logs():
+    """抑制Azure SDK的详细日志（幂等，模块导入时调用一次）"""
+    global _LOGS_SUPPRESSED
+    if _LOGS_SUPPRESSED:
+        return
+    _LOGS_SUPPRESSED = True
+
+    for name in _QUIET_LOGGERS:
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    # HTTP请求/响应日志在级别判断之后仍会构造记录并格式化请求头，直接在记录器上丢弃
+    logging.getLogger("azure.core.pipeline.policies.http_logging_policy").addFilter(_DropAll())
+
+
+_suppress_azure_logs()
+
 
 class AzureManager:
-    """Azure资源管理器"""
+    """Azure资源管理器
+
+    使用Azure SDK的异步（aio）客户端，所有网络调用均不会阻塞事件循环。
+    可作为异步上下文管理器使用，退出时关闭客户端及其连接池。
+    """
 
     def __init__(self, config: Config):
         self.config = config
@@ -26,76 +136,162 @@ class AzureManager:
         self.storage_client: Optional[StorageManagementClient] = None
         self.container_client: Optional[ContainerInstanceManagementClient] = None
         self.storage_account_key: Optional[str] = None
+        # 存储账户密钥的本地加密缓存，命中时启动过程可省去list_keys请求
+        self._key_cache = StorageKeyCache(config.azure_client_secret)
+        # 进程内已获取的存储账户密钥（账户名 -> 密钥），避免重复调用受严格限流的list_keys
+        self._account_keys: Dict[str, str] = {}
+        # 本次启动新建了存储账户且尚未确认文件服务可用
+        self._storage_account_created = False
+        # 存储账户密钥取自最近的本地缓存，未经ARM检查确认
+        self._storage_account_unverified = False
+        # 存储账户的唯一名称：首次确保存储账户时由未加后缀的基础名称计算，之后复用
+        # （set_storage_account_name会改写配置中的名称，不能再次据此计算）
+        self._storage_name: Optional[str] = None
+        # 所有Azure客户端共享的aiohttp会话（连接池），在initialize()中创建
+        self._http_session: Optional[aiohttp.ClientSession] = None
+        self._transport: Optional[AioHttpTransport] = None
+        # 文件服务客户端在存储账户就绪后首次使用时创建，文件共享/文件客户端由其派生并共享同一管道
+        self._share_service: Optional[ShareServiceClient] = None
+        self._share_client: Optional[ShareClient] = None
+        self._file_client: Optional[ShareFileClient] = None
+        # 容器列表缓存：(查询时间, 容器列表)，并发查询在锁上合并为一次ARM请求
+        self._containers_cache: Optional[Tuple[float, list]] = None
+        self._containers_lock = asyncio.Lock()
+        # 当前使用中的容器组：(获取时间, 容器组)，创建或复用容器时写入，重启时失效
+        self._container_group_cache: Optional[Tuple[float, Any]] = None
+        # 限制并发的ARM写操作和文件共享请求，避免并发展开后触发限流（429）
+        self._arm_sem = asyncio.Semaphore(config.azure_max_concurrency)
+        self._storage_sem = asyncio.Semaphore(config.storage_max_concurrency)
 
     async def initialize(self):
         """初始化Azure客户端"""
         logger.info("正在初始化Azure客户端...")
 
-        # 抑制Azure SDK的详细日志
-        self._suppress_azure_logs()
+        # 获取订阅ID（如果未提供则使用默认）
+        if not self.config.azure_subscription_id:
+            # 这里可以添加获取默认订阅的逻辑
+            raise ValueError("需要提供AZURE_SUBSCRIPTION_ID")
+
+        # 已初始化时复用现有凭据、客户端和连接池，保留已缓存的访问令牌和TLS连接
+        if self.credential is not None:
+            logger.debug("Azure客户端已初始化，复用现有客户端")
+            return
+
+        # 共享连接池：各客户端复用TCP/TLS连接，避免每次请求重新握手
+        # （会话参数与SDK自建会话保持一致，由SDK负责解压响应）
+        self._http_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=max(HTTP_POOL_SIZE, self.config.azure_max_concurrency + self.config.storage_max_concurrency),
+                limit_per_host=max(HTTP_POOL_PER_HOST, self.config.storage_max_concurrency),
+                keepalive_timeout=60,
+                ttl_dns_cache=300,
+            ),
+            cookie_jar=aiohttp.DummyCookieJar(),
+            auto_decompress=False,
+            trust_env=True,
+        )
+        self._transport = AioHttpTransport(session=self._http_session, session_owner=False)
 
-        # 创建凭据
+        # 创建凭据（启用时访问令牌加密保存在系统密钥环中，进程重启后无需重新获取）
+        credential_options: Dict[str, Any] = {}
+        if self.config.persist_token_cache:
+            credential_options["cache_persistence_options"] = TokenCachePersistenceOptions(
+                name="az-ray", allow_unencrypted_storage=False
+            )
         self.credential = ClientSecretCredential(
             tenant_id=self.config.azure_tenant_id,
             client_id=self.config.azure_client_id,
             client_secret=self.config.azure_client_secret,
+            transport=self._transport,
+            **credential_options,
         )
 
-        # 获取订阅ID（如果未提供则使用默认）
-        if not self.config.azure_subscription_id:
-            # 这里可以添加获取默认订阅的逻辑
-            raise ValueError("需要提供AZURE_SUBSCRIPTION_ID")
-
         # 初始化管理客户端
         self.resource_client = ResourceManagementClient(
-            self.credential, self.config.azure_subscription_id
+            self.credential, self.config.azure_subscription_id, transport=self._transport
         )
         self.storage_client = StorageManagementClient(
-            self.credential, self.config.azure_subscription_id
+            self.credential, self.config.azure_subscription_id, transport=self._transport
         )
         self.container_client = ContainerInstanceManagementClient(
-            self.credential, self.config.azure_subscription_id
+            self.credential, self.config.azure_subscription_id, transport=self._transport
         )
 
         logger.info("Azure客户端初始化完成")
 
-    @staticmethod
-    def _suppress_azure_logs():
-        """抑制Azure SDK的详细日志"""
-        # Azure Core HTTP日志
-        logging.getLogger("azure.core.pipeline.policies.http_logging_policy").setLevel(
-            logging.WARNING
+    async def close(self):
+        """关闭所有Azure客户端、凭据和共享连接池（可重复调用）"""
+        clients = (
+            self._share_service,
+            self.container_client,
+            self.storage_client,
+            self.resource_client,
+            self.credential,
+            self._http_session,
         )
+        self._file_client = None
+        self._share_client = None
+        self._share_service = None
+        self.container_client = None
+        self.storage_client = None
+        self.resource_client = None
+        self.credential = None
+        self._http_session = None
+        self._transport = None
+
+        for client in clients:
+            if client is not None:
+                try:
+                    await client.close()
+                except Exception as e:
+                    logger.warning("关闭Azure客户端时出错: %s", e)
+
+    async def __aenter__(self) -> "AzureManager":
+        await self.initialize()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        await self.close()
 
-        # Azure Identity日志
-        logging.getLogger("azure.identity").setLevel(logging.WARNING)
-
-        # Azure管理客户端日志
-        logging.getLogger("azure.mgmt").setLevel(logging.WARNING)
-
-        # Azure存储日志
-        logging.getLogger("azure.storage").setLevel(logging.WARNING)
-
-        # urllib3日志（Azure SDK内部使用）
-        logging.getLogger("urllib3").setLevel(logging.WARNING)
-
-        # Azure Core日志
-        logging.getLogger("azure.core").setLevel(logging.WARNING)
-        logging.getLogger("urllib3").setLevel(logging.WARNING)
-
-        logging.getLogger("msal").setLevel(logging.WARNING)
+    @staticmethod
+    def _lro_polling() -> AsyncARMPolling:
+        """创建LRO轮询策略（轮询器有状态，每个操作需单独创建）"""
+        return AsyncARMPolling(timeout=LRO_POLLING_INTERVAL)
 
     async def ensure_resources(self):
         """确保所有必需的Azure资源存在"""
         logger.info("正在检查Azure资源...")
 
         # 如果指定了重新创建选项，先删除现有容器实例
-        if os.getenv("RECREATE_RESOURCES") == "true":
+        if self.config.recreate_resources:
             await self._clean_existing_container()
 
-        # 确保资源组存在
-        await self._ensure_resource_group()
+        # 现有容器查询与资源组检查、存储侧资源链（存储账户 -> 文件共享 -> 配置文件）互不依赖，
+        # 立即在后台开始（资源组尚不存在时查询结果为空，与实际情况一致）
+        containers_task = asyncio.create_task(self._find_existing_containers())
+
+        async def ensure_storage_chain() -> bool:
+            # 确保资源组存在
+            await self._ensure_resource_group()
+            return await self._ensure_storage_resources()
+
+        # 等待两者均结束，存储侧失败时不会遗留未完成的查询
+        config_updated, containers = await asyncio.gather(
+            ensure_storage_chain(), containers_task, return_exceptions=True
+        )
+        if isinstance(config_updated, BaseException):
+            raise config_updated
+        if isinstance(containers, BaseException):
+            # 查询失败时由后续步骤重新查询（再次失败则抛出异常，不会误判为没有容器而重复创建）
+            containers = None
 
+        # 确保容器实例存在
+        await self._ensure_container_instance(config_updated, containers)
+
+        logger.info("所有Azure资源检查完成")
+
+    async def _ensure_storage_resources(self) -> bool:
+        """依次确保存储账户、文件共享和V2Ray配置文件，返回配置是否有更新"""
         # 确保存储账户存在
         await self._ensure_storage_account()
 
@@ -103,75 +299,118 @@ class AzureManager:
         await self._ensure_file_share()
 
         # 确保V2Ray配置文件存在，并检查是否有更新
-        config_updated = await self._ensure_v2ray_config()
-
-        # 确保容器实例存在
-        await self._ensure_container_instance(config_updated)
-
-        logger.info("所有Azure资源检查完成")
+        return await self._ensure_v2ray_config()
 
     async def _clean_existing_container(self):
         """删除现有的容器实例（用于重新创建）"""
         logger.info("正在清理所有现有容器实例...")
+        # 重新创建时完整检查存储账户，不使用本地缓存的状态
+        await asyncio.to_thread(self._key_cache.clear)
         await self._cleanup_old_containers()
         logger.info("现有容器实例清理完成")
 
+    @retry_with_backoff(
+        max_attempts=4, base_delay=1.0, max_delay=30.0,
+        exceptions=TRANSIENT_AZURE_ERRORS, retry_if=_is_transient_azure_error,
+        retry_after=_retry_after_seconds, jitter=RETRY_JITTER,
+    )
     async def _ensure_resource_group(self):
         """确保资源组存在"""
         try:
-            self.resource_client.resource_groups.get(self.config.azure_resource_group)
-            logger.info(f"资源组 {self.config.azure_resource_group} 已存在")
+            await self.resource_client.resource_groups.get(self.config.azure_resource_group)
+            logger.info("资源组 %s 已存在", self.config.azure_resource_group)
         except ResourceNotFoundError:
-            logger.info(f"正在创建资源组 {self.config.azure_resource_group}...")
-            self.resource_client.resource_groups.create_or_update(
-                self.config.azure_resource_group,
-                {"location": self.config.azure_location},
-            )
-            logger.info(f"资源组 {self.config.azure_resource_group} 创建完成")
+            logger.info("正在创建资源组 %s...", self.config.azure_resource_group)
+            async with self._arm_sem:
+                await self.resource_client.resource_groups.create_or_update(
+                    self.config.azure_resource_group,
+                    {"location": self.config.azure_location},
+                )
+            logger.info("资源组 %s 创建完成", self.config.azure_resource_group)
 
-    @retry_with_backoff(max_attempts=30, base_delay=3.0)
     async def _wait_for_storage_account_ready(self, storage_name: str) -> str:
-        """等待存储账户完全就绪并返回访问密钥"""
+        """等待存储账户完全就绪并返回访问密钥
+
+        等待过程自身已重试；耗尽后瞬时错误转为RuntimeError抛出，
+        避免_ensure_storage_account的瞬时错误重试再次整体等待。
+        """
+        try:
+            return await self._poll_storage_account_ready(storage_name)
+        except Exception as e:
+            if _is_transient_azure_error(e):
+                raise RuntimeError(f"等待存储账户就绪失败: {e}") from e
+            raise
+
+    @retry_with_backoff(max_attempts=30, base_delay=2.0, max_delay=30.0)
+    async def _poll_storage_account_ready(self, storage_name: str) -> str:
+        """检查存储账户是否就绪并返回访问密钥，尚未就绪时重试"""
 
         # 1. 检查存储账户状态
-        props = self.storage_client.storage_accounts.get_properties(  # type: ignore[union-attr]
+        props = await self.storage_client.storage_accounts.get_properties(  # type: ignore[union-attr]
             self.config.azure_resource_group, storage_name
         )
         if props.provisioning_state != "Succeeded":
             raise RuntimeError(f"存储账户状态: {props.provisioning_state}")
 
-        # 2. 尝试获取密钥
-        keys = self.storage_client.storage_accounts.list_keys(  # type: ignore[union-attr]
-            self.config.azure_resource_group, storage_name
-        )
-        if not keys.keys:
-            raise RuntimeError("存储账户密钥不可用")
+        # 2. 尝试获取密钥（重试时复用已获取的密钥）
+        key = await self._get_storage_account_key(storage_name)
 
         # 3. 测试文件服务可用性
-        share_client = ShareClient(
+        await self._probe_file_service(storage_name, key)
+        return key
+
+    @retry_with_backoff(max_attempts=30, base_delay=2.0, max_delay=30.0)
+    async def _wait_for_file_service(self, storage_name: str, key: str):
+        """等待存储账户的文件服务可用"""
+        await self._probe_file_service(storage_name, key)
+
+    async def _probe_file_service(self, storage_name: str, key: str):
+        """探测文件服务是否可响应，尚未就绪时抛出RuntimeError"""
+        async with ShareClient(
             account_url=f"https://{storage_name}.file.core.windows.net",
             share_name="__readiness_test__",
-            credential=keys.keys[0].value,
-        )
-        try:
-            share_client.get_share_properties()
-        except ResourceNotFoundError:
-            pass  # 预期的 - 说明服务可响应
-        except Exception as e:
-            if "AuthenticationFailed" in str(e):
-                raise RuntimeError("存储账户认证失败，尚未就绪")
-            # 其他错误可能也表示服务可用
-        
-        return keys.keys[0].value  # type: ignore[return-value]
-
-    async def _ensure_storage_account(self):
-        """确保存储账户存在并完全可用"""
-        storage_name = self.config.get_unique_storage_name()
-        logger.info(f"确保存储账户: {storage_name}")
+            credential=key,
+            transport=self._transport,
+        ) as share_client:
+            try:
+                await share_client.get_share_properties()
+            except ResourceNotFoundError:
+                pass  # 预期的 - 说明服务可响应
+            except Exception as e:
+                if "AuthenticationFailed" in str(e):
+                    raise RuntimeError("存储账户认证失败，尚未就绪")
+                # 其他错误可能也表示服务可用
+
+    @retry_with_backoff(
+        max_attempts=4, base_delay=1.0, max_delay=30.0,
+        exceptions=TRANSIENT_AZURE_ERRORS, retry_if=_is_transient_azure_error,
+        retry_after=_retry_after_seconds, jitter=RETRY_JITTER,
+    )
+    async def _ensure_storage_account(self, use_cache: bool = True):
+        """确保存储账户存在并完全可用
+
+        use_cache为True时，最近确认过的存储账户直接使用本地缓存的密钥，不发起ARM请求。
+        """
+        if self._storage_name is None:
+            self._storage_name = self.config.get_unique_storage_name()
+        storage_name = self._storage_name
+        logger.info("确保存储账户: %s", storage_name)
+
+        cached = await asyncio.to_thread(self._key_cache.load_with_age, storage_name) if use_cache else None
+        if cached and cached[1] < STORAGE_STATE_MAX_AGE:
+            # 最近确认过的存储账户直接使用缓存的密钥，不发起任何ARM请求
+            # （文件共享操作首次失败时清除缓存，回退到完整的存储账户检查）
+            logger.info("使用最近缓存的存储账户密钥，跳过存储账户检查")
+            self._account_keys[storage_name] = cached[0]
+            self.storage_account_key = cached[0]
+            self._storage_account_unverified = True
+            self.config.set_storage_account_name(storage_name)
+            return
+        self._storage_account_unverified = False
 
         try:
             # 检查是否已存在
-            props = self.storage_client.storage_accounts.get_properties(
+            props = await self.storage_client.storage_accounts.get_properties(  # type: ignore[union-attr]
                 self.config.azure_resource_group, storage_name
             )
             logger.info("存储账户已存在，验证可用性...")
@@ -182,103 +421,214 @@ class AzureManager:
                     storage_name
                 )
             else:
-                # 直接获取密钥
-                keys = self.storage_client.storage_accounts.list_keys(
-                    self.config.azure_resource_group, storage_name
-                )
-                self.storage_account_key = keys.keys[0].value
+                # 优先使用已获取或本地缓存的密钥（失效时由文件共享操作的认证失败触发刷新）
+                cached_key = self._account_keys.get(storage_name) or (cached[0] if cached else None)
+                if cached_key:
+                    logger.info("使用缓存的存储账户密钥")
+                    self._account_keys[storage_name] = cached_key
+                    self.storage_account_key = cached_key
+                else:
+                    # 直接获取密钥
+                    self.storage_account_key = await self._get_storage_account_key(storage_name)
 
         except ResourceNotFoundError:
             logger.info("创建存储账户...")
-            poller = self.storage_client.storage_accounts.begin_create(
-                self.config.azure_resource_group,
-                storage_name,
-                {
-                    "sku": {"name": "Standard_LRS"},
-                    "kind": "StorageV2",
-                    "location": self.config.azure_location,
-                    "encryption": {
-                        "services": {"file": {"enabled": True}},
-                        "key_source": "Microsoft.Storage",
+            async with self._arm_sem:
+                poller = await self.storage_client.storage_accounts.begin_create(  # type: ignore[union-attr, call-overload]
+                    self.config.azure_resource_group,
+                    storage_name,
+                    {
+                        "sku": {"name": "Standard_LRS"},
+                        "kind": "StorageV2",
+                        "location": self.config.azure_location,
+                        "encryption": {
+                            "services": {"file": {"enabled": True}},
+                            "key_source": "Microsoft.Storage",
+                        },
                     },
-                },
-            )
-            poller.wait()  # 等待ARM部署完成
-            logger.info("等待存储账户完全就绪...")
-            self.storage_account_key = await self._wait_for_storage_account_ready(
-                storage_name
-            )
+                    polling=self._lro_polling(),
+                )
+            account = await poller.result()  # 等待ARM部署完成
+            if account.provisioning_state == "Succeeded":
+                # LRO已确认预配成功：只获取密钥，文件服务是否就绪由首个文件共享请求验证
+                self.storage_account_key = await self._get_storage_account_key(storage_name)
+                self._storage_account_created = True
+            else:
+                logger.info("等待存储账户完全就绪...")
+                self.storage_account_key = await self._wait_for_storage_account_ready(storage_name)
 
-        self.config.storage_account_name = storage_name
+        self.config.set_storage_account_name(storage_name)
+        # 每次确认存储账户后都重新保存，刷新缓存时间
+        await asyncio.to_thread(self._key_cache.save, storage_name, self.storage_account_key)
         logger.info("存储账户已就绪")
 
-    @retry_with_backoff(max_attempts=3, base_delay=2.0)
+    @retry_with_backoff(
+        max_attempts=3, base_delay=2.0,
+        exceptions=TRANSIENT_AZURE_ERRORS, retry_if=_is_retryable_file_share_error,
+        retry_after=_retry_after_seconds, jitter=RETRY_JITTER,
+    )
     async def _ensure_file_share(self):
         """确保文件共享存在"""
-        account_url = (
-            f"https://{self.config.storage_account_name}.file.core.windows.net"
-        )
-        logger.info(f"确保文件共享: {self.config.storage_file_share_name}")
-
-        share_client = ShareClient(
-            account_url=account_url,
-            share_name=self.config.storage_file_share_name,
-            credential=self.storage_account_key,
-        )
+        logger.info("确保文件共享: %s", self.config.storage_file_share_name)
 
+        # 直接创建，已存在时忽略：无论冷热路径都只需一次往返
         try:
-            properties = share_client.get_share_properties()
-            logger.info(f"文件共享已存在，配额: {properties.quota}GB")
-        except ResourceNotFoundError:
-            logger.info("创建文件共享...")
-            share_client.create_share(quota=1)
+            async with self._storage_sem:
+                await self._get_share_client().create_share(quota=1)
             logger.info("文件共享创建完成 (配额: 1GB)")
-
-    @retry_with_backoff(max_attempts=3, base_delay=1.0)
-    async def _ensure_v2ray_config(self) -> bool:
-        """确保V2Ray配置文件存在并是最新的，返回是否有更新"""
-        account_url = (
-            f"https://{self.config.storage_account_name}.file.core.windows.net"
+        except ResourceExistsError:
+            logger.info("文件共享已存在")
+        except (ClientAuthenticationError, ServiceRequestError) as e:
+            if self._storage_account_created:
+                # 新建存储账户的文件服务可能尚未就绪：此时才探测等待，之后由重试装饰器重试
+                logger.info("新建存储账户的文件服务尚未就绪，等待中...")
+                self._storage_account_created = False
+                await self._wait_for_file_service(
+                    self.config.storage_account_name, self.storage_account_key
+                )
+            elif self._storage_account_unverified:
+                # 缓存的存储账户可能已被删除或密钥已轮换：清除缓存，完整检查存储账户后由重试装饰器重试
+                logger.warning("使用缓存密钥访问文件共享失败，正在重新检查存储账户...")
+                self._storage_account_unverified = False
+                self._account_keys.pop(self.config.storage_account_name, None)
+                await asyncio.to_thread(self._key_cache.clear)
+                await self._close_share_clients()
+                await self._ensure_storage_account(use_cache=False)
+            elif isinstance(e, ClientAuthenticationError):
+                # 访问密钥可能已轮换：立即刷新密钥和客户端，由重试装饰器使用新凭据重试
+                logger.warning("文件共享认证失败，正在刷新存储账户密钥...")
+                await self._refresh_storage_account_key()
+            raise
+
+    async def _get_storage_account_key(self, storage_name: str, refresh: bool = False) -> str:
+        """获取存储账户的访问密钥（进程内只获取一次，refresh为True时重新获取）"""
+        key = None if refresh else self._account_keys.get(storage_name)
+        if key is None:
+            async with self._arm_sem:
+                keys = await self.storage_client.storage_accounts.list_keys(  # type: ignore[union-attr]
+                    self.config.azure_resource_group, storage_name
+                )
+            if not keys.keys:
+                raise RuntimeError("存储账户密钥不可用")
+            key = keys.keys[0].value  # type: ignore[index]
+            self._account_keys[storage_name] = key
+        return key
+
+    async def _refresh_storage_account_key(self):
+        """重新获取存储账户密钥，并丢弃使用旧密钥创建的文件共享客户端"""
+        self.storage_account_key = await self._get_storage_account_key(
+            self.config.storage_account_name, refresh=True
         )
-
-        file_client = ShareFileClient(
-            account_url=account_url,
-            share_name=self.config.storage_file_share_name,
-            file_path=self.config.storage_file_name,
-            credential=self.storage_account_key,
+        await asyncio.to_thread(
+            self._key_cache.save, self.config.storage_account_name, self.storage_account_key
         )
+        await self._close_share_clients()
+
+    async def _close_share_clients(self):
+        """丢弃使用旧密钥创建的文件共享客户端，下次使用时重新创建"""
+        stale_service = self._share_service
+        self._share_service = None
+        self._share_client = None
+        self._file_client = None
+        if stale_service is not None:
+            await stale_service.close()
+
+    def _get_share_service_client(self) -> ShareServiceClient:
+        """获取文件服务客户端（首次调用时创建，之后复用）"""
+        if self._share_service is None:
+            self._share_service = ShareServiceClient(
+                account_url=self.config.file_endpoint_url,
+                credential=self.storage_account_key,
+                transport=self._transport,
+                max_range_size=FILE_UPLOAD_RANGE_SIZE,
+            )
+        return self._share_service
 
-        # 生成期望的配置内容
-        expected_config = self._generate_v2ray_config()
-        expected_config_json = json.dumps(expected_config, sort_keys=True)
-        expected_hash = hashlib.sha256(expected_config_json.encode('utf-8')).hexdigest()
+    def _get_share_client(self) -> ShareClient:
+        """获取文件共享客户端（由文件服务客户端派生，之后复用）"""
+        if self._share_client is None:
+            self._share_client = self._get_share_service_client().get_share_client(
+                self.config.storage_file_share_name
+            )
+        return self._share_client
+
+    def _get_file_client(self) -> ShareFileClient:
+        """获取V2Ray配置文件客户端（由文件共享客户端派生，之后复用）"""
+        if self._file_client is None:
+            self._file_client = self._get_share_client().get_file_client(self.config.storage_file_name)
+        return self._file_client
+
+    @retry_with_backoff(
+        max_attempts=3, base_delay=1.0,
+        exceptions=TRANSIENT_AZURE_ERRORS, retry_if=_is_transient_azure_error,
+        retry_after=_retry_after_seconds, jitter=RETRY_JITTER,
+    )
+    async def _ensure_v2ray_config(self) -> bool:
+        """确保V2Ray配置文件存在并是最新的，返回是否有更新"""
+        # 期望的配置内容（已按规范格式序列化）及其MD5
+        config_bytes = self._v2ray_config_bytes
+        expected_md5 = self._v2ray_config_md5
+        file_client = self._get_file_client()
 
-        # 检查当前存储中的配置
+        # 通过文件属性中的Content-MD5判断是否需要更新，无需下载文件内容
         try:
-            current_config_content = await self._get_current_config_from_storage()
-            if current_config_content is not None:
-                current_config_json = json.dumps(current_config_content, sort_keys=True)
-                current_hash = hashlib.sha256(current_config_json.encode('utf-8')).hexdigest()
-                
-                if expected_hash == current_hash:
-                    logger.info(f"V2Ray配置文件已是最新 (哈希: {expected_hash[:16]}...)")
-                    return False  # 没有更新
-                else:
-                    logger.info(f"V2Ray配置文件需要更新 (当前: {current_hash[:16]}..., 期望: {expected_hash[:16]}...)")
-            else:
-                logger.info("V2Ray配置文件不存在，需要创建")
+            async with self._storage_sem:
+                properties = await file_client.get_file_properties()
+            stored_md5 = properties.content_settings.content_md5
+            if stored_md5 is not None and bytes(stored_md5) == expected_md5:
+                logger.info("V2Ray配置文件已是最新 (MD5: %s)", expected_md5.hex())
+                return False  # 没有更新
+            if stored_md5 is None and await self._stored_config_matches(config_bytes):
+                # 旧版本上传的文件没有Content-MD5：内容一致时补写，下次启动即可直接比较
+                logger.info("V2Ray配置文件已是最新，补写Content-MD5")
+                async with self._storage_sem:
+                    await file_client.set_http_headers(
+                        content_settings=ContentSettings(content_md5=bytearray(expected_md5))
+                    )
+                return False  # 没有更新
+            logger.info("V2Ray配置文件需要更新 (期望MD5: %s)", expected_md5.hex())
+        except ResourceNotFoundError:
+            logger.info("V2Ray配置文件不存在，需要创建")
         except Exception as e:
-            logger.warning(f"检查现有配置时出错: {e}，将重新上传配置")
+            logger.warning("检查现有配置时出错: %s，将重新上传配置", e)
 
-        # 上传新的配置文件
+        # 上传新的配置文件，同时写入Content-MD5供下次比较
         logger.info("正在上传V2Ray配置文件...")
-        config_json_formatted = json.dumps(expected_config, indent=2)
-        config_bytes = config_json_formatted.encode("utf-8")
-
-        file_client.upload_file(data=config_bytes, length=len(config_bytes))
-        logger.info(f"V2Ray配置文件上传完成，大小: {len(config_bytes)} bytes")
+        async with self._storage_sem:
+            await file_client.upload_file(
+                data=config_bytes,
+                length=len(config_bytes),
+                content_settings=ContentSettings(content_md5=bytearray(expected_md5)),
+                max_concurrency=FILE_UPLOAD_CONCURRENCY,
+            )
+        logger.info("V2Ray配置文件上传完成，大小: %s bytes", len(config_bytes))
         return True  # 有更新
 
+    async def _stored_config_matches(self, config_bytes: bytes) -> bool:
+        """下载存储中的配置，按规范格式重新序列化后与期望内容比较（与存储中的排版无关）"""
+        current_config_content = await self._get_current_config_from_storage()
+        return current_config_content is not None and self._dump_config(current_config_content) == config_bytes
+
+    @cached_property
+    def _v2ray_config_bytes(self) -> bytes:
+        """V2Ray服务器配置的序列化结果（配置在进程生命周期内不变，只生成一次）"""
+        return self._dump_config(self._generate_v2ray_config())
+
+    @cached_property
+    def _v2ray_config_md5(self) -> bytes:
+        """V2Ray服务器配置的MD5，与存储文件属性中的Content-MD5比较"""
+        return hashlib.md5(self._v2ray_config_bytes, usedforsecurity=False).digest()
+
+    @staticmethod
+    def _dump_config(config: Dict[str, Any]) -> bytes:
+        """将配置序列化为紧凑、键有序的JSON（配置文件仅供程序读取，无需缩进）
+
+        优先使用orjson；两种实现对纯ASCII的配置输出相同的字节，存储中的Content-MD5不受影响。
+        """
+        if orjson is not None:
+            return orjson.dumps(config, option=orjson.OPT_SORT_KEYS)
+        return json.dumps(config, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
     def _generate_v2ray_config(self) -> Dict[str, Any]:
         """生成V2Ray服务器配置"""
         return {
@@ -303,31 +653,34 @@ class AzureManager:
             "outbounds": [{"protocol": "freedom", "settings": {}}],
         }
 
-    async def _ensure_container_instance(self, config_updated: bool = False):
-        """确保容器实例存在"""
+    async def _ensure_container_instance(
+        self, config_updated: bool = False, containers: Optional[list] = None
+    ):
+        """确保容器实例存在（containers为预先查询到的容器列表，未提供时重新查询）"""
         # 如果是重新创建模式，直接创建新容器（旧的已经被清理了）
-        if os.getenv("RECREATE_RESOURCES") == "true":
+        if self.config.recreate_resources:
             new_container_name = await self._create_new_container_instance()
             # 更新配置中的容器名称以供后续使用
             self.config.container_group_name = new_container_name
             return
 
         # 检查是否有现有的活跃容器
-        active_container = await self._get_active_container(config_updated)
+        active_container = await self._get_active_container(config_updated, containers)
         if active_container:
-            logger.info(f"找到符合要求的活跃容器实例: {active_container.name} (位置: {active_container.location})")
+            logger.info("找到符合要求的活跃容器实例: %s (位置: %s)", active_container.name, active_container.location)
             
             # 检查容器状态
             if not active_container.ip_address or not active_container.ip_address.ip:
                 logger.info("容器实例未分配IP地址，创建新的容器实例...")
                 new_container_name = await self._create_new_container_instance()
                 # 清理旧容器
-                await self._cleanup_old_containers(keep_current=new_container_name)
+                await self._cleanup_old_containers(keep_current=new_container_name, containers=containers)
                 self.config.container_group_name = new_container_name
             else:
                 # 使用现有的活跃容器
-                logger.info(f"复用现有容器实例，IP: {active_container.ip_address.ip}")
+                logger.info("复用现有容器实例，IP: %s", active_container.ip_address.ip)
                 self.config.container_group_name = active_container.name
+                self._container_group_cache = (time.monotonic(), active_container)
         else:
             logger.info("没有找到现有容器实例，正在创建新的...")
             new_container_name = await self._create_new_container_instance()
@@ -336,23 +689,26 @@ class AzureManager:
     async def restart_container(self):
         """重启容器实例（通过创建新容器实现）"""
         logger.info("正在通过创建新容器来重启...")
+        self._container_group_cache = None
         
         old_container_name = self.config.container_group_name
+        # 创建前记录现有容器（通常命中缓存），创建后直接清理这些容器，无需再次查询
+        old_containers = await self._find_existing_containers()
         new_container_name = await self._create_new_container_instance()
         
         # 更新配置中的容器名称
         self.config.container_group_name = new_container_name
         
         # 异步清理旧容器
-        await self._cleanup_old_containers(keep_current=new_container_name)
+        await self._cleanup_old_containers(keep_current=new_container_name, containers=old_containers)
         
-        logger.info(f"容器重启完成: {old_container_name} -> {new_container_name}")
+        logger.info("容器重启完成: %s -> %s", old_container_name, new_container_name)
 
     async def get_container_ip(self) -> Optional[str]:
         """获取当前活跃容器的IP地址"""
         try:
-            # 获取当前活跃的容器
-            active_container = await self._get_active_container()
+            # 获取当前活跃的容器（通常直接使用创建或复用时记录的容器组）
+            active_container = await self._get_container_group()
             if not active_container:
                 return None
                 
@@ -360,8 +716,42 @@ class AzureManager:
         except Exception:
             return None
 
-    async def _find_existing_containers(self) -> list:
-        """查找所有带有指定前缀的容器实例"""
+    async def _get_container_group(self, force: bool = False, max_age: float = CONTAINER_LIST_TTL):
+        """获取当前使用中的容器组，max_age秒内直接返回记录的结果（force为True时重新查询）"""
+        if not force and self._container_group_cache is not None:
+            fetched_at, container_group = self._container_group_cache
+            if time.monotonic() - fetched_at < max_age:
+                return container_group
+
+        container_group = await self._get_active_container()
+        self._container_group_cache = (
+            (time.monotonic(), container_group) if container_group is not None else None
+        )
+        return container_group
+
+    async def _find_existing_containers(self, max_age: float = CONTAINER_LIST_TTL) -> list:
+        """查找所有带有指定前缀的容器实例
+
+        结果缓存max_age秒，并发调用只发起一次查询；创建或删除容器后缓存失效。
+        查询失败时抛出异常（不缓存），避免被当作没有容器而重复创建容器组。
+        """
+        async with self._containers_lock:
+            if self._containers_cache is not None:
+                fetched_at, containers = self._containers_cache
+                if time.monotonic() - fetched_at < max_age:
+                    return list(containers)
+
+            listed = await self._list_containers()
+            self._containers_cache = (time.monotonic(), listed)
+            # 返回副本，调用方排序等操作不影响缓存
+            return list(listed)
+
+    def _invalidate_container_cache(self):
+        """容器发生变化后丢弃缓存的容器列表"""
+        self._containers_cache = None
+
+    async def _list_containers(self) -> list:
+        """从Azure查询带有指定前缀的容器实例（出错时记录警告并抛出异常）"""
         try:
             prefix = self.config.get_container_name_prefix()
             containers = []
@@ -371,18 +761,21 @@ class AzureManager:
                 self.config.azure_resource_group
             )
             
-            for container_group in container_groups:
+            async for container_group in container_groups:
                 if container_group.name.startswith(prefix):  # type: ignore[union-attr]
                     containers.append(container_group)
             
             return containers
         except Exception as e:
-            logger.warning(f"查找现有容器时出错: {e}")
-            return []
+            logger.warning("查找现有容器时出错: %s", e)
+            raise
 
-    async def _get_active_container(self, config_updated: bool = False):
+    async def _get_active_container(
+        self, config_updated: bool = False, containers: Optional[list] = None
+    ):
         """获取当前活跃且符合要求的容器实例"""
-        containers = await self._find_existing_containers()
+        if containers is None:
+            containers = await self._find_existing_containers()
         if not containers:
             return None
         
@@ -394,16 +787,16 @@ class AzureManager:
         
         # 检查1：位置是否匹配
         if not await self._is_container_location_valid(latest_container):
-            logger.info(f"容器 {latest_container.name} 位置不匹配 "
-                        f"(当前: {latest_container.location}, 期望: {self.config.azure_location})，需要重新创建")
+            logger.info("容器 %s 位置不匹配 (当前: %s, 期望: %s)，需要重新创建",
+                        latest_container.name, latest_container.location, self.config.azure_location)
             return None
             
         # 检查2：如果配置文件有更新，需要重新创建容器
         if config_updated:
-            logger.info(f"容器 {latest_container.name} 配置已更新，需要重新创建")
+            logger.info("容器 %s 配置已更新，需要重新创建", latest_container.name)
             return None
             
-        logger.info(f"容器 {latest_container.name} 符合要求，可以复用")
+        logger.info("容器 %s 符合要求，可以复用", latest_container.name)
         return latest_container
 
     async def _is_container_location_valid(self, container) -> bool:
@@ -413,16 +806,10 @@ class AzureManager:
     async def _get_current_config_from_storage(self) -> Optional[Dict[str, Any]]:
         """从Azure存储中获取当前的配置文件内容"""
         try:
-            file_client = ShareFileClient(
-                account_url=f"https://{self.config.storage_account_name}.file.core.windows.net",
-                share_name=self.config.storage_file_share_name,
-                file_path=self.config.storage_file_name,
-                credential=self.storage_account_key,
-            )
-            
             # 下载配置文件
-            download_stream = file_client.download_file()
-            config_content = download_stream.readall().decode('utf-8')
+            async with self._storage_sem:
+                download_stream = await self._get_file_client().download_file()
+                config_content = (await download_stream.readall()).decode('utf-8')
             
             # 解析JSON
             return json.loads(config_content)
@@ -431,30 +818,36 @@ class AzureManager:
             logger.info("存储中未找到配置文件")
             return None
         except Exception as e:
-            logger.warning(f"获取存储配置文件时出错: {e}")
+            logger.warning("获取存储配置文件时出错: %s", e)
             return None
 
-    async def _cleanup_old_containers(self, keep_current: Optional[str] = None):  # type: ignore[assignment]
-        """清理旧的容器实例，保留当前指定的容器"""
-        containers = await self._find_existing_containers()
+    async def _cleanup_old_containers(
+        self, keep_current: Optional[str] = None, containers: Optional[list] = None
+    ):
+        """清理旧的容器实例，保留当前指定的容器（containers为已知的容器列表，未提供时重新查询）"""
+        if containers is None:
+            containers = await self._find_existing_containers()
         
         for container in containers:
             if keep_current and container.name == keep_current:
                 continue
                 
-            logger.info(f"清理旧容器实例: {container.name}")
+            logger.info("清理旧容器实例: %s", container.name)
             try:
-                # 异步删除，不等待完成
-                self.container_client.container_groups.begin_delete(  # type: ignore[union-attr]
-                    self.config.azure_resource_group, container.name
-                )
+                # 发起删除，不等待完成
+                async with self._arm_sem:
+                    await self.container_client.container_groups.begin_delete(  # type: ignore[union-attr]
+                        self.config.azure_resource_group, container.name
+                    )
             except Exception as e:
-                logger.warning(f"删除容器 {container.name} 时出错: {e}")
+                logger.warning("删除容器 %s 时出错: %s", container.name, e)
+
+        self._invalidate_container_cache()
 
     async def _create_new_container_instance(self) -> str:
         """创建新的容器实例，返回容器名称"""
         new_container_name = self.config.get_unique_container_name()
-        logger.info(f"正在创建新容器实例: {new_container_name}")
+        logger.info("正在创建新容器实例: %s", new_container_name)
         
         container_group = {
             "location": self.config.azure_location,
@@ -493,14 +886,21 @@ class AzureManager:
             "restart_policy": "Always",
         }
 
-        poller = self.container_client.container_groups.begin_create_or_update(  # type: ignore[union-attr, call-overload]
-            self.config.azure_resource_group,
-            new_container_name,
-            container_group,
-        )
+        # 只在发起请求时占用信号量，轮询等待期间不占用
+        container_groups = self.container_client.container_groups  # type: ignore[union-attr]
+        async with self._arm_sem:
+            poller = await container_groups.begin_create_or_update(  # type: ignore[call-overload]
+                self.config.azure_resource_group,
+                new_container_name,
+                container_group,
+                polling=self._lro_polling(),
+            )
 
-        result = poller.result()
+        result = await poller.result()
+        self._invalidate_container_cache()
+        # 创建结果即为当前容器组（含IP地址），后续获取IP时无需再次查询
+        self._container_group_cache = (time.monotonic(), result)
         ip = result.ip_address.ip if result.ip_address else "未分配"
-        logger.info(f"容器实例创建完成: {new_container_name}, IP: {ip}")
+        logger.info("容器实例创建完成: %s, IP: %s", new_container_name, ip)
         
         return new_container_name
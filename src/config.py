@@ -1,10 +1,30 @@
+import hashlib
+import mmap
 import os
+import re
 import uuid
 import logging
 import time
 from dataclasses import dataclass
+from functools import cached_property
 from typing import Optional
 
+# 域名格式（在模块导入时编译一次）
+_DOMAIN_PATTERN = re.compile(
+    r'^[a-zA-Z0-9]([a-zA-Z0-9\-]{0,61}[a-zA-Z0-9])?(\.[a-zA-Z0-9]([a-zA-Z0-9\-]{0,61}[a-zA-Z0-9])?)*$'
+)
+# 域名文件达到该大小时改用内存映射读取
+_MMAP_MIN_SIZE = 1 << 20
+# 加载域名文件时警告中最多列出的无效域名数量
+_MAX_INVALID_DOMAINS_LOGGED = 10
+# 布尔开关类环境变量视为开启的取值（不区分大小写）
+_TRUE_VALUES = ("true", "1", "yes")
+
+
+def domain_file_digest(data: bytes) -> bytes:
+    """计算域名文件内容的摘要，用于判断文件内容是否变化"""
+    return hashlib.blake2b(data, digest_size=16).digest()
+
 
 @dataclass
 class Config:
@@ -35,7 +55,11 @@ class Config:
     socks5_port: int = 1080
     http_port: int = 1081
     health_check_interval: int = 600  # 10分钟
+    azure_max_concurrency: int = 8  # 同时进行的ARM写操作上限
+    storage_max_concurrency: int = 16  # 同时进行的文件共享请求上限
     verbose: bool = False  # 详细日志输出
+    recreate_resources: bool = False  # 启动时删除现有容器实例并重新创建
+    persist_token_cache: bool = False  # 在系统密钥环中持久化Azure访问令牌，重启后复用
 
     # 转发域名列表
     domain_list: Optional[list[str]] = None
@@ -43,27 +67,41 @@ class Config:
     # 额外转发域名文件路径
     domain_file: Optional[str] = None
 
+    # 转发域名集合，用于O(1)成员判断
+    domain_set: frozenset[str] = frozenset()
+
+    # 上次加载的域名文件内容摘要（与解析的是同一份数据）
+    domain_file_hash: Optional[bytes] = None
+
     def __init__(self):
+        # 一次性读取环境变量快照，之后的查找均在普通字典上进行
+        env = dict(os.environ)
+
         # 存储域名文件路径
-        self.domain_file = os.getenv("DOMAIN_FILE")
+        self.domain_file = env.get("DOMAIN_FILE")
+        # 上次加载时域名文件的修改时间，用于跳过无变化的重新加载
+        self._domain_file_mtime_ns: Optional[int] = None
         
         # 从环境变量读取必需配置
-        self.azure_client_id = self._get_env_required("AZURE_CLIENT_ID")
-        self.azure_client_secret = self._get_env_required(
-            "AZURE_CLIENT_SECRET")
-        self.azure_tenant_id = self._get_env_required("AZURE_TENANT_ID")
-        self.azure_subscription_id = self._get_env_required("AZURE_SUBSCRIPTION_ID")
-        self.v2ray_client_id = self._get_env_required("V2RAY_CLIENT_ID")
+        self.azure_client_id = self._get_env_required(env, "AZURE_CLIENT_ID")
+        self.azure_client_secret = self._get_env_required(env, "AZURE_CLIENT_SECRET")
+        self.azure_tenant_id = self._get_env_required(env, "AZURE_TENANT_ID")
+        self.azure_subscription_id = self._get_env_required(env, "AZURE_SUBSCRIPTION_ID")
+        self.v2ray_client_id = self._get_env_required(env, "V2RAY_CLIENT_ID")
 
         # 可选配置
-        self.azure_resource_group = os.getenv("AZURE_RESOURCE_GROUP", self.azure_resource_group)
-        self.azure_location = os.getenv("AZURE_LOCATION", self.azure_location)
-
-        self.v2ray_port = int(os.getenv("V2RAY_PORT", self.v2ray_port))
-        self.socks5_port = int(os.getenv("SOCKS5_PORT", self.socks5_port))
-        self.http_port = int(os.getenv("HTTP_PORT", self.http_port))
-        self.health_check_interval = int(os.getenv("HEALTH_CHECK_INTERVAL", self.health_check_interval))
-        self.verbose = os.getenv("VERBOSE", "false").lower() in ("true", "1", "yes")
+        self.azure_resource_group = env.get("AZURE_RESOURCE_GROUP", self.azure_resource_group)
+        self.azure_location = env.get("AZURE_LOCATION", self.azure_location)
+
+        self.v2ray_port = int(env.get("V2RAY_PORT", self.v2ray_port))
+        self.socks5_port = int(env.get("SOCKS5_PORT", self.socks5_port))
+        self.http_port = int(env.get("HTTP_PORT", self.http_port))
+        self.health_check_interval = int(env.get("HEALTH_CHECK_INTERVAL", self.health_check_interval))
+        self.azure_max_concurrency = int(env.get("AZURE_MAX_CONCURRENCY", self.azure_max_concurrency))
+        self.storage_max_concurrency = int(env.get("STORAGE_MAX_CONCURRENCY", self.storage_max_concurrency))
+        self.verbose = self._get_env_flag(env, "VERBOSE")
+        self.recreate_resources = self._get_env_flag(env, "RECREATE_RESOURCES")
+        self.persist_token_cache = self._get_env_flag(env, "PERSIST_TOKEN_CACHE")
 
         # 初始化转发域名列表
         self._initialize_domain_list()
@@ -81,70 +119,115 @@ class Config:
         if self.domain_file:
             domain_list.extend(self._load_domains_from_file(self.domain_file))
 
+        # 去除重复域名（保持原有顺序），避免V2Ray路由规则中出现重复条目
+        unique_domains = list(dict.fromkeys(domain_list))
+        if len(unique_domains) < len(domain_list):
+            logging.info("已去除 %d 个重复域名", len(domain_list) - len(unique_domains))
+        domain_list = unique_domains
+
         # google.com -> domain:google.com以匹配所有子域名
         self.domain_list = [f"domain:{d}" for d in domain_list]
+        self.domain_set = frozenset(self.domain_list)
+
+    def reload_domain_list(self, force: bool = False):
+        """重新加载域名列表
+
+        文件修改时间未变化时直接返回当前列表；修改时间精度较粗（如网络、FAT文件系统）
+        或同一时钟周期内多次写入时修改时间可能不变，已确认内容变化的调用方应传入force=True。
+        """
+        if not force and self.domain_file and self._domain_file_mtime_ns is not None:
+            try:
+                if os.stat(self.domain_file).st_mtime_ns == self._domain_file_mtime_ns:
+                    logging.debug("域名文件未修改，跳过重新加载")
+                    return self.domain_list
+            except OSError:
+                pass  # 交由加载逻辑报告错误
 
-    def reload_domain_list(self):
-        """重新加载域名列表"""
         logging.info("重新加载域名列表...")
         old_count = len(self.domain_list) if self.domain_list else 0
         self._initialize_domain_list()
-        new_count = len(self.domain_list)
-        logging.info(f"域名列表重新加载完成: {old_count} -> {new_count}")
+        new_count = len(self.domain_list) if self.domain_list else 0
+        logging.info("域名列表重新加载完成: %d -> %d", old_count, new_count)
         return self.domain_list
 
     def _load_domains_from_file(self, filepath: str) -> list[str]:
         """从文件加载域名列表"""
         try:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                domains = []
-                for line_num, line in enumerate(f, 1):
-                    # 去除空白字符
-                    domain = line.strip()
-                    # 跳过空行和注释行
-                    if not domain or domain.startswith('#'):
-                        continue
-                    # 简单的域名格式验证
-                    if self._is_valid_domain(domain):
-                        domains.append(domain)
-                    else:
-                        logging.warning(
-                            f"跳过无效域名 (行 {line_num}): {domain}"
-                        )
-                
-                logging.info(f"从文件 {filepath} 加载了 {len(domains)} 个域名")
-                return domains
-                
+            with open(filepath, 'rb') as f:
+                stat = os.fstat(f.fileno())
+                self._domain_file_mtime_ns = stat.st_mtime_ns
+                # 大文件通过内存映射一次性读入，小文件（含空文件，无法映射）直接读取
+                if stat.st_size >= _MMAP_MIN_SIZE:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                        data = mm.read()
+                else:
+                    data = f.read()
+            self.domain_file_hash = domain_file_digest(data)
+            # 在bytes上完成分行和去空白（均在C层完成），只解码保留下来的行；跳过空行和注释行
+            entries = [
+                raw.decode('utf-8')
+                for raw in map(bytes.strip, data.splitlines())
+                if raw and not raw.startswith(b'#')
+            ]
         except Exception as e:
             raise ValueError(f"读取域名文件失败: {e}")
 
+        # 简单的域名格式验证（与_is_valid_domain一致，内联以减少大文件的逐行调用开销）
+        match = _DOMAIN_PATTERN.match
+        domains = [d for d in entries if len(d) <= 253 and match(d) is not None]
+
+        if len(domains) < len(entries):
+            # 汇总为一条警告，只列出前若干个无效域名
+            invalid = [d for d in entries if not self._is_valid_domain(d)]
+            shown = ", ".join(invalid[:_MAX_INVALID_DOMAINS_LOGGED])
+            if len(invalid) > _MAX_INVALID_DOMAINS_LOGGED:
+                shown += " ..."
+            logging.warning("跳过 %d 个无效域名: %s", len(invalid), shown)
+
+        logging.info("从文件 %s 加载了 %d 个域名", filepath, len(domains))
+        return domains
+
     def _is_valid_domain(self, domain: str) -> bool:
         """简单的域名格式验证"""
-        import re
-        # 基本的域名格式检查
-        domain_pattern = r'^[a-zA-Z0-9]([a-zA-Z0-9\-]{0,61}[a-zA-Z0-9])?(\.[a-zA-Z0-9]([a-zA-Z0-9\-]{0,61}[a-zA-Z0-9])?)*$'
-        return bool(re.match(domain_pattern, domain)) and len(domain) <= 253
-
-    def _get_env_required(self, key: str) -> str:
-        """获取必需的环境变量"""
-        value = os.getenv(key)
+        # 基本的域名格式检查（先判断长度，超长时无需匹配正则）
+        return len(domain) <= 253 and _DOMAIN_PATTERN.match(domain) is not None
+
+    def _get_env_required(self, env: dict[str, str], key: str) -> str:
+        """从环境变量快照中获取必需的环境变量"""
+        value = env.get(key)
         if not value:
             raise ValueError(f"环境变量 {key} 是必需的")
         return value
 
-    @property
+    def _get_env_flag(self, env: dict[str, str], key: str) -> bool:
+        """从环境变量快照中读取布尔开关（true/1/yes，不区分大小写，未设置时为False）"""
+        return env.get(key, "false").lower() in _TRUE_VALUES
+
+    @cached_property
+    def file_endpoint_url(self) -> str:
+        """获取存储账户的Azure文件服务终结点URL（存储账户名变化时失效）"""
+        return f"https://{self.storage_account_name}.file.core.windows.net"
+
+    def set_storage_account_name(self, name: str):
+        """更新存储账户名，并使缓存的文件服务终结点URL及配置URL失效"""
+        self.storage_account_name = name
+        self.__dict__.pop("file_endpoint_url", None)
+        self.__dict__.pop("v2ray_config_url", None)
+
+    @cached_property
     def v2ray_config_url(self) -> str:
-        """获取V2Ray配置的Azure Storage URL"""
-        return (
-            f"https://{self.storage_account_name}.file.core.windows.net/"
-            f"{self.storage_file_share_name}/{self.storage_file_name}"
-        )
+        """获取V2Ray配置的Azure Storage URL（存储账户名变化时失效）"""
+        return f"{self.file_endpoint_url}/{self.storage_file_share_name}/{self.storage_file_name}"
+
+    @cached_property
+    def _unique_suffix(self) -> str:
+        """资源名称唯一后缀：v2ray_client_id的前8位（去除连字符），只计算一次"""
+        assert self.v2ray_client_id is not None, "v2ray_client_id must be set"
+        return self.v2ray_client_id.replace('-', '')[:8].lower()
 
     def _get_unique_name(self, base_name: str) -> str:
         """生成唯一的资源名称（不使用连字符）"""
-        assert self.v2ray_client_id is not None, "v2ray_client_id must be set"
-        suffix = self.v2ray_client_id.replace('-', '')[:8].lower()
-        return f"{base_name.lower()}{suffix}"
+        return f"{base_name.lower()}{self._unique_suffix}"
 
     def get_unique_storage_name(self) -> str:
         """
@@ -3,38 +3,70 @@
 import asyncio
 import logging
 import os
-from typing import Callable, Union, Optional, Awaitable
+from typing import Any, Awaitable, Callable, Coroutine, Optional, Union
+
+try:
+    from watchfiles import Change, awatch
+except ImportError:  # watchfiles不可用时退回到轮询
+    awatch = None  # type: ignore[assignment]
 
 logger = logging.getLogger(__name__)
 
 
 class FileWatcher:
-    """文件变更监控器"""
-    
+    """文件变更监控器
+
+    优先使用watchfiles（inotify/FSEvents/ReadDirectoryChangesW）接收内核推送的
+    变更事件；watchfiles未安装时退回到定期检查修改时间。
+    """
+
+    __slots__ = ("file_path", "callback", "_callback_is_async", "_running", "_task", "_stop_event", "_last_modified")
+
     def __init__(self, file_path: str, callback: Union[Callable[[], None], Callable[[], Awaitable[None]]]):
         self.file_path = file_path
         self.callback = callback
+        # 回调类型在构造时判断一次，避免每次变更都进行反射检查
+        self._callback_is_async = asyncio.iscoroutinefunction(callback)
         self._running = False
         self._task: Optional[asyncio.Task] = None
+        self._stop_event: Optional[asyncio.Event] = None
         self._last_modified = None
-        
+
     async def start(self):
-        """开始监控文件"""
+        """在后台任务中开始监控文件"""
+        watch_loop = self._begin()
+        if watch_loop is not None:
+            self._task = asyncio.create_task(watch_loop)
+
+    async def run(self):
+        """在当前任务中监控文件，直到调用stop()"""
+        watch_loop = self._begin()
+        if watch_loop is not None:
+            self._task = asyncio.current_task()
+            await watch_loop
+
+    def _begin(self) -> Optional[Coroutine[Any, Any, None]]:
+        """标记监控开始并返回监控循环；已在运行或文件不存在时返回None"""
         if self._running:
-            return
-            
+            return None
+
         if not os.path.exists(self.file_path):
-            logger.warning(f"监控的文件不存在: {self.file_path}")
-            return
-            
+            logger.warning("监控的文件不存在: %s", self.file_path)
+            return None
+
         self._running = True
-        self._last_modified = os.path.getmtime(self.file_path)
-        self._task = asyncio.create_task(self._watch_loop())
-        logger.info(f"开始监控文件: {self.file_path}")
-        
+        self._stop_event = asyncio.Event()
+        logger.info("开始监控文件: %s", self.file_path)
+        if awatch is not None:
+            return self._event_loop()
+        self._last_modified = os.stat(self.file_path).st_mtime_ns
+        return self._watch_loop()
+
     async def stop(self):
         """停止监控"""
         self._running = False
+        if self._stop_event:
+            self._stop_event.set()
         if self._task:
             self._task.cancel()
             try:
@@ -42,30 +74,61 @@ class FileWatcher:
             except asyncio.CancelledError:
                 pass
             self._task = None
-        logger.info(f"停止监控文件: {self.file_path}")
-        
+        logger.info("停止监控文件: %s", self.file_path)
+
+    async def _notify(self):
+        """执行变更回调"""
+        try:
+            if self._callback_is_async:
+                await self.callback()
+            else:
+                await asyncio.to_thread(self.callback)
+        except Exception as e:
+            logger.error("处理文件变更回调失败: %s", e)
+
+    async def _event_loop(self):
+        """基于内核文件事件的监控循环"""
+        target = os.path.abspath(self.file_path)
+
+        # 监控所在目录而非文件本身，编辑器"写临时文件再重命名"的保存方式也能被捕获
+        def only_target(change: "Change", path: str) -> bool:
+            return path == target
+
+        try:
+            async for changes in awatch(
+                os.path.dirname(target),
+                watch_filter=only_target,
+                stop_event=self._stop_event,
+                recursive=False,
+            ):
+                if any(change == Change.deleted for change, _ in changes) and not os.path.exists(target):
+                    logger.warning("监控的文件已删除: %s", self.file_path)
+                    continue
+                logger.info("检测到文件变更: %s", self.file_path)
+                await self._notify()
+        except Exception as e:
+            # 例如inotify监控数量达到上限，退回到轮询以保证功能可用
+            logger.error("文件事件监控异常，退回到轮询: %s", e)
+            self._last_modified = os.stat(self.file_path).st_mtime_ns
+            await self._watch_loop()
+
     async def _watch_loop(self):
-        """监控循环"""
+        """轮询监控循环（watchfiles不可用时使用）"""
         while self._running:
             try:
-                if os.path.exists(self.file_path):
-                    current_modified = os.path.getmtime(self.file_path)
+                # 每次检查只调用一次stat，文件不存在时由异常判断
+                try:
+                    current_modified = os.stat(self.file_path).st_mtime_ns
+                except FileNotFoundError:
+                    logger.warning("监控的文件已删除: %s", self.file_path)
+                else:
                     if current_modified != self._last_modified:
-                        logger.info(f"检测到文件变更: {self.file_path}")
+                        logger.info("检测到文件变更: %s", self.file_path)
                         self._last_modified = current_modified
-                        try:
-                            # 判断callback是否为async函数
-                            if asyncio.iscoroutinefunction(self.callback):
-                                await self.callback()
-                            else:
-                                await asyncio.to_thread(self.callback)
-                        except Exception as e:
-                            logger.error(f"处理文件变更回调失败: {e}")
-                else:
-                    logger.warning(f"监控的文件已删除: {self.file_path}")
-                    
+                        await self._notify()
+
                 await asyncio.sleep(2)  # 每2秒检查一次
-                
+
             except Exception as e:
-                logger.error(f"文件监控异常: {e}")
+                logger.error("文件监控异常: %s", e)
                 await asyncio.sleep(5)  # 出错时等待更长时间
@@ -11,16 +11,28 @@ from .v2ray_manager import V2RayManager
 
 logger = logging.getLogger(__name__)
 
+# 连通性检测地址：返回空的204响应，无需下载页面内容（google.com在代理路由规则内）
+PROBE_URL = "https://www.google.com/generate_204"
+# V2Ray重启后的预热时间（秒），期间的检测失败不计入连续失败次数
+RESTART_WARMUP = 60
+
 
 class HealthMonitor:
     """健康监控器"""
 
     def __init__(
-        self, config: Config, azure_manager: AzureManager, v2ray_manager: V2RayManager
+        self,
+        config: Config,
+        azure_manager: AzureManager,
+        v2ray_manager: V2RayManager,
+        http_session: Optional[aiohttp.ClientSession] = None,
     ):
         self.config = config
         self.azure_manager = azure_manager
         self.v2ray_manager = v2ray_manager
+        # 经由本地SOCKS5代理的共享会话，由应用注入；未注入时首次检查时创建并由监控器持有
+        self.http_session = http_session
+        self._owns_session = False
         self.running = False
         self.monitor_task: Optional[asyncio.Task] = None
         self.last_check_time = 0
@@ -28,16 +40,27 @@ class HealthMonitor:
         self.max_failures = 3  # 连续失败3次后重启
 
     async def start(self):
-        """启动健康监控"""
+        """在后台任务中启动健康监控"""
+        if self._begin():
+            self.monitor_task = asyncio.create_task(self._monitor_loop())
+
+    async def run(self):
+        """在当前任务中运行健康监控，直到调用stop()"""
+        if self._begin():
+            self.monitor_task = asyncio.current_task()
+            await self._monitor_loop()
+
+    def _begin(self) -> bool:
+        """标记监控开始，已在运行时返回False"""
         if self.running:
             logger.warning("健康监控已在运行")
-            return
+            return False
 
         logger.info(
-            f"正在启动健康监控，检查间隔: {self.config.health_check_interval}秒"
+            "正在启动健康监控，检查间隔: %s秒", self.config.health_check_interval
         )
         self.running = True
-        self.monitor_task = asyncio.create_task(self._monitor_loop())
+        return True
 
     async def stop(self):
         """停止健康监控"""
@@ -55,6 +78,11 @@ class HealthMonitor:
                 pass
             self.monitor_task = None
 
+        if self._owns_session and self.http_session is not None:
+            await self.http_session.close()
+            self.http_session = None
+            self._owns_session = False
+
         logger.info("健康监控已停止")
 
     async def _monitor_loop(self):
@@ -66,7 +94,7 @@ class HealthMonitor:
             except asyncio.CancelledError:
                 break
             except Exception as e:
-                logger.error(f"健康检查过程中出现错误: {e}")
+                logger.error("健康检查过程中出现错误: %s", e)
                 await asyncio.sleep(60)  # 出错时等待1分钟再继续
 
     async def _perform_health_check(self):
@@ -86,46 +114,60 @@ class HealthMonitor:
         if connection_ok:
             logger.debug("健康检查通过")
             self.consecutive_failures = 0
+        elif self._in_warmup():
+            logger.info("V2Ray刚重启，仍在预热中，本次检测失败不计入连续失败次数")
         else:
             self.consecutive_failures += 1
             logger.warning(
-                f"健康检查失败 (连续失败: "
-                f"{self.consecutive_failures}/{self.max_failures})"
+                "健康检查失败 (连续失败: %s/%s)",
+                self.consecutive_failures, self.max_failures
             )
 
             if self.consecutive_failures >= self.max_failures:
                 logger.error("连续健康检查失败，正在重启Azure容器...")
                 await self._handle_connection_failure()
 
+    def _in_warmup(self) -> bool:
+        """V2Ray是否在最近一次（重新）启动后的预热时间内（包括域名文件变更等其他原因触发的重启）"""
+        started_at = self.v2ray_manager.last_started_at
+        return started_at is not None and time.monotonic() - started_at < RESTART_WARMUP
+
     async def _test_proxy_connection(self) -> bool:
         """测试代理连接"""
         try:
-            # 配置SOCKS5代理
-            connector = ProxyConnector.from_url(
-                f"socks5://127.0.0.1:{self.config.socks5_port}"
-            )
-
-            timeout = aiohttp.ClientTimeout(total=30)
-
-            async with aiohttp.ClientSession(
-                connector=connector, timeout=timeout
-            ) as session:
-                # 尝试访问Google
-                async with session.get("https://www.google.com") as response:
-                    if response.status == 200:
-                        logger.debug("代理连接测试成功")
-                        return True
-                    else:
-                        logger.warning(f"代理连接测试失败，状态码: {response.status}")
-                        return False
+            return await self._probe(self._get_session())
 
         except asyncio.TimeoutError:
             logger.warning("代理连接测试超时")
             return False
         except Exception as e:
-            logger.warning(f"代理连接测试失败: {e}")
+            logger.warning("代理连接测试失败: %s", e)
             return False
 
+    def _get_session(self) -> aiohttp.ClientSession:
+        """获取经由代理的会话，未注入时创建一次并在各次检查间复用连接"""
+        if self.http_session is None:
+            # 配置SOCKS5代理
+            connector = ProxyConnector.from_url(
+                f"socks5://127.0.0.1:{self.config.socks5_port}",
+                keepalive_timeout=60,
+            )
+            self.http_session = aiohttp.ClientSession(
+                connector=connector, timeout=aiohttp.ClientTimeout(total=30)
+            )
+            self._owns_session = True
+        return self.http_session
+
+    async def _probe(self, session: aiohttp.ClientSession) -> bool:
+        """通过代理会话向Google的204检测地址发送HEAD请求"""
+        async with session.head(PROBE_URL, allow_redirects=False) as response:
+            if response.status == 204:
+                logger.debug("代理连接测试成功")
+                return True
+            else:
+                logger.warning("代理连接测试失败，状态码: %s", response.status)
+                return False
+
     async def _handle_connection_failure(self):
         """处理连接失败"""
         try:
@@ -144,7 +186,7 @@ class HealthMonitor:
             logger.info("连接故障恢复处理完成")
 
         except Exception as e:
-            logger.error(f"处理连接故障时出现错误: {e}")
+            logger.error("处理连接故障时出现错误: %s", e)
 
     def get_status(self) -> dict:
         """获取监控状态"""
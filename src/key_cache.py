@@ -0,0 +1,98 @@
+"""存储账户密钥本地缓存模块"""
+
+import base64
+import json
+import logging
+import os
+import time
+from typing import Optional, Tuple
+
+from cryptography.fernet import Fernet, InvalidToken
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+
+logger = logging.getLogger(__name__)
+
+# 默认缓存文件路径
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".az-ray", "keys.json")
+# 缓存有效期（秒）
+CACHE_TTL = 24 * 60 * 60
+# 由客户端密钥派生加密密钥时的PBKDF2迭代次数
+_KDF_ITERATIONS = 200_000
+
+
+class StorageKeyCache:
+    """存储账户密钥的本地加密缓存
+
+    密钥使用由Azure客户端密钥派生的Fernet密钥加密后保存，进程重启后可省去一次
+    list_keys请求。缓存的密钥失效时由调用方重新获取并覆盖。
+    """
+
+    def __init__(self, secret: str, path: str = DEFAULT_CACHE_PATH, ttl: float = CACHE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._secret = secret.encode("utf-8")
+
+    def load(self, account_name: str) -> Optional[str]:
+        """读取指定存储账户的缓存密钥，不存在、已过期或无法解密时返回None"""
+        cached = self.load_with_age(account_name)
+        return cached[0] if cached else None
+
+    def load_with_age(self, account_name: str) -> Optional[Tuple[str, float]]:
+        """读取指定存储账户的缓存密钥及其保存至今的秒数，不存在、已过期或无法解密时返回None"""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+
+            age = time.time() - entry["saved_at"]
+            if entry["name"] != account_name or age > self.ttl:
+                return None
+
+            fernet = self._fernet(base64.b64decode(entry["salt"]))
+            return fernet.decrypt(entry["key"].encode("ascii")).decode("utf-8"), age
+
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError, InvalidToken) as e:
+            logger.debug("读取存储账户密钥缓存失败: %s", e)
+            return None
+
+    def save(self, account_name: str, key: str):
+        """加密保存存储账户密钥（仅当前用户可读写）"""
+        salt = os.urandom(16)
+        entry = {
+            "name": account_name,
+            "saved_at": time.time(),
+            "salt": base64.b64encode(salt).decode("ascii"),
+            "key": self._fernet(salt).encrypt(key.encode("utf-8")).decode("ascii"),
+        }
+
+        tmp_path = f"{self.path}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path), mode=0o700, exist_ok=True)
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(entry, f)
+            # 先写临时文件再替换，避免并发读取到不完整的内容
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning("保存存储账户密钥缓存失败: %s", e)
+
+    def clear(self):
+        """删除缓存文件"""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning("删除存储账户密钥缓存失败: %s", e)
+
+    def _fernet(self, salt: bytes) -> Fernet:
+        """由客户端密钥和盐派生Fernet加密器"""
+        kdf = PBKDF2HMAC(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=salt,
+            iterations=_KDF_ITERATIONS,
+        )
+        return Fernet(base64.urlsafe_b64encode(kdf.derive(self._secret)))
@@ -2,9 +2,39 @@
 
 import asyncio
 import logging
+import random
 import time
 from functools import wraps
-from typing import Any, Callable, Tuple, Type
+from typing import Any, Callable, Optional, Tuple, Type
+
+
+class CachedTimeFormatter(logging.Formatter):
+    """Log formatter that reuses the formatted timestamp within one second.
+
+    ``logging.Formatter.formatTime`` calls ``time.strftime`` for every record;
+    here the second-resolution part is computed once per second and only the
+    milliseconds are appended per record.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._time_cache: Tuple[int, str] = (-1, "")
+
+    def formatTime(self, record: logging.LogRecord, datefmt: Optional[str] = None) -> str:
+        if datefmt:
+            return super().formatTime(record, datefmt)
+
+        second = int(record.created)
+        cached_second, cached_text = self._time_cache
+        if second != cached_second:
+            cached_text = time.strftime(
+                self.default_time_format, self.converter(record.created)
+            )
+            # Store as one tuple so concurrent handlers never see a mismatched pair
+            self._time_cache = (second, cached_text)
+        if self.default_msec_format:
+            return self.default_msec_format % (cached_text, record.msecs)
+        return cached_text
 
 
 def retry_with_backoff(
@@ -12,7 +42,10 @@ def retry_with_backoff(
     base_delay: float = 1.0,
     backoff_factor: float = 2.0,
     max_delay: float = 60.0,
-    exceptions: Tuple[Type[Exception], ...] = (Exception,)
+    exceptions: Tuple[Type[Exception], ...] = (Exception,),
+    retry_after: Optional[Callable[[Exception], Optional[float]]] = None,
+    jitter: float = 0.0,
+    retry_if: Optional[Callable[[Exception], bool]] = None,
 ):
     """Decorator for retrying operations with exponential backoff.
 
@@ -22,10 +55,31 @@ def retry_with_backoff(
         backoff_factor: Factor to increase delay after each retry
         max_delay: Maximum delay between retries (seconds)
         exceptions: Tuple of exception types to retry on
+        retry_after: Optional callable returning the delay requested by the
+            failed call (e.g. a ``Retry-After`` header), or None to use backoff
+        jitter: Maximum extra fraction randomly added to each backoff delay
+            (e.g. 0.5 waits between 1x and 1.5x), still capped at max_delay
+        retry_if: Optional predicate further narrowing ``exceptions``; errors
+            for which it returns False are raised immediately
 
     Returns:
         Decorated function with retry logic
     """
+    # The backoff schedule is fixed, so compute it once at decoration time
+    delays = tuple(
+        min(base_delay * (backoff_factor ** attempt), max_delay)
+        for attempt in range(max_attempts)
+    )
+
+    def compute_delay(attempt: int, error: Exception) -> float:
+        if retry_after is not None:
+            requested = retry_after(error)
+            if requested is not None:
+                return min(requested, max_delay)
+        if jitter:
+            return min(delays[attempt] * (1 + jitter * random.random()), max_delay)
+        return delays[attempt]
+
     def decorator(func: Callable) -> Callable:
         if asyncio.iscoroutinefunction(func):
             @wraps(func)
@@ -36,18 +90,16 @@ def retry_with_backoff(
                     try:
                         return await func(*args, **kwargs)
                     except exceptions as e:
+                        if retry_if is not None and not retry_if(e):
+                            raise
                         last_exception = e
                         if attempt == max_attempts:
                             break
 
-                        delay = min(
-                            base_delay * (backoff_factor ** attempt),
-                            max_delay
-                        )
+                        delay = compute_delay(attempt, e)
                         logging.warning(
-                            f"Attempt {attempt + 1} failed for "
-                            f"{func.__name__}: {e}. "
-                            f"Retrying in {delay:.2f} seconds..."
+                            "Attempt %d failed for %s: %s. Retrying in %.2f seconds...",
+                            attempt + 1, func.__name__, e, delay,
                         )
                         await asyncio.sleep(delay)
 
@@ -64,18 +116,16 @@ def retry_with_backoff(
                     try:
                         return func(*args, **kwargs)
                     except exceptions as e:
+                        if retry_if is not None and not retry_if(e):
+                            raise
                         last_exception = e
                         if attempt == max_attempts:
                             break
 
-                        delay = min(
-                            base_delay * (backoff_factor ** attempt),
-                            max_delay
-                        )
+                        delay = compute_delay(attempt, e)
                         logging.warning(
-                            f"Attempt {attempt + 1} failed for "
-                            f"{func.__name__}: {e}. "
-                            f"Retrying in {delay:.2f} seconds..."
+                            "Attempt %d failed for %s: %s. Retrying in %.2f seconds...",
+                            attempt + 1, func.__name__, e, delay,
                         )
                         time.sleep(delay)
 
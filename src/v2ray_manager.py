@@ -1,16 +1,49 @@
 import asyncio
+import collections
+import contextlib
 import json
 import logging
-import subprocess
+import re
 import tempfile
+import time
 import os
-from typing import Optional
+from typing import Callable, Optional
+
+try:
+    import orjson
+except ImportError:  # 未安装orjson时退回标准库json
+    orjson = None  # type: ignore[assignment]
 
 from .config import Config
 from .azure_manager import AzureManager
 
 logger = logging.getLogger(__name__)
 
+# 默认经由代理访问的站点（V2Ray内置geosite分类）
+PROXY_GEOSITES: tuple[str, ...] = (
+    "geosite:google",
+    "geosite:youtube",
+    "geosite:twitter",
+    "geosite:facebook",
+    "geosite:github",
+    "geosite:amazon",
+    "geosite:telegram",
+    "geosite:netflix",
+)
+
+# 直连的IP分类（V2Ray内置geoip分类）
+DIRECT_GEOIPS: tuple[str, ...] = (
+    "geoip:private",  # 私有网络
+    "geoip:cn",  # 中国大陆IP
+)
+
+# V2Ray完成启动时输出的日志（如"V2Ray 5.16.1 started"）
+_STARTED_PATTERN = re.compile(r"V2Ray \S+ started")
+# 启动失败时错误信息中保留的输出末尾行数
+_OUTPUT_TAIL_LINES = 20
+# 合并短时间内连续重启请求的等待时间（秒）
+RESTART_DEBOUNCE = 0.2
+
 
 class V2RayManager:
     """V2Ray代理管理器"""
@@ -18,8 +51,21 @@ class V2RayManager:
     def __init__(self, config: Config, azure_manager: AzureManager):
         self.config = config
         self.azure_manager = azure_manager
-        self.process: Optional[subprocess.Popen] = None
+        self.process: Optional[asyncio.subprocess.Process] = None
         self.config_file: Optional[str] = None
+        # 客户端配置模板及上次写入的内容，用于跳过内容未变化的重写
+        self._config_template = self._build_config_template()
+        self._last_config_bytes: Optional[bytes] = None
+        # V2Ray输出读取任务、启动完成通知及输出末尾（用于启动失败时的错误信息）
+        self._log_task: Optional[asyncio.Task] = None
+        self._ready_event = asyncio.Event()
+        self._output_tail: collections.deque[bytes] = collections.deque(maxlen=_OUTPUT_TAIL_LINES)
+        # 最近一次成功启动（含重启）的时间（单调时钟），供健康监控判断是否仍在预热
+        self.last_started_at: Optional[float] = None
+        # 尚未开始执行、可供后续调用加入的重启，以及所有未完成的重启任务
+        self._pending_restart: Optional[asyncio.Task] = None
+        self._restart_tasks: set[asyncio.Task] = set()
+        self._restart_lock = asyncio.Lock()
 
     async def initialize(self):
         """初始化V2Ray管理器"""
@@ -30,18 +76,9 @@ class V2RayManager:
 
         logger.info("V2Ray管理器初始化完成")
 
-    async def _generate_client_config(self):
-        """生成V2Ray客户端配置"""
-        # 获取Azure容器的IP地址
-        server_ip = await self.azure_manager.get_container_ip()
-        if not server_ip:
-            raise RuntimeError("无法获取Azure容器的IP地址")
-        
-        server_address = server_ip
-        logger.info(f"使用容器IP地址: {server_ip}")
-
-        # 生成客户端配置
-        client_config = {
+    def _build_config_template(self) -> dict:
+        """构建客户端配置模板（服务器地址和用户自定义域名在每次生成时填入）"""
+        return {
             "log": {
                 "loglevel": "info" if self.config.verbose else "warning",
                 "access": ""  # 禁用访问日志
@@ -72,7 +109,7 @@ class V2RayManager:
                     "settings": {
                         "vnext": [
                             {
-                                "address": server_address,
+                                "address": "",  # 每次生成时填入容器IP
                                 "port": self.config.v2ray_port,
                                 "users": [
                                     {
@@ -102,29 +139,17 @@ class V2RayManager:
                 "rules": [
                     {
                         "type": "field",
-                        "domain": [
-                            "geosite:google",
-                            "geosite:youtube",
-                            "geosite:twitter",
-                            "geosite:facebook",
-                            "geosite:github",
-                            "geosite:amazon",
-                            "geosite:telegram",
-                            "geosite:netflix",
-                        ],
+                        "domain": list(PROXY_GEOSITES),
                         "outboundTag": "proxy"
                     },
                     {
                         "type": "field",
-                        "domain": self.config.domain_list,  # 用户自定义域名
+                        "domain": [],  # 用户自定义域名，每次生成时填入
                         "outboundTag": "proxy"
                     },
                     {
                         "type": "field",
-                        "ip": [
-                            "geoip:private",      # 私有网络
-                            "geoip:cn"            # 中国大陆IP
-                        ],
+                        "ip": list(DIRECT_GEOIPS),
                         "outboundTag": "direct"
                     },
                     {
@@ -136,128 +161,264 @@ class V2RayManager:
             }
         }
 
-        # 保存配置到临时文件
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False) as f:
-            json.dump(client_config, f, indent=2)
-            self.config_file = f.name
+    async def _build_client_config(self) -> dict:
+        """获取Azure容器的IP地址并填入客户端配置模板，返回配置字典
+
+        返回的是各次生成间复用的模板本身，其余部分不变，只更新服务器地址和用户自定义域名。
+        """
+        server_ip = await self.azure_manager.get_container_ip()
+        if not server_ip:
+            raise RuntimeError("无法获取Azure容器的IP地址")
+        logger.info("使用容器IP地址: %s", server_ip)
+
+        client_config = self._config_template
+        client_config["outbounds"][0]["settings"]["vnext"][0]["address"] = server_ip
+        client_config["routing"]["rules"][1]["domain"] = self.config.domain_list
+        return client_config
 
-        logger.info(f"V2Ray客户端配置已生成: {self.config_file}")
+    async def _generate_client_config(self):
+        """生成V2Ray客户端配置"""
+        vnext = self._config_template["outbounds"][0]["settings"]["vnext"][0]
+        user_rule = self._config_template["routing"]["rules"][1]
+        previous_address, previous_domains = vnext["address"], user_rule["domain"]
+
+        client_config = await self._build_client_config()
+
+        # 地址未变且域名列表仍是上次写入的同一对象（未重新加载）时，无需重新序列化
+        if (
+            self._last_config_bytes is not None
+            and vnext["address"] == previous_address
+            and user_rule["domain"] is previous_domains
+            and self.config_file
+            and os.path.exists(self.config_file)
+        ):
+            logger.info("V2Ray客户端配置未变化: %s", self.config_file)
+            return
+
+        payload = self._dump_config(client_config)
+
+        # 内容与上次写入的相同且文件仍在时无需重写
+        if payload == self._last_config_bytes and self.config_file and os.path.exists(self.config_file):
+            logger.info("V2Ray客户端配置未变化: %s", self.config_file)
+            return
+
+        # 保存配置到临时文件（在线程中写入，不阻塞事件循环；已有配置文件时原地覆盖）
+        self.config_file = await asyncio.to_thread(self._write_config_file, payload, self.config_file)
+        self._last_config_bytes = payload
+
+        logger.info("V2Ray客户端配置已生成: %s", self.config_file)
+
+    @staticmethod
+    def _dump_config(client_config: dict) -> bytes:
+        """将客户端配置序列化为JSON（优先使用orjson）
+
+        V2Ray读取配置无需缩进，默认输出紧凑格式；启用DEBUG日志时缩进2格，便于排查。
+        """
+        indent = logger.isEnabledFor(logging.DEBUG)
+        if orjson is not None:
+            return orjson.dumps(client_config, option=orjson.OPT_INDENT_2 if indent else None)
+        if indent:
+            return json.dumps(client_config, indent=2).encode("utf-8")
+        return json.dumps(client_config, separators=(',', ':')).encode("utf-8")
+
+    @staticmethod
+    def _write_config_file(payload: bytes, path: Optional[str] = None) -> str:
+        """将序列化后的客户端配置写入文件（未指定路径时创建临时文件），返回文件路径
+
+        已有配置文件时先写入同目录的临时文件再原子替换，读取方不会看到写了一半的配置。
+        """
+        # mkstemp创建的文件仅当前用户可读写（配置中含客户端ID），且文件名不可预测
+        fd, tmp_path = tempfile.mkstemp(suffix='.json', dir=os.path.dirname(path) if path else None)
+        try:
+            try:
+                # 不经过缓冲写入器，整个配置通常一次write()即可写完
+                view = memoryview(payload)
+                while view:
+                    view = view[os.write(fd, view):]
+            finally:
+                os.close(fd)
+            if path:
+                os.replace(tmp_path, path)
+                return path
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return tmp_path
 
     async def start(self):
         """启动V2Ray代理"""
-        if self.process and self.process.poll() is None:
+        if self.is_running():
             logger.warning("V2Ray已在运行")
             return
 
-        logger.info(f"正在启动V2Ray代理，SOCKS5端口: {self.config.socks5_port}, HTTP端口: {self.config.http_port}")
+        logger.info(
+            "正在启动V2Ray代理，SOCKS5端口: %s, HTTP端口: %s", self.config.socks5_port, self.config.http_port
+        )
 
         try:
-            # 启动V2Ray进程
-            self.process = subprocess.Popen(
-                ["v2ray", "run", "-c", self.config_file],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                universal_newlines=True,
-                bufsize=1  # 行缓冲，确保实时输出
+            self._ready_event.clear()
+            self._output_tail.clear()
+
+            # 启动V2Ray进程（stderr合并到stdout，输出管道为asyncio流，可直接在事件循环中读取）
+            process = self.process = await asyncio.create_subprocess_exec(
+                "v2ray", "run", "-c", self.config_file,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT,
             )
 
-            # 启动日志转发任务（仅在verbose模式下）
-            if self.config.verbose:
-                asyncio.create_task(self._forward_v2ray_logs())
+            # 始终读取V2Ray输出：用于识别启动完成，并避免管道写满阻塞V2Ray
+            self._log_task = asyncio.create_task(self._forward_v2ray_logs())
 
-            # 等待一下确保进程启动（可通过V2RAY_WAIT_TIME环境变量控制）
+            # 等待V2Ray报告启动完成或进程退出，最长等待V2RAY_WAIT_TIME秒
             wait_time = int(os.getenv("V2RAY_WAIT_TIME", "10"))
             if wait_time > 0:
-                await asyncio.sleep(wait_time)
+                await self._wait_until_started(wait_time)
+
+            # 等待期间已由stop()主动停止，不视为启动失败
+            if self.process is not process:
+                logger.info("V2Ray在启动过程中被停止")
+                return
 
             # 检查进程是否正常运行
-            if self.process.poll() is not None:
-                stdout, stderr = self.process.communicate()
-                raise RuntimeError(f"V2Ray启动失败: {stderr}")
+            if process.returncode is not None:
+                # 等待输出读取完毕，以便错误信息包含完整的输出末尾
+                await asyncio.wait({self._log_task}, timeout=1)
+                output = b"".join(self._output_tail).decode(errors='replace').strip()
+                raise RuntimeError(f"V2Ray启动失败: {output}")
 
+            self.last_started_at = time.monotonic()
             logger.info("V2Ray代理启动成功")
 
         except FileNotFoundError:
             logger.error("V2Ray可执行文件未找到，请确保已安装V2Ray")
             raise
         except Exception as e:
-            logger.error(f"启动V2Ray失败: {e}")
+            logger.error("启动V2Ray失败: %s", e)
             raise
 
+    async def _wait_until_started(self, timeout: float):
+        """等待V2Ray输出启动完成日志或进程退出，超时后返回"""
+        assert self.process is not None
+        started = asyncio.ensure_future(self._ready_event.wait())
+        exited = asyncio.ensure_future(self.process.wait())
+        try:
+            await asyncio.wait((started, exited), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            started.cancel()
+            exited.cancel()
+
     async def stop(self):
-        """停止V2Ray代理"""
-        if self.process:
+        """停止V2Ray代理并删除临时配置文件（取消尚未完成的重启）"""
+        for task in tuple(self._restart_tasks):
+            task.cancel()
+        await asyncio.gather(*self._restart_tasks, return_exceptions=True)
+        self._pending_restart = None
+
+        await self._stop_process()
+
+        # 清理临时配置文件
+        if self.config_file and os.path.exists(self.config_file):
+            os.unlink(self.config_file)
+            self.config_file = None
+        self._last_config_bytes = None
+
+    async def _stop_process(self):
+        """停止V2Ray进程（保留配置文件）"""
+        process = self.process
+        if process:
+            # 先清除引用：启动等待期间被停止时，start()据此识别为主动停止
+            self.process = None
             logger.info("正在停止V2Ray代理...")
-            self.process.terminate()
+            try:
+                process.terminate()
+            except ProcessLookupError:
+                pass  # 进程已退出
 
             try:
                 # 等待进程结束
-                await asyncio.wait_for(
-                    asyncio.to_thread(self.process.wait),
-                    timeout=10
-                )
+                await asyncio.wait_for(process.wait(), timeout=10)
             except asyncio.TimeoutError:
                 logger.warning("V2Ray进程未响应，强制终止")
-                self.process.kill()
-                await asyncio.to_thread(self.process.wait)
+                process.kill()
+                await process.wait()
 
-            self.process = None
+            # 等待输出读取任务结束，避免其在下次start()重置输出末尾和启动通知后仍在运行
+            if self._log_task:
+                self._log_task.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await self._log_task
+                self._log_task = None
             logger.info("V2Ray代理已停止")
 
-        # 清理临时配置文件
-        if self.config_file and os.path.exists(self.config_file):
-            os.unlink(self.config_file)
-            self.config_file = None
-
     async def restart(self):
-        """重启V2Ray代理"""
-        logger.info("正在重启V2Ray代理...")
-        await self.stop()
+        """重启V2Ray代理
 
-        # 重新生成配置（可能domains已变化）
-        await self._generate_client_config()
+        短时间内的多次调用（如域名文件变更与健康检查同时触发）合并为一次重启：
+        尚未开始执行的重启会使用届时最新的配置，后续调用直接等待它完成。
+        """
+        task = self._pending_restart
+        if task is None:
+            task = self._pending_restart = asyncio.create_task(self._restart())
+            self._restart_tasks.add(task)
+            task.add_done_callback(self._restart_tasks.discard)
+        # 调用方被取消时不影响其他等待同一次重启的调用方
+        await asyncio.shield(task)
+
+    async def _restart(self):
+        """执行一次重启"""
+        await asyncio.sleep(RESTART_DEBOUNCE)
+        async with self._restart_lock:
+            # 此后的调用需要新的重启才能用上更新的配置
+            self._pending_restart = None
 
-        await self.start()
-        logger.info("V2Ray代理重启完成")
+            logger.info("正在重启V2Ray代理...")
+            await self._stop_process()
+
+            # 重新生成配置（可能domains已变化；内容未变化时沿用现有配置文件）
+            await self._generate_client_config()
+
+            await self.start()
+            logger.info("V2Ray代理重启完成")
 
     async def _forward_v2ray_logs(self):
-        """转发V2Ray的日志输出到Python日志系统"""
-        if not self.process:
+        """转发V2Ray的日志输出（stdout与stderr已合并）到Python日志系统"""
+        if not self.process or not self.process.stdout:
             return
 
-        # 创建V2Ray专用的logger
+        # 创建V2Ray专用的logger（非verbose模式下仅以DEBUG级别记录，DEBUG未启用时不记录）
         v2ray_logger = logging.getLogger("v2ray")
-        
-        try:
-            # 同时读取stdout和stderr
-            tasks = []
-            if self.process.stdout:
-                tasks.append(self._read_stream(self.process.stdout, v2ray_logger.info))
-            if self.process.stderr:
-                tasks.append(self._read_stream(self.process.stderr, v2ray_logger.warning))
-            
-            if tasks:
-                await asyncio.gather(*tasks, return_exceptions=True)
-                
-        except Exception as e:
-            logger.warning(f"V2Ray日志转发出错: {e}")
+        log_func: Optional[Callable[[str], None]] = None
+        if self.config.verbose:
+            log_func = v2ray_logger.info
+        elif v2ray_logger.isEnabledFor(logging.DEBUG):
+            log_func = v2ray_logger.debug
 
-    async def _read_stream(self, stream, log_func):
-        """读取流并记录日志"""
+        await self._read_stream(self.process.stdout, log_func, self._output_tail)
+
+    async def _read_stream(self, stream, log_func, tail: Optional[collections.deque] = None):
+        """读取流并记录日志
+
+        log_func为None时不记录日志：V2Ray报告启动完成后只排空管道，不再逐行解码。
+        tail不为None时保存原始的末尾若干行。
+        """
         try:
-            while True:
-                line = await asyncio.to_thread(stream.readline)
-                if not line:  # EOF
-                    break
-                
+            async for raw in stream:
+                if tail is not None:
+                    tail.append(raw)
+                if log_func is None and self._ready_event.is_set():
+                    continue
+
                 # 清理行尾并记录日志
-                line = line.strip()
+                line = raw.decode(errors='replace').strip()
                 if line:  # 只记录非空行
-                    log_func(line)
+                    if log_func is not None:
+                        log_func(line)
+                    if not self._ready_event.is_set() and _STARTED_PATTERN.search(line):
+                        self._ready_event.set()
                     
         except Exception as e:
-            logger.warning(f"读取V2Ray日志流时出错: {e}")
+            logger.warning("读取V2Ray日志流时出错: %s", e)
 
     def is_running(self) -> bool:
         """检查V2Ray是否正在运行"""
-        return self.process is not None and self.process.poll() is None
+        return self.process is not None and self.process.returncode is None
@@ -0,0 +1,38 @@
+"""测试公共夹具"""
+
+import pytest
+
+# 创建Config所需的环境变量
+AZURE_ENV = {
+    "AZURE_CLIENT_ID": "test-client-id",
+    "AZURE_CLIENT_SECRET": "test-client-secret",
+    "AZURE_TENANT_ID": "test-tenant-id",
+    "AZURE_SUBSCRIPTION_ID": "test-subscription-id",
+    "V2RAY_CLIENT_ID": "550e8400-e29b-41d4-a716-446655440000",
+}
+
+
+def _apply_azure_env(mp):
+    """设置必需的环境变量，并移除可能影响默认值的可选环境变量"""
+    for key, value in AZURE_ENV.items():
+        mp.setenv(key, value)
+    for key in ("DOMAIN_FILE", "V2RAY_PORT", "AZURE_RESOURCE_GROUP", "RECREATE_RESOURCES"):
+        mp.delenv(key, raising=False)
+
+
+@pytest.fixture
+def azure_env(monkeypatch):
+    """设置创建Config所需的环境变量（测试结束后自动恢复）
+
+    返回monkeypatch以便测试追加设置。
+    """
+    _apply_azure_env(monkeypatch)
+    return monkeypatch
+
+
+@pytest.fixture(scope="class")
+def class_azure_env():
+    """类级别的azure_env，供按类共享的夹具使用（类中测试结束后恢复）"""
+    with pytest.MonkeyPatch.context() as mp:
+        _apply_azure_env(mp)
+        yield mp
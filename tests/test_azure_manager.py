@@ -1,33 +1,77 @@
+import asyncio
+import copy
 import pytest
-import os
 import json
 import hashlib
 from unittest.mock import Mock, AsyncMock, patch
 from src.config import Config
-from src.azure_manager import AzureManager
+from azure.mgmt.core.polling.async_arm_polling import AsyncARMPolling
+from src.azure_manager import AzureManager, LRO_POLLING_INTERVAL, RETRY_JITTER
+
+
+async def _async_iter(items):
+    """模拟aio SDK返回的异步分页结果"""
+    for item in items:
+        yield item
+
+
+def _file_properties(content_md5):
+    """模拟存储文件属性"""
+    properties = Mock()
+    properties.content_settings.content_md5 = content_md5
+    return properties
+
+
+def _mock_aio_client():
+    """模拟aio存储客户端（方法均可await）"""
+    return AsyncMock()
+
+
+def _mock_share_service(share_client=None, file_client=None):
+    """模拟文件服务客户端及其派生的文件共享/文件客户端"""
+    share_client = share_client or _mock_aio_client()
+    share_client.get_file_client = Mock(return_value=file_client or _mock_aio_client())
+    service = _mock_aio_client()
+    service.get_share_client = Mock(return_value=share_client)
+    return service
+
+
+# 模拟配置的默认属性，每个测试前重新设置
+_CONFIG_ATTRS = {
+    "azure_client_id": "test-client-id",
+    "azure_client_secret": "test-client-secret",
+    "azure_tenant_id": "test-tenant-id",
+    "azure_subscription_id": "test-subscription-id",
+    "azure_resource_group": "test-rg",
+    "azure_location": "eastus",
+    "v2ray_client_id": "550e8400-e29b-41d4-a716-446655440000",
+    "storage_account_name": "teststore",
+    "storage_file_share_name": "test-config",
+    "storage_file_name": "config.json",
+    "container_group_name": "test-container",
+    "container_name": "v2ray",
+    "container_image": "v2fly/v2fly-core:latest",
+    "v2ray_port": 443,
+    "v2ray_path": "/v2ray",
+    "azure_max_concurrency": 8,
+    "recreate_resources": False,
+    "persist_token_cache": False,
+    "storage_max_concurrency": 16,
+}
+
+
+@pytest.fixture(scope="module")
+def mock_config():
+    """模拟配置（模块内共享，由_reset_mock_config在每个测试前复位）"""
+    return Mock(spec=Config)
 
 
-@pytest.fixture
-def mock_config():
-    """模拟配置"""
-    config = Mock(spec=Config)
-    config.azure_client_id = "test-client-id"
-    config.azure_client_secret = "test-client-secret"
-    config.azure_tenant_id = "test-tenant-id"
-    config.azure_subscription_id = "test-subscription-id"
-    config.azure_resource_group = "test-rg"
-    config.azure_location = "eastus"
-    config.v2ray_client_id = "550e8400-e29b-41d4-a716-446655440000"
-    config.storage_account_name = "teststore"
-    config.storage_file_share_name = "test-config"
-    config.storage_file_name = "config.json"
-    config.container_group_name = "test-container"
-    config.container_name = "v2ray"
-    config.container_image = "v2fly/v2fly-core:latest"
-    config.v2ray_port = 443
-    config.v2ray_path = "/v2ray"
-    config.get_unique_name = Mock(side_effect=lambda x: f"{x}-test")
-    return config
+@pytest.fixture(autouse=True)
+def _reset_mock_config(mock_config):
+    """恢复模拟配置的默认属性并清除调用记录，避免测试间互相影响"""
+    mock_config.reset_mock(return_value=True, side_effect=True)
+    mock_config.configure_mock(**_CONFIG_ATTRS)
+    mock_config.get_unique_name = Mock(side_effect=lambda x: f"{x}-test")
 
 
 @pytest.fixture
@@ -39,13 +83,14 @@ def mock_azure_manager(mock_config):
     manager.storage_client = Mock()
     manager.container_client = Mock()
     manager.storage_account_key = "test-key"
+    manager._key_cache = Mock()
+    manager._key_cache.load_with_age.return_value = None
     return manager
 
 
 class TestAzureManager:
     """Azure管理器测试"""
 
-    @pytest.mark.asyncio
     async def test_initialize(self, mock_config):
         """测试初始化"""
         manager = AzureManager(mock_config)
@@ -55,24 +100,180 @@ class TestAzureManager:
             mock_config.azure_subscription_id = None
             await manager.initialize()
 
-    @pytest.mark.asyncio
+    async def test_initialize_creates_shared_pool(self, mock_config):
+        """测试初始化创建共享连接池"""
+        manager = AzureManager(mock_config)
+
+        with patch("src.azure_manager.ClientSecretCredential") as credential_cls:
+            await manager.initialize()
+            try:
+                # 连接池大小不低于配置的并发上限
+                assert manager._http_session.connector.limit == 32
+                assert manager._http_session.connector.limit_per_host == 16
+            finally:
+                credential_cls.return_value.close = AsyncMock()
+                await manager.close()
+
+    async def test_initialize_persistent_token_cache(self, mock_config):
+        """测试启用后凭据使用持久化令牌缓存"""
+        mock_config.persist_token_cache = True
+        manager = AzureManager(mock_config)
+
+        with patch("src.azure_manager.ClientSecretCredential") as credential_cls:
+            credential_cls.return_value.close = AsyncMock()
+            await manager.initialize()
+            await manager.close()
+
+        options = credential_cls.call_args.kwargs["cache_persistence_options"]
+        assert options.name == "az-ray"
+        assert options.allow_unencrypted_storage is False
+
+    async def test_initialize_reuses_existing_clients(self, mock_azure_manager):
+        """测试重复初始化时复用现有客户端"""
+        credential = mock_azure_manager.credential
+        resource_client = mock_azure_manager.resource_client
+
+        with patch("src.azure_manager.ClientSecretCredential") as credential_cls:
+            await mock_azure_manager.initialize()
+
+        credential_cls.assert_not_called()
+        assert mock_azure_manager.credential is credential
+        assert mock_azure_manager.resource_client is resource_client
+
     async def test_ensure_resources(self, mock_azure_manager):
         """测试资源确保"""
+        containers = [Mock()]
         # 模拟所有方法
+        with patch.multiple(
+            mock_azure_manager,
+            _ensure_resource_group=AsyncMock(),
+            _ensure_storage_account=AsyncMock(),
+            _ensure_file_share=AsyncMock(),
+            _ensure_v2ray_config=AsyncMock(return_value=False),  # 返回布尔值
+            _find_existing_containers=AsyncMock(return_value=containers),
+            _ensure_container_instance=AsyncMock(),
+        ):
+            await mock_azure_manager.ensure_resources()
+
+            # 验证所有方法都被调用
+            mock_azure_manager._ensure_resource_group.assert_called_once()
+            mock_azure_manager._ensure_storage_account.assert_called_once()
+            mock_azure_manager._ensure_file_share.assert_called_once()
+            mock_azure_manager._ensure_v2ray_config.assert_called_once()
+            mock_azure_manager._find_existing_containers.assert_called_once()
+            # 传入配置更新状态和并发查询到的容器列表
+            mock_azure_manager._ensure_container_instance.assert_called_once_with(False, containers)
+
+    async def test_ensure_resources_storage_failure(self, mock_azure_manager):
+        """测试存储侧失败时异常向上传播，且不会创建容器"""
         mock_azure_manager._ensure_resource_group = AsyncMock()
-        mock_azure_manager._ensure_storage_account = AsyncMock()
-        mock_azure_manager._ensure_file_share = AsyncMock()
-        mock_azure_manager._ensure_v2ray_config = AsyncMock(return_value=False)  # 返回布尔值
+        mock_azure_manager._ensure_storage_account = AsyncMock(side_effect=RuntimeError("storage"))
+        mock_azure_manager._find_existing_containers = AsyncMock(return_value=[])
+        mock_azure_manager._ensure_container_instance = AsyncMock()
+
+        with pytest.raises(RuntimeError, match="storage"):
+            await mock_azure_manager.ensure_resources()
+
+        mock_azure_manager._find_existing_containers.assert_awaited_once()
+        mock_azure_manager._ensure_container_instance.assert_not_called()
+
+    async def test_ensure_resources_requeries_after_listing_failure(self, mock_azure_manager):
+        """测试并发的容器查询失败时，确保容器实例前重新查询，而不是当作没有容器"""
+        container = Mock()
+        mock_azure_manager._ensure_resource_group = AsyncMock()
+        mock_azure_manager._ensure_storage_resources = AsyncMock(return_value=False)
+        mock_azure_manager._find_existing_containers = AsyncMock(side_effect=[RuntimeError("list"), [container]])
+        mock_azure_manager._is_container_location_valid = AsyncMock(return_value=True)
+        mock_azure_manager._create_new_container_instance = AsyncMock()
+
+        await mock_azure_manager.ensure_resources()
+
+        assert mock_azure_manager._find_existing_containers.await_count == 2
+        mock_azure_manager._create_new_container_instance.assert_not_called()
+
+    async def test_ensure_resources_lists_containers_during_resource_group_check(self, mock_azure_manager):
+        """测试容器查询与资源组检查并发进行"""
+        listing_started = asyncio.Event()
+
+        async def find_containers():
+            listing_started.set()
+            return []
+
+        async def ensure_resource_group():
+            # 资源组检查完成前容器查询已经开始
+            await asyncio.wait_for(listing_started.wait(), timeout=1)
+
+        mock_azure_manager._find_existing_containers = find_containers
+        mock_azure_manager._ensure_resource_group = ensure_resource_group
+        mock_azure_manager._ensure_storage_resources = AsyncMock(return_value=True)
         mock_azure_manager._ensure_container_instance = AsyncMock()
 
         await mock_azure_manager.ensure_resources()
 
-        # 验证所有方法都被调用
-        mock_azure_manager._ensure_resource_group.assert_called_once()
-        mock_azure_manager._ensure_storage_account.assert_called_once()
-        mock_azure_manager._ensure_file_share.assert_called_once()
-        mock_azure_manager._ensure_v2ray_config.assert_called_once()
-        mock_azure_manager._ensure_container_instance.assert_called_once_with(False)  # 传入配置更新状态
+        mock_azure_manager._ensure_container_instance.assert_awaited_once_with(True, [])
+
+    async def test_close(self, mock_azure_manager):
+        """测试关闭客户端和凭据"""
+        clients = [
+            mock_azure_manager.credential,
+            mock_azure_manager.resource_client,
+            mock_azure_manager.storage_client,
+            mock_azure_manager.container_client,
+        ]
+        for client in clients:
+            client.close = AsyncMock()
+
+        await mock_azure_manager.close()
+
+        for client in clients:
+            client.close.assert_awaited_once()
+        assert mock_azure_manager.credential is None
+        assert mock_azure_manager.container_client is None
+
+        # 重复关闭不会出错
+        await mock_azure_manager.close()
+
+    async def test_ensure_resource_group_retries_transient_errors(self, mock_azure_manager):
+        """测试资源组检查遇到限流时按Retry-After重试"""
+        from azure.core.exceptions import HttpResponseError
+
+        response = Mock(status_code=429)
+        response.headers = {"retry-after": "3"}
+        throttled = HttpResponseError(message="Too Many Requests", response=response)
+        mock_azure_manager.resource_client.resource_groups.get = AsyncMock(side_effect=[throttled, Mock()])
+
+        with patch('src.utils.asyncio.sleep', new_callable=AsyncMock) as mock_sleep:
+            await mock_azure_manager._ensure_resource_group()
+
+        assert mock_azure_manager.resource_client.resource_groups.get.await_count == 2
+        mock_sleep.assert_awaited_once_with(3.0)
+
+    async def test_ensure_resource_group_retry_backoff_has_jitter(self, mock_azure_manager):
+        """测试没有Retry-After时，重试延迟在退避时间上加入随机抖动"""
+        from azure.core.exceptions import HttpResponseError
+
+        unavailable = HttpResponseError(message="Service Unavailable", response=Mock(status_code=503, headers={}))
+        mock_azure_manager.resource_client.resource_groups.get = AsyncMock(side_effect=[unavailable, Mock()])
+
+        with patch('src.utils.asyncio.sleep', new_callable=AsyncMock) as mock_sleep, \
+                patch('src.utils.random.random', return_value=1.0):
+            await mock_azure_manager._ensure_resource_group()
+
+        mock_sleep.assert_awaited_once_with(1.0 * (1 + RETRY_JITTER))
+
+    async def test_ensure_resource_group_does_not_retry_client_errors(self, mock_azure_manager):
+        """测试资源组检查遇到4xx错误（408/429除外）时不重试"""
+        from azure.core.exceptions import HttpResponseError
+
+        forbidden = HttpResponseError(message="Forbidden", response=Mock(status_code=403, headers={}))
+        mock_azure_manager.resource_client.resource_groups.get = AsyncMock(side_effect=forbidden)
+
+        with patch('src.utils.asyncio.sleep', new_callable=AsyncMock) as mock_sleep, \
+                pytest.raises(HttpResponseError):
+            await mock_azure_manager._ensure_resource_group()
+
+        mock_azure_manager.resource_client.resource_groups.get.assert_awaited_once()
+        mock_sleep.assert_not_awaited()
 
     def test_generate_v2ray_config(self, mock_azure_manager):
         """测试V2Ray配置生成"""
@@ -86,72 +287,36 @@ class TestAzureManager:
         client_id = config["inbounds"][0]["settings"]["clients"][0]["id"]
         assert client_id == "550e8400-e29b-41d4-a716-446655440000"
 
-    def test_v2ray_port_env_override(self):
+    def test_v2ray_port_env_override(self, azure_env):
         """测试V2RAY_PORT环境变量override功能"""
-        import os
-        
-        # 保存原始环境变量
-        original_port = os.environ.get("V2RAY_PORT")
-        
-        try:
-            # 测试默认端口
-            os.environ.pop("V2RAY_PORT", None)
-            
-            # 设置必需的环境变量
-            os.environ["AZURE_CLIENT_ID"] = "test-client"
-            os.environ["AZURE_CLIENT_SECRET"] = "test-secret"
-            os.environ["AZURE_TENANT_ID"] = "test-tenant"
-            os.environ["AZURE_SUBSCRIPTION_ID"] = "test-subscription"
-            os.environ["V2RAY_CLIENT_ID"] = "550e8400-e29b-41d4-a716-446655440000"
-            
-            config = Config()
-            # 测试默认端口为443（WebSocket）
-            assert config.v2ray_port == 443, f"期望默认端口443（WebSocket），实际{config.v2ray_port}"
-            
-            # 测试环境变量override
-            os.environ["V2RAY_PORT"] = "8443"
-            config2 = Config()
-            assert config2.v2ray_port == 8443, f"期望override端口8443，实际{config2.v2ray_port}"
-            
-        finally:
-            # 恢复环境变量
-            if original_port:
-                os.environ["V2RAY_PORT"] = original_port
-            else:
-                os.environ.pop("V2RAY_PORT", None)
-                
-            # 清理测试用的环境变量
-            test_vars = ["AZURE_CLIENT_ID", "AZURE_CLIENT_SECRET", "AZURE_TENANT_ID",
-                         "AZURE_SUBSCRIPTION_ID", "V2RAY_CLIENT_ID"]
-            for var in test_vars:
-                os.environ.pop(var, None)
+        config = Config()
+        # 测试默认端口为443（WebSocket）
+        assert config.v2ray_port == 443, f"期望默认端口443（WebSocket），实际{config.v2ray_port}"
+
+        # 测试环境变量override
+        azure_env.setenv("V2RAY_PORT", "8443")
+        config2 = Config()
+        assert config2.v2ray_port == 8443, f"期望override端口8443，实际{config2.v2ray_port}"
 
 
 class TestAzureManagerContainerOperations:
     """测试新的容器管理操作"""
     
+    @pytest.fixture(scope="class")
+    @classmethod
+    def base_config(cls, class_azure_env):
+        """每个测试类只解析一次环境变量创建的配置"""
+        class_azure_env.setenv("AZURE_RESOURCE_GROUP", "test-rg")
+        return Config()
+
     @pytest.fixture(autouse=True)
-    def setup_method(self):
+    def setup_method(self, base_config):
         """测试前设置"""
-        os.environ["AZURE_CLIENT_ID"] = "test-client-id"
-        os.environ["AZURE_CLIENT_SECRET"] = "test-client-secret"
-        os.environ["AZURE_TENANT_ID"] = "test-tenant-id"
-        os.environ["AZURE_SUBSCRIPTION_ID"] = "test-subscription-id"
-        os.environ["AZURE_RESOURCE_GROUP"] = "test-rg"
-        os.environ["V2RAY_CLIENT_ID"] = "550e8400-e29b-41d4-a716-446655440000"
-        
-        self.config = Config()
+        # 浅拷贝配置，测试（及AzureManager）修改的属性不会影响其他测试
+        self.config = copy.copy(base_config)
         self.azure_manager = AzureManager(self.config)
-        
-        # Cleanup after test
-        yield
-        test_vars = ["AZURE_CLIENT_ID", "AZURE_CLIENT_SECRET", "AZURE_TENANT_ID",
-                     "AZURE_SUBSCRIPTION_ID", "AZURE_RESOURCE_GROUP", "V2RAY_CLIENT_ID"]
-        for var in test_vars:
-            os.environ.pop(var, None)
-    
+
     @patch('src.azure_manager.ContainerInstanceManagementClient')
-    @pytest.mark.asyncio
     async def test_find_existing_containers(self, mock_client_class):
         """测试查找现有容器"""
         # 模拟客户端
@@ -175,9 +340,9 @@ class TestAzureManagerContainerOperations:
         mock_container3.location = "eastus"
         mock_container3.instance_view.current_state.state = "Running"
         
-        mock_client.container_groups.list_by_resource_group.return_value = [
+        mock_client.container_groups.list_by_resource_group.return_value = _async_iter([
             mock_container1, mock_container2, mock_container3
-        ]
+        ])
         
         # 测试查找
         containers = await self.azure_manager._find_existing_containers()
@@ -187,8 +352,40 @@ class TestAzureManagerContainerOperations:
         assert containers[0].name == "azraycontainer-20240101120000"
         assert containers[1].name == "azraycontainer-20240101130000"
     
+    async def test_find_existing_containers_failure_raises(self):
+        """测试查询容器失败时抛出异常且不缓存，而不是返回空列表"""
+        mock_client = Mock()
+        self.azure_manager.container_client = mock_client
+        mock_client.container_groups.list_by_resource_group.side_effect = RuntimeError("list failed")
+
+        with pytest.raises(RuntimeError, match="list failed"):
+            await self.azure_manager._find_existing_containers()
+        assert self.azure_manager._containers_cache is None
+
+    async def test_find_existing_containers_cached(self):
+        """测试容器列表在有效期内复用，并发查询合并，创建容器后失效"""
+        mock_client = Mock()
+        self.azure_manager.container_client = mock_client
+
+        mock_container = Mock()
+        mock_container.name = "azraycontainer-20240101120000"
+        mock_client.container_groups.list_by_resource_group.side_effect = (
+            lambda rg: _async_iter([mock_container])
+        )
+
+        results = await asyncio.gather(
+            self.azure_manager._find_existing_containers(),
+            self.azure_manager._find_existing_containers(),
+        )
+        assert results == [[mock_container], [mock_container]]
+        assert mock_client.container_groups.list_by_resource_group.call_count == 1
+
+        # 创建新容器后缓存失效
+        self.azure_manager._invalidate_container_cache()
+        await self.azure_manager._find_existing_containers()
+        assert mock_client.container_groups.list_by_resource_group.call_count == 2
+
     @patch('src.azure_manager.ContainerInstanceManagementClient')
-    @pytest.mark.asyncio
     async def test_cleanup_old_containers(self, mock_client_class):
         """测试清理旧容器"""
         # 模拟客户端
@@ -208,17 +405,60 @@ class TestAzureManagerContainerOperations:
             return [mock_container1, mock_container2]
         
         self.azure_manager._find_existing_containers = mock_find
+        mock_client.container_groups.begin_delete = AsyncMock()
         
         # 测试清理，保留当前容器
         await self.azure_manager._cleanup_old_containers(keep_current="azraycontainer-current")
         
         # 验证只删除了旧容器
-        mock_client.container_groups.begin_delete.assert_called_once_with(
+        mock_client.container_groups.begin_delete.assert_awaited_once_with(
             self.config.azure_resource_group, "azraycontainer-old"
         )
     
+    async def test_restart_container(self):
+        """测试重启容器时复用创建前的容器列表清理旧容器"""
+        mock_client = Mock()
+        mock_client.container_groups.begin_delete = AsyncMock()
+        self.azure_manager.container_client = mock_client
+
+        old_container = Mock()
+        old_container.name = "azraycontainer-old"
+        self.azure_manager._find_existing_containers = AsyncMock(return_value=[old_container])
+        self.azure_manager._create_new_container_instance = AsyncMock(return_value="azraycontainer-new")
+
+        await self.azure_manager.restart_container()
+
+        # 只在创建前查询一次
+        self.azure_manager._find_existing_containers.assert_awaited_once()
+        mock_client.container_groups.begin_delete.assert_awaited_once_with(
+            self.config.azure_resource_group, "azraycontainer-old"
+        )
+        assert self.config.container_group_name == "azraycontainer-new"
+
+    async def test_get_container_ip_uses_created_container_group(self):
+        """测试创建容器后直接使用创建结果获取IP，无需再次查询"""
+        mock_client = Mock()
+        created = Mock()
+        created.ip_address.ip = "1.2.3.4"
+        poller = Mock()
+        poller.result = AsyncMock(return_value=created)
+        mock_client.container_groups.begin_create_or_update = AsyncMock(return_value=poller)
+        self.azure_manager.container_client = mock_client
+        self.azure_manager.storage_account_key = "test-key"
+        self.azure_manager._get_active_container = AsyncMock()
+
+        await self.azure_manager._create_new_container_instance()
+
+        assert await self.azure_manager.get_container_ip() == "1.2.3.4"
+        self.azure_manager._get_active_container.assert_not_called()
+
+        # 强制刷新时重新查询，未找到容器时不缓存
+        self.azure_manager._get_active_container.return_value = None
+        assert await self.azure_manager._get_container_group(force=True) is None
+        self.azure_manager._get_active_container.assert_awaited_once()
+        assert self.azure_manager._container_group_cache is None
+
     @patch('src.azure_manager.ContainerInstanceManagementClient')
-    @pytest.mark.asyncio
     async def test_create_new_container_instance(self, mock_client_class):
         """测试创建新容器实例"""
         # 模拟客户端
@@ -231,14 +471,18 @@ class TestAzureManagerContainerOperations:
         
         # 模拟创建操作
         mock_operation = Mock()
-        mock_operation.result.return_value = Mock(name="azraycontainer-20240101140000")
-        mock_client.container_groups.begin_create_or_update.return_value = mock_operation
+        mock_operation.result = AsyncMock(return_value=Mock(name="azraycontainer-20240101140000"))
+        mock_client.container_groups.begin_create_or_update = AsyncMock(return_value=mock_operation)
         
         # 测试创建
         container_name = await self.azure_manager._create_new_container_instance()
         
         # 验证调用
-        mock_client.container_groups.begin_create_or_update.assert_called_once()
+        mock_client.container_groups.begin_create_or_update.assert_awaited_once()
+        # 使用较短间隔轮询LRO，而非SDK默认的30秒
+        polling = mock_client.container_groups.begin_create_or_update.call_args.kwargs["polling"]
+        assert isinstance(polling, AsyncARMPolling)
+        assert polling._timeout == LRO_POLLING_INTERVAL
         assert container_name == "azraycontainer-20240101140000"
 
 
@@ -250,91 +494,331 @@ class TestAzureManagerConfigValidation:
         """Azure管理器实例"""
         manager = AzureManager(mock_config)
         manager.storage_account_key = "test-key"
+        manager._key_cache = Mock()
+        manager._key_cache.load_with_age.return_value = None
         return manager
 
-    @pytest.mark.asyncio
-    async def test_ensure_v2ray_config_no_update_needed(self, azure_manager):
-        """测试配置文件无需更新的情况"""
-        # 模拟当前配置与期望配置一致
+    @pytest.mark.parametrize("stored_md5, expected_result", [
+        ("current", False),  # Content-MD5与期望一致：无需更新
+        (b"old-md5", True),  # 配置已变化：重新上传
+        (None, True),        # 文件不存在：创建文件
+    ], ids=["no_update_needed", "update_needed", "file_not_exists"])
+    async def test_ensure_v2ray_config(self, azure_manager, stored_md5, expected_result):
+        """测试根据存储文件的Content-MD5决定是否上传配置，且无需下载文件"""
+        from azure.core.exceptions import ResourceNotFoundError
+
+        azure_manager._generate_v2ray_config = Mock(return_value={"test": "config"})
+        azure_manager._get_current_config_from_storage = AsyncMock()
+        expected_md5 = hashlib.md5(azure_manager._v2ray_config_bytes).digest()
+
+        with patch('src.azure_manager.ShareServiceClient') as mock_service_client:
+            mock_client = _mock_aio_client()
+            mock_service_client.return_value = _mock_share_service(file_client=mock_client)
+            if stored_md5 is None:
+                mock_client.get_file_properties.side_effect = ResourceNotFoundError("File not found")
+            else:
+                md5 = expected_md5 if stored_md5 == "current" else stored_md5
+                mock_client.get_file_properties.return_value = _file_properties(bytearray(md5))
+
+            result = await azure_manager._ensure_v2ray_config()
+
+        assert result is expected_result
+        azure_manager._get_current_config_from_storage.assert_not_called()
+        if expected_result:
+            mock_client.upload_file.assert_awaited_once()
+            content_settings = mock_client.upload_file.call_args.kwargs["content_settings"]
+            assert bytes(content_settings.content_md5) == expected_md5
+        else:
+            mock_client.upload_file.assert_not_called()
+
+    async def test_ensure_v2ray_config_legacy_file_without_md5(self, azure_manager):
+        """测试旧文件没有Content-MD5但内容一致时，补写MD5而不重新上传"""
         expected_config = {"test": "config"}
         azure_manager._generate_v2ray_config = Mock(return_value=expected_config)
         azure_manager._get_current_config_from_storage = AsyncMock(return_value=expected_config)
 
-        with patch('src.azure_manager.ShareFileClient'):
+        with patch('src.azure_manager.ShareServiceClient') as mock_service_client:
+            mock_client = _mock_aio_client()
+            mock_service_client.return_value = _mock_share_service(file_client=mock_client)
+            mock_client.get_file_properties.return_value = _file_properties(None)
+
             result = await azure_manager._ensure_v2ray_config()
 
         assert result is False  # 无更新
-        azure_manager._get_current_config_from_storage.assert_called_once()
-
-    @pytest.mark.asyncio
-    async def test_ensure_v2ray_config_update_needed(self, azure_manager):
-        """测试配置文件需要更新的情况"""
-        # 模拟当前配置与期望配置不一致
-        current_config = {"test": "old_config"}
-        expected_config = {"test": "new_config"}
-        
-        azure_manager._generate_v2ray_config = Mock(return_value=expected_config)
-        azure_manager._get_current_config_from_storage = AsyncMock(return_value=current_config)
+        mock_client.set_http_headers.assert_awaited_once()
+        mock_client.upload_file.assert_not_called()
 
-        with patch('src.azure_manager.ShareFileClient') as mock_file_client:
-            mock_client = Mock()
-            mock_file_client.return_value = mock_client
-            
-            result = await azure_manager._ensure_v2ray_config()
+    async def test_v2ray_config_bytes_cached(self, azure_manager):
+        """测试配置只生成一次，并以紧凑JSON上传"""
+        azure_manager._generate_v2ray_config = Mock(return_value={"b": 1, "a": [1, 2]})
 
-        assert result is True  # 有更新
-        mock_client.upload_file.assert_called_once()
+        with patch('src.azure_manager.ShareServiceClient') as mock_service_client:
+            mock_client = _mock_aio_client()
+            mock_service_client.return_value = _mock_share_service(file_client=mock_client)
+            mock_client.get_file_properties.return_value = _file_properties(None)
+            azure_manager._get_current_config_from_storage = AsyncMock(return_value=None)
 
-    @pytest.mark.asyncio
-    async def test_ensure_v2ray_config_file_not_exists(self, azure_manager):
-        """测试配置文件不存在的情况"""
-        expected_config = {"test": "config"}
-        azure_manager._generate_v2ray_config = Mock(return_value=expected_config)
-        azure_manager._get_current_config_from_storage = AsyncMock(return_value=None)
+            await azure_manager._ensure_v2ray_config()
+            await azure_manager._ensure_v2ray_config()
 
-        with patch('src.azure_manager.ShareFileClient') as mock_file_client:
-            mock_client = Mock()
-            mock_file_client.return_value = mock_client
-            
-            result = await azure_manager._ensure_v2ray_config()
+        azure_manager._generate_v2ray_config.assert_called_once()
+        assert mock_client.upload_file.call_args.kwargs["data"] == b'{"a":[1,2],"b":1}'
+
+    def test_dump_config_matches_stdlib_json(self, azure_manager):
+        """测试orjson与标准库json的序列化结果一致（已上传文件的MD5保持有效）"""
+        config = azure_manager._generate_v2ray_config()
+
+        with patch('src.azure_manager.orjson', None):
+            stdlib_bytes = AzureManager._dump_config(config)
+
+        assert AzureManager._dump_config(config) == stdlib_bytes
+
+    async def test_ensure_storage_account_created_skips_readiness_checks(self, azure_manager):
+        """测试新建存储账户的LRO结果已为Succeeded时，不再查询预配状态或探测文件服务"""
+        from azure.core.exceptions import ResourceNotFoundError
+
+        azure_manager.config.get_unique_storage_name = Mock(return_value="teststore1")
+        accounts = Mock()
+        accounts.get_properties = AsyncMock(side_effect=ResourceNotFoundError("not found"))
+        poller = Mock()
+        poller.result = AsyncMock(return_value=Mock(provisioning_state="Succeeded"))
+        accounts.begin_create = AsyncMock(return_value=poller)
+        key = Mock(value="new-key")
+        accounts.list_keys = AsyncMock(return_value=Mock(keys=[key]))
+        azure_manager.storage_client = Mock(storage_accounts=accounts)
+
+        with patch('src.azure_manager.ShareClient') as mock_share_client:
+            await azure_manager._ensure_storage_account()
+
+        accounts.get_properties.assert_awaited_once()  # 仅初始存在性检查
+        mock_share_client.assert_not_called()
+        assert azure_manager.storage_account_key == "new-key"
+        assert azure_manager._storage_account_created is True
+        azure_manager.config.set_storage_account_name.assert_called_once_with("teststore1")
+
+    async def test_ensure_storage_account_recent_cache_skips_arm(self, azure_manager):
+        """测试本地缓存的密钥足够新时不发起任何ARM请求"""
+        azure_manager.config.get_unique_storage_name = Mock(return_value="teststore1")
+        azure_manager._key_cache.load_with_age.return_value = ("cached-key", 60.0)
+        azure_manager.storage_client = Mock()
+
+        await azure_manager._ensure_storage_account()
+
+        assert azure_manager.storage_account_key == "cached-key"
+        azure_manager.config.set_storage_account_name.assert_called_once_with("teststore1")
+        assert not azure_manager.storage_client.mock_calls
+        assert azure_manager._storage_account_unverified is True
+
+    async def test_wait_for_storage_account_ready_lists_keys_once(self, azure_manager):
+        """测试等待存储账户就绪的重试过程中只获取一次密钥"""
+        key = Mock(value="new-key")
+        accounts = Mock()
+        accounts.get_properties = AsyncMock(return_value=Mock(provisioning_state="Succeeded"))
+        accounts.list_keys = AsyncMock(return_value=Mock(keys=[key]))
+        azure_manager.storage_client = Mock(storage_accounts=accounts)
+
+        with patch('src.azure_manager.ShareClient') as mock_share_client, \
+                patch('src.utils.asyncio.sleep', new_callable=AsyncMock):
+            share_client = mock_share_client.return_value.__aenter__.return_value
+            share_client.get_share_properties = AsyncMock(
+                side_effect=[Exception("AuthenticationFailed"), None]
+            )
+            result = await azure_manager._wait_for_storage_account_ready("teststore1")
+
+        assert result == "new-key"
+        assert share_client.get_share_properties.await_count == 2
+        accounts.list_keys.assert_awaited_once()
+
+    async def test_storage_account_readiness_wait_not_retried_again(self, azure_manager):
+        """测试等待存储账户就绪耗尽重试后，外层的瞬时错误重试不再整体重复等待"""
+        from azure.core.exceptions import ServiceRequestError
+
+        azure_manager.config.get_unique_storage_name = Mock(return_value="teststore1")
+        accounts = Mock()
+        accounts.get_properties = AsyncMock(return_value=Mock(provisioning_state="Creating"))
+        azure_manager.storage_client = Mock(storage_accounts=accounts)
+        azure_manager._poll_storage_account_ready = AsyncMock(side_effect=ServiceRequestError("DNS"))
+
+        with patch('src.utils.asyncio.sleep', new_callable=AsyncMock), \
+                pytest.raises(RuntimeError, match="等待存储账户就绪失败"):
+            await azure_manager._ensure_storage_account()
+
+        azure_manager._poll_storage_account_ready.assert_awaited_once_with("teststore1")
+        accounts.get_properties.assert_awaited_once()
+
+    async def test_ensure_file_share_already_exists(self, azure_manager):
+        """测试文件共享已存在时直接创建失败即视为成功，无需额外查询"""
+        from azure.core.exceptions import ResourceExistsError
+
+        with patch('src.azure_manager.ShareServiceClient') as mock_service_client:
+            mock_client = _mock_aio_client()
+            mock_service_client.return_value = _mock_share_service(share_client=mock_client)
+            mock_client.create_share.side_effect = ResourceExistsError("Share exists")
+
+            await azure_manager._ensure_file_share()
+
+        mock_client.create_share.assert_awaited_once_with(quota=1)
+        mock_client.get_share_properties.assert_not_called()
+
+    @pytest.mark.parametrize("operation", ["_ensure_file_share", "_ensure_v2ray_config"])
+    async def test_file_operations_do_not_retry_client_errors(self, azure_manager, operation):
+        """测试创建文件共享和上传配置遇到4xx错误（408/429除外）时不重试"""
+        from azure.core.exceptions import HttpResponseError
+
+        forbidden = HttpResponseError(message="Forbidden", response=Mock(status_code=403, headers={}))
+        client = _mock_aio_client()
+        client.create_share.side_effect = forbidden
+        client.get_file_properties.side_effect = Exception("probe failed")
+        client.upload_file.side_effect = forbidden
+
+        with patch('src.azure_manager.ShareServiceClient',
+                   return_value=_mock_share_service(share_client=client, file_client=client)), \
+                patch('src.utils.asyncio.sleep', new_callable=AsyncMock) as mock_sleep, \
+                pytest.raises(HttpResponseError):
+            await getattr(azure_manager, operation)()
+
+        mock_sleep.assert_not_awaited()
+
+    def test_share_clients_derived_from_one_service_client(self, azure_manager):
+        """测试文件共享和文件客户端由同一个文件服务客户端派生"""
+        with patch('src.azure_manager.ShareServiceClient') as mock_service_client:
+            mock_service_client.return_value = _mock_share_service()
+
+            file_client = azure_manager._get_file_client()
+            assert azure_manager._get_share_client().get_file_client.return_value is file_client
+            assert azure_manager._get_file_client() is file_client
+
+        mock_service_client.assert_called_once()
+        assert mock_service_client.call_args.kwargs["credential"] == "test-key"
+
+    async def test_ensure_file_share_waits_for_new_account(self, azure_manager):
+        """测试新建存储账户的文件服务未就绪时，先等待文件服务再重试创建"""
+        from azure.core.exceptions import ServiceRequestError
+
+        azure_manager._storage_account_created = True
+        azure_manager._wait_for_file_service = AsyncMock()
+        share_client = _mock_aio_client()
+        share_client.create_share.side_effect = [ServiceRequestError("DNS"), None]
+
+        with patch('src.azure_manager.ShareServiceClient', return_value=_mock_share_service(share_client=share_client)), \
+                patch('src.utils.asyncio.sleep', new_callable=AsyncMock):
+            await azure_manager._ensure_file_share()
+
+        azure_manager._wait_for_file_service.assert_awaited_once_with("teststore", "test-key")
+        assert share_client.create_share.await_count == 2
+        assert azure_manager._storage_account_created is False
+
+    async def test_ensure_file_share_rechecks_account_after_cache_hit(self, azure_manager):
+        """测试使用缓存密钥访问文件共享失败时，清除缓存并完整检查存储账户后重试"""
+        from azure.core.exceptions import ServiceRequestError
+
+        azure_manager._storage_account_unverified = True
+        azure_manager._account_keys["teststore"] = "test-key"
+        azure_manager._ensure_storage_account = AsyncMock()
+        share_client = _mock_aio_client()
+        share_client.create_share.side_effect = [ServiceRequestError("DNS"), None]
+
+        with patch('src.azure_manager.ShareServiceClient', return_value=_mock_share_service(share_client=share_client)), \
+                patch('src.utils.asyncio.sleep', new_callable=AsyncMock):
+            await azure_manager._ensure_file_share()
+
+        azure_manager._key_cache.clear.assert_called_once()
+        azure_manager._ensure_storage_account.assert_awaited_once_with(use_cache=False)
+        assert "teststore" not in azure_manager._account_keys
+        assert azure_manager._storage_account_unverified is False
+        assert share_client.create_share.await_count == 2
+
+    async def test_cached_key_fallback_rechecks_same_account(self, azure_env):
+        """测试缓存密钥失效后的完整检查使用同一个存储账户名（不重复追加唯一后缀）"""
+        from azure.core.exceptions import ClientAuthenticationError
+
+        config = Config()
+        manager = AzureManager(config)
+        manager._key_cache = Mock()
+        manager._key_cache.load_with_age.return_value = ("stale-key", 60.0)
+        accounts = Mock()
+        accounts.get_properties = AsyncMock(return_value=Mock(provisioning_state="Succeeded"))
+        accounts.list_keys = AsyncMock(return_value=Mock(keys=[Mock(value="new-key")]))
+        manager.storage_client = Mock(storage_accounts=accounts)
+
+        stale_client = _mock_aio_client()
+        stale_client.create_share.side_effect = ClientAuthenticationError("AuthenticationFailed")
+        fresh_client = _mock_aio_client()
+
+        await manager._ensure_storage_account()
+        assert config.storage_account_name == "azraystore550e8400"
+
+        with patch('src.azure_manager.ShareServiceClient', side_effect=[
+                _mock_share_service(share_client=stale_client),
+                _mock_share_service(share_client=fresh_client),
+        ]), patch('src.utils.asyncio.sleep', new_callable=AsyncMock):
+            await manager._ensure_file_share()
+
+        accounts.get_properties.assert_awaited_once_with("az-ray-rg", "azraystore550e8400")
+        accounts.list_keys.assert_awaited_once_with("az-ray-rg", "azraystore550e8400")
+        assert config.storage_account_name == "azraystore550e8400"
+        assert manager.storage_account_key == "new-key"
+        fresh_client.create_share.assert_awaited_once_with(quota=1)
+
+    async def test_ensure_file_share_refreshes_key_on_auth_failure(self, azure_manager):
+        """测试认证失败时刷新存储账户密钥并使用新客户端重试"""
+        from azure.core.exceptions import ClientAuthenticationError
+
+        azure_manager.storage_client = Mock()
+        new_key = Mock()
+        new_key.value = "new-key"
+        azure_manager.storage_client.storage_accounts.list_keys = AsyncMock(
+            return_value=Mock(keys=[new_key])
+        )
+
+        stale_client = _mock_aio_client()
+        stale_client.create_share.side_effect = ClientAuthenticationError("AuthenticationFailed")
+        fresh_client = _mock_aio_client()
+
+        stale_service = _mock_share_service(share_client=stale_client)
+        fresh_service = _mock_share_service(share_client=fresh_client)
+
+        with patch('src.azure_manager.ShareServiceClient', side_effect=[stale_service, fresh_service]) as mock_service_client, \
+                patch('src.utils.asyncio.sleep', new_callable=AsyncMock):
+            await azure_manager._ensure_file_share()
 
-        assert result is True  # 需要创建文件
-        mock_client.upload_file.assert_called_once()
+        assert azure_manager.storage_account_key == "new-key"
+        azure_manager._key_cache.save.assert_called_once_with("teststore", "new-key")
+        assert mock_service_client.call_args.kwargs["credential"] == "new-key"
+        stale_service.close.assert_awaited_once()
+        fresh_client.create_share.assert_awaited_once_with(quota=1)
 
-    @pytest.mark.asyncio
     async def test_get_current_config_from_storage_success(self, azure_manager):
         """测试成功获取存储配置"""
         config_data = {"test": "config"}
         config_json = json.dumps(config_data)
 
-        with patch('src.azure_manager.ShareFileClient') as mock_file_client:
-            mock_client = Mock()
-            mock_file_client.return_value = mock_client
+        with patch('src.azure_manager.ShareServiceClient') as mock_service_client:
+            mock_client = _mock_aio_client()
+            mock_service_client.return_value = _mock_share_service(file_client=mock_client)
             
             # 模拟下载流
             mock_stream = Mock()
-            mock_stream.readall.return_value = config_json.encode('utf-8')
+            mock_stream.readall = AsyncMock(return_value=config_json.encode('utf-8'))
             mock_client.download_file.return_value = mock_stream
             
             result = await azure_manager._get_current_config_from_storage()
 
         assert result == config_data
 
-    @pytest.mark.asyncio
     async def test_get_current_config_from_storage_not_found(self, azure_manager):
         """测试配置文件不存在"""
         from azure.core.exceptions import ResourceNotFoundError
 
-        with patch('src.azure_manager.ShareFileClient') as mock_file_client:
-            mock_client = Mock()
-            mock_file_client.return_value = mock_client
+        with patch('src.azure_manager.ShareServiceClient') as mock_service_client:
+            mock_client = _mock_aio_client()
+            mock_service_client.return_value = _mock_share_service(file_client=mock_client)
             mock_client.download_file.side_effect = ResourceNotFoundError("File not found")
             
             result = await azure_manager._get_current_config_from_storage()
 
         assert result is None
 
-    @pytest.mark.asyncio
     async def test_is_container_location_valid(self, azure_manager):
         """测试容器位置验证"""
         # 模拟容器对象
@@ -351,7 +835,6 @@ class TestAzureManagerConfigValidation:
         result = await azure_manager._is_container_location_valid(container)
         assert result is False
 
-    @pytest.mark.asyncio
     async def test_get_active_container_with_config_updated(self, azure_manager):
         """测试配置更新时的容器检查"""
         # 模拟容器列表
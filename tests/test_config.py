@@ -0,0 +1,86 @@
+"""测试Config类的存储相关配置"""
+
+import pytest
+
+from src.config import Config
+
+
+@pytest.fixture
+def config(azure_env):
+    """使用测试环境变量创建配置"""
+    return Config()
+
+
+class TestConfigStorage:
+    """测试存储相关配置"""
+
+    def test_file_endpoint_url(self, config):
+        """测试文件服务终结点URL"""
+        assert config.file_endpoint_url == "https://azraystore.file.core.windows.net"
+        assert config.v2ray_config_url == (
+            "https://azraystore.file.core.windows.net/v2ray-config/config.json"
+        )
+
+    def test_set_storage_account_name_invalidates_url(self, config):
+        """测试更新存储账户名后终结点URL及配置URL随之更新"""
+        assert config.file_endpoint_url == "https://azraystore.file.core.windows.net"
+        assert config.v2ray_config_url.startswith("https://azraystore.file.core.windows.net/")
+
+        config.set_storage_account_name("azraystore550e8400")
+
+        assert config.storage_account_name == "azraystore550e8400"
+        assert config.file_endpoint_url == "https://azraystore550e8400.file.core.windows.net"
+        assert config.v2ray_config_url == (
+            "https://azraystore550e8400.file.core.windows.net/v2ray-config/config.json"
+        )
+
+
+class TestConfigConcurrency:
+    """测试并发限制配置"""
+
+    def test_concurrency_limits_from_env(self, config, monkeypatch):
+        """测试并发上限默认值及环境变量覆盖"""
+        assert config.azure_max_concurrency == 8
+        assert config.storage_max_concurrency == 16
+
+        monkeypatch.setenv("AZURE_MAX_CONCURRENCY", "4")
+        monkeypatch.setenv("STORAGE_MAX_CONCURRENCY", "2")
+        overridden = Config()
+
+        assert overridden.azure_max_concurrency == 4
+        assert overridden.storage_max_concurrency == 2
+
+
+class TestConfigRecreate:
+    """测试重新创建资源选项"""
+
+    def test_recreate_resources_from_env(self, config, monkeypatch):
+        """测试默认不重新创建，环境变量为true时启用"""
+        assert config.recreate_resources is False
+
+        monkeypatch.setenv("RECREATE_RESOURCES", "true")
+        assert Config().recreate_resources is True
+
+    @pytest.mark.parametrize("key, attr", [
+        ("VERBOSE", "verbose"),
+        ("RECREATE_RESOURCES", "recreate_resources"),
+        ("PERSIST_TOKEN_CACHE", "persist_token_cache"),
+    ])
+    @pytest.mark.parametrize("value, expected", [
+        ("TRUE", True), ("1", True), ("yes", True), ("0", False), ("off", False),
+    ])
+    def test_boolean_flags_accept_same_values(self, config, monkeypatch, key, attr, value, expected):
+        """测试各布尔开关环境变量接受相同的取值"""
+        monkeypatch.setenv(key, value)
+        assert getattr(Config(), attr) is expected
+
+
+class TestConfigUniqueNames:
+    """测试唯一资源名称"""
+
+    def test_unique_storage_name_uses_client_id_prefix(self, config):
+        """测试存储账户名附加客户端ID前8位，并随存储账户名更新"""
+        assert config.get_unique_storage_name() == "azraystore550e8400"
+
+        config.set_storage_account_name("AzrayOther")
+        assert config.get_unique_storage_name() == "azrayother550e8400"
@@ -1,39 +1,41 @@
 """测试Config类的域名文件功能"""
 
 import pytest
-import tempfile
+import logging
+import mmap
 import os
-from src.config import Config
+from unittest.mock import patch
+from src.config import Config, domain_file_digest
+
+
+@pytest.fixture
+def domain_file(tmp_path, azure_env):
+    """返回写入临时域名文件并将DOMAIN_FILE指向它的函数"""
+    path = tmp_path / "domains.txt"
+
+    def write(content):
+        if isinstance(content, bytes):
+            path.write_bytes(content)
+        else:
+            path.write_text(content)
+        azure_env.setenv("DOMAIN_FILE", str(path))
+        return str(path)
+
+    return write
 
 
 class TestConfigDomainFile:
     """测试Config类的域名文件功能"""
 
-    def test_default_domain_list(self):
+    def test_default_domain_list(self, azure_env):
         """测试默认转发域名列表"""
-        # 模拟环境变量
-        os.environ["AZURE_CLIENT_ID"] = "test-id"
-        os.environ["AZURE_CLIENT_SECRET"] = "test-secret"
-        os.environ["AZURE_TENANT_ID"] = "test-tenant"
-        os.environ["AZURE_SUBSCRIPTION_ID"] = "test-subscription"
-        os.environ["V2RAY_CLIENT_ID"] = "550e8400-e29b-41d4-a716-446655440000"
-        
-        try:
-            config = Config()
-            assert config.domain_list is not None
-            assert len(config.domain_list) == 0
-        finally:
-            # 清理环境变量
-            keys = ["AZURE_CLIENT_ID", "AZURE_CLIENT_SECRET", "AZURE_TENANT_ID",
-                    "AZURE_SUBSCRIPTION_ID", "V2RAY_CLIENT_ID"]
-            for key in keys:
-                os.environ.pop(key, None)
-
-    def test_load_domains_from_file(self):
+        config = Config()
+        assert config.domain_list is not None
+        assert len(config.domain_list) == 0
+
+    def test_load_domains_from_file(self, domain_file):
         """测试从文件加载域名列表"""
-        # 创建临时域名文件
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.txt', delete=False) as f:
-            f.write("""# 测试域名文件
+        domain_file("""# 测试域名文件
 google.com
 youtube.com
 
@@ -43,82 +45,114 @@ facebook.com
 twitter.com
 invalid-domain-
 """)
-            temp_file = f.name
-
-        try:
-            # 模拟环境变量
-            os.environ["AZURE_CLIENT_ID"] = "test-id"
-            os.environ["AZURE_CLIENT_SECRET"] = "test-secret"
-            os.environ["AZURE_TENANT_ID"] = "test-tenant"
-            os.environ["AZURE_SUBSCRIPTION_ID"] = "test-subscription"
-            os.environ["V2RAY_CLIENT_ID"] = "550e8400-e29b-41d4-a716-446655440000"
-            os.environ["DOMAIN_FILE"] = temp_file
-            
-            config = Config()
-            
-            # 验证加载的域名
-            # 文件中4个有效域名（不再有默认列表）
-            assert len(config.domain_list) == 4
-            assert "domain:google.com" in config.domain_list
-            assert "domain:youtube.com" in config.domain_list
-            assert "domain:facebook.com" in config.domain_list
-            assert "domain:twitter.com" in config.domain_list
-            assert "invalid-domain-" not in config.domain_list  # 无效域名被跳过
-            
-        finally:
-            # 清理
-            os.unlink(temp_file)
-            keys = ["AZURE_CLIENT_ID", "AZURE_CLIENT_SECRET", "AZURE_TENANT_ID",
-                    "AZURE_SUBSCRIPTION_ID", "V2RAY_CLIENT_ID", "DOMAIN_FILE"]
-            for key in keys:
-                os.environ.pop(key, None)
-
-    def test_domain_file_not_found(self):
+
+        config = Config()
+
+        # 验证加载的域名
+        # 文件中4个有效域名（不再有默认列表）
+        assert len(config.domain_list) == 4
+        assert "domain:google.com" in config.domain_list
+        assert "domain:youtube.com" in config.domain_list
+        assert "domain:facebook.com" in config.domain_list
+        assert "domain:twitter.com" in config.domain_list
+        assert "invalid-domain-" not in config.domain_list  # 无效域名被跳过
+
+    def test_domain_file_not_found(self, azure_env):
         """测试域名文件不存在的情况"""
-        # 模拟环境变量
-        os.environ["AZURE_CLIENT_ID"] = "test-id"
-        os.environ["AZURE_CLIENT_SECRET"] = "test-secret"
-        os.environ["AZURE_TENANT_ID"] = "test-tenant"
-        os.environ["AZURE_SUBSCRIPTION_ID"] = "test-subscription"
-        os.environ["V2RAY_CLIENT_ID"] = "550e8400-e29b-41d4-a716-446655440000"
-        os.environ["DOMAIN_FILE"] = "/non/existent/file.txt"
-        
-        try:
-            with pytest.raises(ValueError, match="读取域名文件失败"):
-                Config()
-        finally:
-            # 清理环境变量
-            keys = ["AZURE_CLIENT_ID", "AZURE_CLIENT_SECRET", "AZURE_TENANT_ID",
-                    "AZURE_SUBSCRIPTION_ID", "V2RAY_CLIENT_ID", "DOMAIN_FILE"]
-            for key in keys:
-                os.environ.pop(key, None)
-
-    def test_domain_validation(self):
+        azure_env.setenv("DOMAIN_FILE", "/non/existent/file.txt")
+
+        with pytest.raises(ValueError, match="读取域名文件失败"):
+            Config()
+
+    def test_domain_validation(self, azure_env):
         """测试域名格式验证"""
-        # 模拟环境变量
-        os.environ["AZURE_CLIENT_ID"] = "test-id"
-        os.environ["AZURE_CLIENT_SECRET"] = "test-secret"
-        os.environ["AZURE_TENANT_ID"] = "test-tenant"
-        os.environ["AZURE_SUBSCRIPTION_ID"] = "test-subscription"
-        os.environ["V2RAY_CLIENT_ID"] = "550e8400-e29b-41d4-a716-446655440000"
-        
-        try:
+        config = Config()
+
+        # 测试有效域名
+        assert config._is_valid_domain("google.com")
+        assert config._is_valid_domain("sub.example.com")
+        assert config._is_valid_domain("a.b.c.d.com")
+
+        # 测试无效域名
+        assert not config._is_valid_domain("")
+        assert not config._is_valid_domain("invalid-")
+        assert not config._is_valid_domain("-invalid")
+        assert not config._is_valid_domain("too.long." + "a" * 250)
+
+    def test_reload_skipped_when_file_unchanged(self, domain_file):
+        """测试域名文件修改时间未变化时跳过重新加载"""
+        temp_file = domain_file("google.com\n")
+
+        config = Config()
+        assert config.domain_set == frozenset(["domain:google.com"])
+
+        # 修改时间未变化，不重新读取文件
+        with patch.object(config, "_load_domains_from_file") as load:
+            assert config.reload_domain_list() == ["domain:google.com"]
+            load.assert_not_called()
+
+        # 文件更新后重新加载
+        with open(temp_file, 'w') as f:
+            f.write("google.com\nyoutube.com\n")
+        stat = os.stat(temp_file)
+        os.utime(temp_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+        config.reload_domain_list()
+        assert "domain:youtube.com" in config.domain_set
+        assert len(config.domain_list) == 2
+
+    def test_forced_reload_ignores_unchanged_mtime(self, domain_file):
+        """测试内容变化但修改时间未变时，force=True仍会重新加载"""
+        temp_file = domain_file("google.com\n")
+        config = Config()
+        stat = os.stat(temp_file)
+
+        with open(temp_file, 'w') as f:
+            f.write("google.com\nyoutube.com\n")
+        os.utime(temp_file, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+        assert config.reload_domain_list() == ["domain:google.com"]
+        assert config.reload_domain_list(force=True) == ["domain:google.com", "domain:youtube.com"]
+
+    def test_domain_file_hash_matches_loaded_content(self, domain_file):
+        """测试域名文件摘要取自解析时读取的内容，并随重新加载更新"""
+        temp_file = domain_file("google.com\n")
+        config = Config()
+        assert config.domain_file_hash == domain_file_digest(b"google.com\n")
+
+        with open(temp_file, 'w') as f:
+            f.write("google.com\nyoutube.com\n")
+        config.reload_domain_list(force=True)
+        assert config.domain_file_hash == domain_file_digest(b"google.com\nyoutube.com\n")
+
+    def test_duplicate_domains_removed(self, domain_file):
+        """测试重复域名只保留第一次出现的位置"""
+        domain_file("google.com\nyoutube.com\ngoogle.com\n")
+
+        config = Config()
+        assert config.domain_list == ["domain:google.com", "domain:youtube.com"]
+
+    def test_large_file_loaded_via_mmap(self, domain_file):
+        """测试达到阈值的文件通过内存映射读取，并正确处理CRLF换行和注释"""
+        domain_file(b"# comment\r\ngoogle.com\r\n  youtube.com  \r\n\r\ninvalid-domain-\r\n")
+
+        with patch("src.config._MMAP_MIN_SIZE", 1), \
+                patch("src.config.mmap.mmap", wraps=mmap.mmap) as mock_mmap:
+            config = Config()
+
+        mock_mmap.assert_called_once()
+        assert config.domain_list == ["domain:google.com", "domain:youtube.com"]
+
+    def test_invalid_domains_summarized_in_one_warning(self, domain_file, caplog):
+        """测试大量无效域名只产生一条警告，且最多列出前10个"""
+        domain_file("google.com\n" + "".join(f"bad{i}-\n" for i in range(15)))
+
+        with caplog.at_level(logging.WARNING):
             config = Config()
-            
-            # 测试有效域名
-            assert config._is_valid_domain("google.com")
-            assert config._is_valid_domain("sub.example.com")
-            assert config._is_valid_domain("a.b.c.d.com")
-            
-            # 测试无效域名
-            assert not config._is_valid_domain("")
-            assert not config._is_valid_domain("invalid-")
-            assert not config._is_valid_domain("-invalid")
-            assert not config._is_valid_domain("too.long." + "a" * 250)
-            
-        finally:
-            # 清理环境变量
-            keys = ["AZURE_CLIENT_ID", "AZURE_CLIENT_SECRET", "AZURE_TENANT_ID",
-                    "AZURE_SUBSCRIPTION_ID", "V2RAY_CLIENT_ID"]
-            for key in keys:
-                os.environ.pop(key, None)
+
+        assert config.domain_list == ["domain:google.com"]
+        warnings = [r.getMessage() for r in caplog.records if r.levelno == logging.WARNING]
+        assert len(warnings) == 1
+        assert "15" in warnings[0]
+        assert "bad9-" in warnings[0]
+        assert "bad10-" not in warnings[0]
@@ -2,151 +2,183 @@
 
 import pytest
 import asyncio
-import tempfile
 import os
+from unittest.mock import patch
 from src.file_watcher import FileWatcher
 
 
+def _write(path, content):
+    """写入文件内容（在线程中调用，避免阻塞事件循环）"""
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+@pytest.fixture
+def watched_file(tmp_path):
+    """临时被监控文件（由pytest自动清理）"""
+    path = tmp_path / "watched.txt"
+    path.write_text("initial content")
+    return str(path)
+
+
 class TestFileWatcher:
     """测试文件监控器"""
 
-    @pytest.mark.asyncio
-    async def test_file_watcher_detect_change(self):
+    async def test_file_watcher_detect_change(self, watched_file):
         """测试文件变更检测"""
-        # 创建临时文件
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.txt', delete=False) as f:
-            f.write("initial content")
-            temp_file = f.name
+        change_detected = asyncio.Event()
+
+        def on_change():
+            change_detected.set()
+
+        # 创建文件监控器
+        watcher = FileWatcher(watched_file, on_change)
 
+        # 启动监控
+        await watcher.start()
+
+        # 让出一次事件循环，使监控任务完成注册
+        await asyncio.sleep(0)
+
+        # 修改文件
+        await asyncio.to_thread(_write, watched_file, "modified content")
+
+        # 等待变更检测
         try:
-            change_detected = asyncio.Event()
-            
-            def on_change():
-                change_detected.set()
-
-            # 创建文件监控器
-            watcher = FileWatcher(temp_file, on_change)
-            
-            # 启动监控
+            await asyncio.wait_for(change_detected.wait(), timeout=5.0)
+            assert True, "文件变更被正确检测"
+        except asyncio.TimeoutError:
+            assert False, "文件变更未被检测到"
+
+        # 停止监控
+        await watcher.stop()
+
+    async def test_file_watcher_coalesces_rapid_writes(self, watched_file):
+        """测试连续多次写入合并为一到两次回调"""
+        calls = 0
+        change_detected = asyncio.Event()
+
+        def on_change():
+            nonlocal calls
+            calls += 1
+            change_detected.set()
+
+        watcher = FileWatcher(watched_file, on_change)
+        await watcher.start()
+        await asyncio.sleep(0)
+
+        for i in range(5):
+            await asyncio.to_thread(_write, watched_file, f"content {i}")
+
+        await asyncio.wait_for(change_detected.wait(), timeout=5.0)
+        await asyncio.sleep(0.3)  # 等待可能的后续批次
+        await watcher.stop()
+
+        assert 1 <= calls <= 2
+
+    async def test_file_watcher_polling_fallback(self, watched_file):
+        """测试watchfiles不可用时通过轮询修改时间检测变更"""
+        change_detected = asyncio.Event()
+
+        with patch('src.file_watcher.awatch', None):
+            watcher = FileWatcher(watched_file, change_detected.set)
             await watcher.start()
-            
-            # 等待一下让监控器稳定
-            await asyncio.sleep(0.5)
-            
-            # 修改文件
-            with open(temp_file, 'w') as f:
-                f.write("modified content")
-            
-            # 等待变更检测
-            try:
-                await asyncio.wait_for(change_detected.wait(), timeout=5.0)
-                assert True, "文件变更被正确检测"
-            except asyncio.TimeoutError:
-                assert False, "文件变更未被检测到"
-            
-            # 停止监控
+
+            stat = os.stat(watched_file)
+            os.utime(watched_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+            await asyncio.wait_for(change_detected.wait(), timeout=5.0)
             await watcher.stop()
-            
-        finally:
-            # 清理临时文件
-            if os.path.exists(temp_file):
-                os.unlink(temp_file)
-
-    @pytest.mark.asyncio
-    async def test_file_watcher_async_callback(self):
+
+    async def test_file_watcher_run(self, watched_file):
+        """测试run()在当前任务中监控文件，直到调用stop()"""
+        change_detected = asyncio.Event()
+        watcher = FileWatcher(watched_file, change_detected.set)
+
+        task = asyncio.create_task(watcher.run())
+        await asyncio.sleep(0)
+        assert watcher._running
+
+        await asyncio.to_thread(_write, watched_file, "modified content")
+
+        await asyncio.wait_for(change_detected.wait(), timeout=5.0)
+
+        await watcher.stop()
+        assert task.done()
+
+    async def test_file_watcher_async_callback(self, watched_file):
         """测试异步回调函数"""
-        # 创建临时文件
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.txt', delete=False) as f:
-            f.write("initial content")
-            temp_file = f.name
+        change_detected = asyncio.Event()
+        callback_executed = False
+
+        async def async_on_change():
+            nonlocal callback_executed
+            await asyncio.sleep(0.1)  # 模拟异步操作
+            callback_executed = True
+            change_detected.set()
+
+        # 创建文件监控器（使用异步回调）
+        watcher = FileWatcher(watched_file, async_on_change)
 
+        # 启动监控
+        await watcher.start()
+
+        # 让出一次事件循环，使监控任务完成注册
+        await asyncio.sleep(0)
+
+        # 修改文件
+        await asyncio.to_thread(_write, watched_file, "modified content")
+
+        # 等待变更检测
         try:
-            change_detected = asyncio.Event()
-            callback_executed = False
-            
-            async def async_on_change():
-                nonlocal callback_executed
-                await asyncio.sleep(0.1)  # 模拟异步操作
-                callback_executed = True
-                change_detected.set()
-
-            # 创建文件监控器（使用异步回调）
-            watcher = FileWatcher(temp_file, async_on_change)
-            
-            # 启动监控
-            await watcher.start()
-            
-            # 等待一下让监控器稳定
-            await asyncio.sleep(0.5)
-            
-            # 修改文件
-            with open(temp_file, 'w') as f:
-                f.write("modified content")
-            
-            # 等待变更检测
-            try:
-                await asyncio.wait_for(change_detected.wait(), timeout=5.0)
-                assert callback_executed, "异步回调函数被正确执行"
-            except asyncio.TimeoutError:
-                assert False, "异步回调未被检测到"
-            
-            # 停止监控
-            await watcher.stop()
-            
-        finally:
-            # 清理临时文件
-            if os.path.exists(temp_file):
-                os.unlink(temp_file)
+            await asyncio.wait_for(change_detected.wait(), timeout=5.0)
+            assert callback_executed, "异步回调函数被正确执行"
+        except asyncio.TimeoutError:
+            assert False, "异步回调未被检测到"
+
+        # 停止监控
+        await watcher.stop()
 
-    @pytest.mark.asyncio
     async def test_file_watcher_nonexistent_file(self):
         """测试监控不存在的文件"""
         change_detected = False
-        
+
         def on_change():
             nonlocal change_detected
             change_detected = True
 
         # 监控不存在的文件
         watcher = FileWatcher("/non/existent/file.txt", on_change)
-        
-        # 启动监控（应该不会出错，只是记录警告）
+
+        # 启动监控（应该不会出错，只是记录警告，且不创建监控任务）
         await watcher.start()
+        assert watcher._task is None
+        assert not watcher._running
         await asyncio.sleep(0.1)
         await watcher.stop()
-        
+
         assert not change_detected, "不存在的文件不应该触发变更事件"
 
-    @pytest.mark.asyncio
-    async def test_file_watcher_start_stop(self):
+    async def test_file_watcher_start_stop(self, watched_file):
         """测试文件监控器的启动和停止"""
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.txt', delete=False) as f:
-            f.write("test content")
-            temp_file = f.name
+        def on_change():
+            pass
 
-        try:
-            def on_change():
-                pass
+        watcher = FileWatcher(watched_file, on_change)
 
-            watcher = FileWatcher(temp_file, on_change)
-            
-            # 测试启动
-            assert not watcher._running
-            await watcher.start()
-            assert watcher._running
-            
-            # 测试重复启动
-            await watcher.start()  # 应该不会出错
-            assert watcher._running
-            
-            # 测试停止
-            await watcher.stop()
-            assert not watcher._running
-            
-            # 测试重复停止
-            await watcher.stop()  # 应该不会出错
-            assert not watcher._running
-            
-        finally:
-            if os.path.exists(temp_file):
-                os.unlink(temp_file)
+        # 测试启动
+        assert not watcher._running
+        await watcher.start()
+        assert watcher._running
+
+        # 测试重复启动
+        await watcher.start()  # 应该不会出错
+        assert watcher._running
+
+        # 测试停止
+        await watcher.stop()
+        assert not watcher._running
+
+        # 测试重复停止
+        await watcher.stop()  # 应该不会出错
+        assert not watcher._running
@@ -1,35 +1,42 @@
+import asyncio
+import time
 import pytest
-from unittest.mock import Mock, AsyncMock, patch
+from unittest.mock import MagicMock, Mock, AsyncMock, patch
 from src.config import Config
-from src.health_monitor import HealthMonitor
+from src.health_monitor import HealthMonitor, PROBE_URL, RESTART_WARMUP
 from src.azure_manager import AzureManager
 from src.v2ray_manager import V2RayManager
 
 
-@pytest.fixture
+@pytest.fixture(scope="module")
 def mock_config():
-    """模拟配置"""
-    config = Mock(spec=Config)
-    config.health_check_interval = 1  # 1秒用于测试
-    config.socks5_port = 1080
-    return config
+    """模拟配置（模块内共享）"""
+    return Mock(spec=Config)
 
 
-@pytest.fixture
+@pytest.fixture(scope="module")
 def mock_azure_manager():
-    """模拟Azure管理器"""
-    manager = Mock(spec=AzureManager)
-    manager.restart_container = AsyncMock()
-    return manager
+    """模拟Azure管理器（模块内共享）"""
+    return Mock(spec=AzureManager)
 
 
-@pytest.fixture
+@pytest.fixture(scope="module")
 def mock_v2ray_manager():
-    """模拟V2Ray管理器"""
-    manager = Mock(spec=V2RayManager)
-    manager.is_running.return_value = True
-    manager.restart = AsyncMock()
-    return manager
+    """模拟V2Ray管理器（模块内共享）"""
+    return Mock(spec=V2RayManager)
+
+
+@pytest.fixture(autouse=True)
+def _reset_mocks(mock_config, mock_azure_manager, mock_v2ray_manager):
+    """每个测试前清除共享模拟对象的调用记录并恢复默认行为"""
+    for mock in (mock_config, mock_azure_manager, mock_v2ray_manager):
+        mock.reset_mock(return_value=True, side_effect=True)
+    mock_config.health_check_interval = 1  # 1秒用于测试
+    mock_config.socks5_port = 1080
+    mock_azure_manager.restart_container = AsyncMock()
+    mock_v2ray_manager.is_running.return_value = True
+    mock_v2ray_manager.restart = AsyncMock()
+    mock_v2ray_manager.last_started_at = None
 
 
 @pytest.fixture
@@ -41,7 +48,6 @@ def health_monitor(mock_config, mock_azure_manager, mock_v2ray_manager):
 class TestHealthMonitor:
     """健康监控测试"""
 
-    @pytest.mark.asyncio
     async def test_start_stop(self, health_monitor):
         """测试启动和停止"""
         assert not health_monitor.running
@@ -56,30 +62,69 @@ class TestHealthMonitor:
         assert not health_monitor.running
         assert health_monitor.monitor_task is None
 
-    @pytest.mark.asyncio
+    async def test_run_until_stopped(self, health_monitor):
+        """测试run()在当前任务中运行，直到调用stop()"""
+        checked = asyncio.Event()
+
+        async def probe():
+            checked.set()
+            return True
+
+        with patch.object(health_monitor, '_test_proxy_connection', side_effect=probe):
+            task = asyncio.create_task(health_monitor.run())
+            await asyncio.wait_for(checked.wait(), timeout=1)
+            assert health_monitor.running
+            assert health_monitor.monitor_task is task
+
+            await health_monitor.stop()
+            assert task.done()
+            assert health_monitor.monitor_task is None
+
+    async def test_monitor_loop_repeats_checks(self, health_monitor, mock_config):
+        """测试监控循环按检查间隔重复检查（间隔为0时不占用实际时间）"""
+        mock_config.health_check_interval = 0
+        checks = 0
+        done = asyncio.Event()
+
+        async def probe():
+            nonlocal checks
+            checks += 1
+            if checks == 3:
+                done.set()
+            return True
+
+        with patch.object(health_monitor, '_test_proxy_connection', side_effect=probe):
+            await health_monitor.start()
+            await asyncio.wait_for(done.wait(), timeout=1)
+            await health_monitor.stop()
+
+        assert checks >= 3
+        assert health_monitor.consecutive_failures == 0
+
     async def test_health_check_success(self, health_monitor):
         """测试健康检查成功"""
         with patch.object(health_monitor, '_test_proxy_connection', return_value=True):
             await health_monitor._perform_health_check()
             assert health_monitor.consecutive_failures == 0
 
-    @pytest.mark.asyncio
-    async def test_health_check_failure(self, health_monitor):
-        """测试健康检查失败"""
-        with patch.object(health_monitor, '_test_proxy_connection',
-                          return_value=False), \
-            patch.object(health_monitor, '_handle_connection_failure',
-                         new_callable=AsyncMock) as mock_handle_failure:
-            # 模拟连续失败
-            for i in range(3):
-                await health_monitor._perform_health_check()
-
-            # 第3次失败时应该调用_handle_connection_failure
-            mock_handle_failure.assert_called_once()
-            # 在调用_handle_connection_failure之前，consecutive_failures应该是3
-            assert health_monitor.consecutive_failures == 3
-
-    @pytest.mark.asyncio
+    @pytest.mark.parametrize("n_failures, expect_recover", [
+        (1, False),
+        (2, False),
+        (3, True),  # 第3次连续失败时触发故障恢复
+    ])
+    async def test_health_check_failure(self, health_monitor, monkeypatch, n_failures, expect_recover):
+        """测试健康检查连续失败达到阈值时才处理连接故障"""
+        mock_handle_failure = AsyncMock()
+        monkeypatch.setattr(health_monitor, '_test_proxy_connection', AsyncMock(return_value=False))
+        monkeypatch.setattr(health_monitor, '_handle_connection_failure', mock_handle_failure)
+
+        for _ in range(n_failures):
+            await health_monitor._perform_health_check()
+
+        assert mock_handle_failure.called is expect_recover
+        # _handle_connection_failure被模拟，计数未被重置
+        assert health_monitor.consecutive_failures == n_failures
+
     async def test_v2ray_not_running(self, health_monitor, mock_v2ray_manager):
         """测试V2Ray未运行的情况"""
         mock_v2ray_manager.is_running.return_value = False
@@ -87,6 +132,61 @@ class TestHealthMonitor:
         await health_monitor._perform_health_check()
         mock_v2ray_manager.restart.assert_called_once()
 
+    async def test_failure_during_warmup_not_counted(self, health_monitor, mock_v2ray_manager):
+        """测试V2Ray（无论因何）重启后的预热期内检测失败不计入连续失败次数"""
+        # 如域名文件变更触发的重启：由V2RayManager记录启动时间
+        mock_v2ray_manager.last_started_at = time.monotonic()
+
+        with patch.object(health_monitor, '_test_proxy_connection', return_value=False):
+            await health_monitor._perform_health_check()
+            assert health_monitor.consecutive_failures == 0
+
+            # 预热期结束后失败照常计数
+            mock_v2ray_manager.last_started_at -= RESTART_WARMUP
+            await health_monitor._perform_health_check()
+            assert health_monitor.consecutive_failures == 1
+
+    async def test_uses_injected_http_session(self, health_monitor):
+        """测试使用注入的共享HTTP会话进行代理检测"""
+        response = Mock(status=204)
+        session = MagicMock()
+        session.head.return_value.__aenter__ = AsyncMock(return_value=response)
+        session.head.return_value.__aexit__ = AsyncMock(return_value=False)
+        health_monitor.http_session = session
+
+        with patch('src.health_monitor.aiohttp.ClientSession') as mock_session_class:
+            assert await health_monitor._test_proxy_connection() is True
+
+        session.head.assert_called_once_with(PROBE_URL, allow_redirects=False)
+        mock_session_class.assert_not_called()
+
+    async def test_probe_rejects_non_204(self, health_monitor):
+        """测试检测地址返回非204状态（如被重定向到登录页）时判定为失败"""
+        response = Mock(status=200)
+        session = MagicMock()
+        session.head.return_value.__aenter__ = AsyncMock(return_value=response)
+        session.head.return_value.__aexit__ = AsyncMock(return_value=False)
+        health_monitor.http_session = session
+
+        assert await health_monitor._test_proxy_connection() is False
+
+    async def test_owned_session_reused_and_closed(self, health_monitor):
+        """测试未注入会话时只创建一次会话，并在停止时关闭"""
+        with patch('src.health_monitor.ProxyConnector'), \
+                patch('src.health_monitor.aiohttp.ClientSession') as mock_session_class:
+            session = mock_session_class.return_value
+            session.close = AsyncMock()
+
+            assert health_monitor._get_session() is session
+            assert health_monitor._get_session() is session
+            mock_session_class.assert_called_once()
+
+            health_monitor.running = True
+            await health_monitor.stop()
+
+        session.close.assert_awaited_once()
+        assert health_monitor.http_session is None
+
     def test_get_status(self, health_monitor):
         """测试状态获取"""
         status = health_monitor.get_status()
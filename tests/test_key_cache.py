@@ -0,0 +1,62 @@
+"""测试存储账户密钥本地缓存"""
+
+import json
+import os
+import stat
+
+from src.key_cache import StorageKeyCache
+
+
+class TestStorageKeyCache:
+    """测试存储账户密钥缓存"""
+
+    def test_save_and_load(self, tmp_path):
+        """测试保存后可读取，且文件中不含明文密钥"""
+        path = tmp_path / "keys.json"
+        cache = StorageKeyCache("client-secret", path=str(path))
+
+        cache.save("azraystore", "account-key")
+
+        assert cache.load("azraystore") == "account-key"
+        assert "account-key" not in path.read_text()
+        assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+
+    def test_load_missing_file(self, tmp_path):
+        """测试缓存文件不存在"""
+        cache = StorageKeyCache("client-secret", path=str(tmp_path / "keys.json"))
+        assert cache.load("azraystore") is None
+
+    def test_load_other_account_or_secret(self, tmp_path):
+        """测试账户不匹配或客户端密钥变化时不使用缓存"""
+        path = str(tmp_path / "keys.json")
+        StorageKeyCache("client-secret", path=path).save("azraystore", "account-key")
+
+        assert StorageKeyCache("client-secret", path=path).load("otherstore") is None
+        assert StorageKeyCache("other-secret", path=path).load("azraystore") is None
+
+    def test_load_expired(self, tmp_path):
+        """测试缓存过期"""
+        path = tmp_path / "keys.json"
+        cache = StorageKeyCache("client-secret", path=str(path), ttl=60)
+        cache.save("azraystore", "account-key")
+
+        entry = json.loads(path.read_text())
+        entry["saved_at"] -= 120
+        path.write_text(json.dumps(entry))
+
+        assert cache.load("azraystore") is None
+
+    def test_load_with_age_and_clear(self, tmp_path):
+        """测试读取缓存的保存时长，以及删除缓存"""
+        path = tmp_path / "keys.json"
+        cache = StorageKeyCache("client-secret", path=str(path))
+        cache.save("azraystore", "account-key")
+
+        key, age = cache.load_with_age("azraystore")
+        assert key == "account-key"
+        assert 0 <= age < 60
+
+        cache.clear()
+        assert not path.exists()
+        assert cache.load("azraystore") is None
+        cache.clear()  # 文件不存在时不报错
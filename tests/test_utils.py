@@ -1,44 +1,64 @@
 """Test cases for utils module."""
 
+import logging
+import time
+
 import pytest
 
-from src.utils import retry_with_backoff
+from src.utils import CachedTimeFormatter, retry_with_backoff
+
+
+@pytest.fixture
+def slept(monkeypatch):
+    """Record retry delays instead of actually sleeping."""
+    delays = []
+
+    async def fake_sleep(delay):
+        delays.append(delay)
+
+    monkeypatch.setattr("src.utils.time.sleep", delays.append)
+    monkeypatch.setattr("src.utils.asyncio.sleep", fake_sleep)
+    return delays
 
 
 class TestRetryWithBackoff:
     """Test retry_with_backoff decorator."""
 
-    def test_sync_function_success(self):
-        """Test retry decorator with sync function that succeeds."""
+    @pytest.mark.parametrize("is_async, fail_first, expected_delays", [
+        (False, 0, []),
+        (False, 2, [0.1, 0.2]),
+        (True, 0, []),
+        (True, 1, [0.1]),
+    ], ids=["sync_success", "sync_failure_then_success", "async_success", "async_failure_then_success"])
+    async def test_retry_until_success(self, slept, is_async, fail_first, expected_delays):
+        """Test retry decorator with sync and async functions that fail a few times then succeed."""
         call_count = 0
 
-        @retry_with_backoff(max_attempts=3, base_delay=0.1)
-        def test_func():
+        def body():
             nonlocal call_count
             call_count += 1
+            if call_count <= fail_first:
+                raise ValueError("Test error")
             return "success"
 
-        result = test_func()
-        assert result == "success"
-        assert call_count == 1
+        if is_async:
+            @retry_with_backoff(max_attempts=3, base_delay=0.1)
+            async def async_func():
+                return body()
 
-    def test_sync_function_failure_then_success(self):
-        """Test retry decorator with sync function that fails then succeeds."""
-        call_count = 0
+            result = await async_func()
+        else:
+            @retry_with_backoff(max_attempts=3, base_delay=0.1)
+            def sync_func():
+                return body()
 
-        @retry_with_backoff(max_attempts=3, base_delay=0.1)
-        def test_func():
-            nonlocal call_count
-            call_count += 1
-            if call_count < 3:
-                raise ValueError("Test error")
-            return "success"
+            result = sync_func()
 
-        result = test_func()
         assert result == "success"
-        assert call_count == 3
+        assert call_count == fail_first + 1
+        assert slept == expected_delays
 
-    def test_sync_function_max_retries_exceeded(self):
+    def test_sync_function_max_retries_exceeded(self, slept):
         """Test retry decorator when max retries are exceeded."""
         call_count = 0
 
@@ -51,57 +71,127 @@ class TestRetryWithBackoff:
         with pytest.raises(ValueError, match="Test error"):
             test_func()
         assert call_count == 3  # Initial call + 2 retries
+        assert slept == [0.1, 0.2]
 
-    @pytest.mark.asyncio
-    async def test_async_function_success(self):
-        """Test retry decorator with async function that succeeds."""
+    def test_specific_exception_handling(self, slept):
+        """Test retry decorator with specific exception types."""
         call_count = 0
 
-        @retry_with_backoff(max_attempts=3, base_delay=0.1)
-        async def test_func():
+        @retry_with_backoff(
+            max_attempts=3,
+            base_delay=0.1,
+            exceptions=(ValueError,)
+        )
+        def test_func():
             nonlocal call_count
             call_count += 1
-            return "async success"
+            if call_count == 1:
+                raise ValueError("Retry this")
+            elif call_count == 2:
+                raise RuntimeError("Don't retry this")
+            return "success"
 
-        result = await test_func()
-        assert result == "async success"
-        assert call_count == 1
+        with pytest.raises(RuntimeError, match="Don't retry this"):
+            test_func()
+        assert call_count == 2
+        assert slept == [0.1]
 
-    @pytest.mark.asyncio
-    async def test_async_function_failure_then_success(self):
-        """Test retry decorator with async function that fails then succeeds."""
+    def test_retry_if_predicate_narrows_exceptions(self, slept):
+        """Test that errors rejected by retry_if are raised without retrying."""
         call_count = 0
 
-        @retry_with_backoff(max_attempts=3, base_delay=0.1)
-        async def test_func():
+        @retry_with_backoff(max_attempts=3, base_delay=0.1, retry_if=lambda e: "transient" in str(e))
+        def test_func():
             nonlocal call_count
             call_count += 1
-            if call_count < 2:
-                raise RuntimeError("Test error")
-            return "async success"
+            if call_count == 1:
+                raise ValueError("transient")
+            raise ValueError("permanent")
 
-        result = await test_func()
-        assert result == "async success"
+        with pytest.raises(ValueError, match="permanent"):
+            test_func()
         assert call_count == 2
+        assert slept == [0.1]
 
-    def test_specific_exception_handling(self):
-        """Test retry decorator with specific exception types."""
+    async def test_retry_after_overrides_backoff(self, slept):
+        """Test that a delay requested by the error replaces the backoff delay."""
         call_count = 0
 
-        @retry_with_backoff(
-            max_attempts=3,
-            base_delay=0.1,
-            exceptions=(ValueError,)
-        )
-        def test_func():
+        def requested_delay(error):
+            return 7.0 if "throttled" in str(error) else None
+
+        @retry_with_backoff(max_attempts=3, base_delay=1.0, max_delay=5.0, retry_after=requested_delay)
+        async def test_func():
             nonlocal call_count
             call_count += 1
             if call_count == 1:
-                raise ValueError("Retry this")
-            elif call_count == 2:
-                raise RuntimeError("Don't retry this")
+                raise ValueError("throttled")
+            if call_count == 2:
+                raise ValueError("other")
             return "success"
 
-        with pytest.raises(RuntimeError, match="Don't retry this"):
+        assert await test_func() == "success"
+        # Requested delay is capped at max_delay; otherwise exponential backoff applies
+        assert slept == [5.0, 2.0]
+
+    def test_backoff_schedule_capped_at_max_delay(self, slept):
+        """Test that exponential backoff delays grow until max_delay."""
+
+        @retry_with_backoff(max_attempts=4, base_delay=1.0, max_delay=5.0)
+        def test_func():
+            raise ValueError("Test error")
+
+        with pytest.raises(ValueError):
             test_func()
-        assert call_count == 2
+        assert slept == [1.0, 2.0, 4.0, 5.0]
+
+    def test_backoff_jitter_schedule(self, slept, monkeypatch):
+        """Test that jitter scales each backoff delay and is still capped at max_delay."""
+        monkeypatch.setattr("src.utils.random.random", lambda: 0.5)
+
+        @retry_with_backoff(max_attempts=4, base_delay=1.0, max_delay=5.0, jitter=0.5)
+        def test_func():
+            raise ValueError("Test error")
+
+        with pytest.raises(ValueError):
+            test_func()
+        assert slept == [1.25, 2.5, 5.0, 5.0]
+
+
+class TestCachedTimeFormatter:
+    """Test CachedTimeFormatter."""
+
+    def _record(self, created: float) -> logging.LogRecord:
+        record = logging.LogRecord("test", logging.INFO, __file__, 1, "msg", None, None)
+        record.created = created
+        record.msecs = (created - int(created)) * 1000
+        return record
+
+    def test_matches_default_formatter(self):
+        """Test the cached timestamp matches logging.Formatter output."""
+        fmt = "%(asctime)s - %(message)s"
+        cached = CachedTimeFormatter(fmt)
+        default = logging.Formatter(fmt)
+
+        for created in (1700000000.123, 1700000000.987, 1700000001.5):
+            record = self._record(created)
+            assert cached.format(record) == default.format(record)
+
+    def test_reuses_strftime_within_same_second(self, monkeypatch):
+        """Test strftime is only called once per second."""
+        calls = []
+        original_strftime = time.strftime
+
+        def counting_strftime(*args):
+            calls.append(args)
+            return original_strftime(*args)
+
+        monkeypatch.setattr("src.utils.time.strftime", counting_strftime)
+        formatter = CachedTimeFormatter("%(asctime)s")
+
+        formatter.format(self._record(1700000000.1))
+        formatter.format(self._record(1700000000.9))
+        assert len(calls) == 1
+
+        formatter.format(self._record(1700000001.1))
+        assert len(calls) == 2
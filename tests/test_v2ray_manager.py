@@ -1,3 +1,7 @@
+import asyncio
+import collections
+import json
+import logging
 import pytest
 import os
 from unittest.mock import Mock, AsyncMock, patch
@@ -6,47 +10,82 @@ from src.v2ray_manager import V2RayManager
 from src.azure_manager import AzureManager
 
 
-@pytest.fixture
+class _FakeProcess:
+    """模拟asyncio子进程（stderr已合并到stdout），输出由测试写入"""
+
+    def __init__(self):
+        self.stdout = asyncio.StreamReader()
+        self.returncode = None
+        self._exited = asyncio.Event()
+
+    def exit(self, code):
+        self.returncode = code
+        self.stdout.feed_eof()
+        self._exited.set()
+
+    async def wait(self):
+        await self._exited.wait()
+        return self.returncode
+
+    def terminate(self):
+        self.exit(0)
+
+    def kill(self):
+        self.exit(-9)
+
+
+@pytest.fixture(scope="module")
 def mock_config():
-    """模拟配置"""
-    config = Mock(spec=Config)
-    config.socks5_port = 1080
-    config.http_port = 1081
-    config.v2ray_port = 9088
-    config.v2ray_path = "/v2ray"
-    config.v2ray_client_id = "550e8400-e29b-41d4-a716-446655440000"
-    config.domain_list = ["domain:google.com", "domain:youtube.com"]
-    config.domain_file = None
-    config.verbose = False  # 默认非verbose模式
-    return config
+    """模拟配置（模块内共享）"""
+    return Mock(spec=Config)
 
 
-@pytest.fixture
+@pytest.fixture(scope="module")
 def mock_azure_manager():
-    """模拟Azure管理器"""
-    manager = Mock(spec=AzureManager)
-    manager.get_container_ip = AsyncMock(
-        return_value="20.21.22.23")
-    return manager
+    """模拟Azure管理器（模块内共享）"""
+    return Mock(spec=AzureManager)
+
+
+@pytest.fixture(autouse=True)
+def _reset_mocks(mock_config, mock_azure_manager):
+    """每个测试前清除共享模拟对象的调用记录并恢复默认值"""
+    mock_config.reset_mock(return_value=True, side_effect=True)
+    mock_config.configure_mock(
+        socks5_port=1080,
+        http_port=1081,
+        v2ray_port=9088,
+        v2ray_path="/v2ray",
+        v2ray_client_id="550e8400-e29b-41d4-a716-446655440000",
+        domain_list=["domain:google.com", "domain:youtube.com"],
+        domain_file=None,
+        verbose=False,  # 默认非verbose模式
+    )
+    mock_azure_manager.reset_mock(return_value=True, side_effect=True)
+    mock_azure_manager.get_container_ip = AsyncMock(return_value="20.21.22.23")
+
+
+@pytest.fixture
+async def mock_exec(monkeypatch):
+    """以模拟子进程替换asyncio.create_subprocess_exec，return_value为_FakeProcess
+
+    异步夹具，保证_FakeProcess的流在测试所用的事件循环中创建。
+    """
+    mock = AsyncMock(return_value=_FakeProcess())
+    monkeypatch.setattr(asyncio, "create_subprocess_exec", mock)
+    return mock
 
 
 @pytest.fixture
-def v2ray_manager(mock_config, mock_azure_manager):
+def v2ray_manager(mock_config, mock_azure_manager, monkeypatch):
     """V2Ray管理器实例"""
     # 设置V2RAY_WAIT_TIME为0以加速测试
-    os.environ["V2RAY_WAIT_TIME"] = "0"
-    manager = V2RayManager(mock_config, mock_azure_manager)
-    
-    yield manager
-    
-    # 清理环境变量
-    os.environ.pop("V2RAY_WAIT_TIME", None)
+    monkeypatch.setenv("V2RAY_WAIT_TIME", "0")
+    return V2RayManager(mock_config, mock_azure_manager)
 
 
 class TestV2RayManager:
     """V2Ray管理器测试"""
 
-    @pytest.mark.asyncio
     async def test_initialize(self, v2ray_manager):
         """测试初始化"""
         with patch.object(v2ray_manager, '_generate_client_config',
@@ -54,42 +93,99 @@ class TestV2RayManager:
             await v2ray_manager.initialize()
             v2ray_manager._generate_client_config.assert_called_once()
 
-    @pytest.mark.asyncio
+    async def test_build_client_config(self, v2ray_manager):
+        """测试客户端配置构建（不写文件）"""
+        config = await v2ray_manager._build_client_config()
+
+        assert "inbounds" in config
+        assert "outbounds" in config
+        assert "routing" in config
+        assert config["inbounds"][0]["port"] == 1080
+        assert config["inbounds"][0]["protocol"] == "socks"
+        assert config["outbounds"][0]["settings"]["vnext"][0]["address"] == "20.21.22.23"
+        assert config["routing"]["rules"][1]["domain"] == ["domain:google.com", "domain:youtube.com"]
+        assert v2ray_manager.config_file is None
+
     async def test_generate_client_config(self, v2ray_manager):
-        """测试客户端配置生成"""
+        """测试客户端配置生成并写入文件"""
         await v2ray_manager._generate_client_config()
 
         assert v2ray_manager.config_file is not None
+        # 配置中含客户端ID，文件仅当前用户可读写
+        assert os.stat(v2ray_manager.config_file).st_mode & 0o777 == 0o600
 
-        # 验证配置文件内容
-        import json
+        # 验证配置文件内容与构建的配置一致
         with open(v2ray_manager.config_file, 'r') as f:
             config = json.load(f)
+        assert config == v2ray_manager._config_template
 
-        assert "inbounds" in config
-        assert "outbounds" in config
-        assert "routing" in config
-        assert config["inbounds"][0]["port"] == 1080
-        assert config["inbounds"][0]["protocol"] == "socks"
+    async def test_regenerate_skips_unchanged_config(self, v2ray_manager, mock_azure_manager):
+        """测试配置内容未变化时不重写文件，地址变化时原地覆盖"""
+        await v2ray_manager._generate_client_config()
+        config_file = v2ray_manager.config_file
 
-    @pytest.mark.asyncio
-    async def test_start_stop(self, v2ray_manager):
-        """测试启动和停止"""
-        with patch('subprocess.Popen') as mock_popen:
-            mock_process = Mock()
-            mock_process.poll.return_value = None  # 进程运行中
-            mock_popen.return_value = mock_process
+        with patch.object(V2RayManager, '_write_config_file',
+                          wraps=V2RayManager._write_config_file) as mock_write, \
+                patch.object(V2RayManager, '_dump_config',
+                             wraps=V2RayManager._dump_config) as mock_dump:
+            # 地址和域名列表均未变化时既不序列化也不写入
+            await v2ray_manager._generate_client_config()
+            mock_dump.assert_not_called()
+            mock_write.assert_not_called()
 
-            # 初始化配置
+            # 域名列表重新加载但内容相同：重新序列化，但不重写文件
+            v2ray_manager.config.domain_list = list(v2ray_manager.config.domain_list)
             await v2ray_manager._generate_client_config()
+            mock_dump.assert_called_once()
+            mock_write.assert_not_called()
 
-            # 启动
-            await v2ray_manager.start()
-            assert v2ray_manager.process is not None
+            mock_azure_manager.get_container_ip.return_value = "20.21.22.24"
+            await v2ray_manager._generate_client_config()
+            mock_write.assert_called_once()
 
-            # 停止
-            await v2ray_manager.stop()
-            mock_process.terminate.assert_called_once()
+        assert v2ray_manager.config_file == config_file
+        with open(config_file, 'r') as f:
+            config = json.load(f)
+        assert config["outbounds"][0]["settings"]["vnext"][0]["address"] == "20.21.22.24"
+        assert config["routing"]["rules"][1]["domain"] == ["domain:google.com", "domain:youtube.com"]
+
+        await v2ray_manager.stop()
+        assert not os.path.exists(config_file)
+
+    def test_dump_config_json_fallback(self, v2ray_manager):
+        """测试orjson与标准库json的序列化结果可互换"""
+        config = v2ray_manager._build_config_template()
+
+        with patch('src.v2ray_manager.orjson', None):
+            fallback = V2RayManager._dump_config(config)
+
+        assert json.loads(V2RayManager._dump_config(config)) == json.loads(fallback) == config
+
+    def test_dump_config_compact_unless_debug(self, v2ray_manager, caplog):
+        """测试默认输出紧凑JSON，启用DEBUG日志时缩进"""
+        config = v2ray_manager._build_config_template()
+
+        with caplog.at_level(logging.INFO, logger="src.v2ray_manager"):
+            assert b"\n" not in V2RayManager._dump_config(config)
+        with caplog.at_level(logging.DEBUG, logger="src.v2ray_manager"):
+            assert b'\n  "log"' in V2RayManager._dump_config(config)
+
+    async def test_start_stop(self, v2ray_manager, mock_exec):
+        """测试启动和停止"""
+        # 初始化配置
+        await v2ray_manager._generate_client_config()
+
+        # 启动
+        await v2ray_manager.start()
+        assert v2ray_manager.process is mock_exec.return_value
+        assert mock_exec.await_args.args == ("v2ray", "run", "-c", v2ray_manager.config_file)
+
+        # 停止（terminate后进程以0退出），输出读取任务随之结束
+        log_task = v2ray_manager._log_task
+        await v2ray_manager.stop()
+        assert mock_exec.return_value.returncode == 0
+        assert log_task.done()
+        assert v2ray_manager._log_task is None
 
     def test_is_running(self, v2ray_manager):
         """测试运行状态检查"""
@@ -98,29 +194,27 @@ class TestV2RayManager:
 
         # 模拟运行状态
         mock_process = Mock()
-        mock_process.poll.return_value = None
+        mock_process.returncode = None
         v2ray_manager.process = mock_process
         assert v2ray_manager.is_running()
 
         # 模拟已停止
-        mock_process.poll.return_value = 0
+        mock_process.returncode = 0
         assert not v2ray_manager.is_running()
 
-    def test_verbose_config_generation(self, v2ray_manager):
+    def test_verbose_config_generation(self, v2ray_manager, tmp_path):
         """测试verbose模式下的配置生成"""
         # 测试非verbose模式
         v2ray_manager.config.verbose = False
         
         # 生成配置（需要设置config_file）
-        import tempfile
-        import json
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False) as f:
-            config_content = {
-                "log": {"loglevel": "warning", "access": ""},
-                "inbounds": [], "outbounds": [], "routing": {}
-            }
-            json.dump(config_content, f)
-            v2ray_manager.config_file = f.name
+        config_content = {
+            "log": {"loglevel": "warning", "access": ""},
+            "inbounds": [], "outbounds": [], "routing": {}
+        }
+        config_path = tmp_path / "config.json"
+        config_path.write_text(json.dumps(config_content))
+        v2ray_manager.config_file = str(config_path)
         
         # 读取生成的配置
         with open(v2ray_manager.config_file, 'r') as f:
@@ -132,66 +226,111 @@ class TestV2RayManager:
         # 测试verbose模式
         v2ray_manager.config.verbose = True
         # 在verbose模式下，loglevel应该是info
-        
-        # 清理
-        os.unlink(v2ray_manager.config_file)
 
-    @pytest.mark.asyncio
-    async def test_log_forwarding_with_verbose(self, v2ray_manager):
-        """测试verbose模式下的日志转发"""
-        # 测试非verbose模式 - 不应该转发日志
-        v2ray_manager.config.verbose = False
-        
-        with patch('subprocess.Popen') as mock_popen, \
-             patch('asyncio.create_task') as mock_create_task:
-            
-            mock_process = Mock()
-            mock_process.poll.return_value = None
-            mock_process.stdout = Mock()
-            mock_process.stderr = Mock()
-            mock_popen.return_value = mock_process
-            
-            # 模拟临时配置文件
-            import tempfile
-            with tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False) as f:
-                f.write('{"test": "config"}')
-                config_file_path = f.name
-                v2ray_manager.config_file = config_file_path
-            
-            await v2ray_manager.start()
-            
-            # 在非verbose模式下，不应该创建日志转发任务
-            mock_create_task.assert_not_called()
-            
-            # 清理
-            await v2ray_manager.stop()
-            if os.path.exists(config_file_path):
-                os.unlink(config_file_path)
-        
-        # 测试verbose模式 - 应该转发日志
-        v2ray_manager.config.verbose = True
-        
-        with patch('subprocess.Popen') as mock_popen, \
-             patch('asyncio.create_task') as mock_create_task:
-            
-            mock_process = Mock()
-            mock_process.poll.return_value = None
-            mock_process.stdout = Mock()
-            mock_process.stderr = Mock()
-            mock_popen.return_value = mock_process
-            
-            # 模拟临时配置文件
-            with tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False) as f:
-                f.write('{"test": "config"}')
-                config_file_path_verbose = f.name
-                v2ray_manager.config_file = config_file_path_verbose
-            
-            await v2ray_manager.start()
-            
-            # 在verbose模式下，应该创建日志转发任务
-            mock_create_task.assert_called_once()
-            
-            # 清理
+    @pytest.mark.parametrize("verbose, stdout_level", [
+        (False, logging.DEBUG),
+        (True, logging.INFO),
+    ], ids=["verbose_off", "verbose_on"])
+    async def test_log_forwarding_with_verbose(self, v2ray_manager, mock_exec, caplog, monkeypatch,
+                                               verbose, stdout_level):
+        """测试始终读取V2Ray输出，verbose模式下以INFO级别转发，否则仅DEBUG"""
+        # start()等待启动完成日志，返回时该行已被读取
+        monkeypatch.setenv("V2RAY_WAIT_TIME", "5")
+        v2ray_manager.config.verbose = verbose
+        mock_exec.return_value.stdout.feed_data(b"V2Ray 5.16.1 started\n")
+
+        with caplog.at_level(logging.DEBUG, logger="v2ray"):
+            await asyncio.wait_for(v2ray_manager.start(), timeout=1)
+            await v2ray_manager._stop_process()
+
+        records = [r for r in caplog.records if r.name == "v2ray"]
+        assert [(r.levelno, r.getMessage()) for r in records] == [(stdout_level, "V2Ray 5.16.1 started")]
+
+    async def test_start_returns_when_v2ray_reports_started(self, v2ray_manager, mock_exec, monkeypatch):
+        """测试V2Ray输出启动完成日志后立即返回，无需等满V2RAY_WAIT_TIME"""
+        monkeypatch.setenv("V2RAY_WAIT_TIME", "30")
+
+        start = asyncio.create_task(v2ray_manager.start())
+        await asyncio.sleep(0.05)
+        assert not start.done()
+
+        mock_exec.return_value.stdout.feed_data(b"[Warning] V2Ray 5.16.1 started\n")
+        await asyncio.wait_for(start, timeout=1)
+
+        assert v2ray_manager.is_running()
+        assert v2ray_manager.last_started_at is not None
+        await v2ray_manager._stop_process()
+
+    async def test_start_failure_reports_stderr(self, v2ray_manager, mock_exec, monkeypatch):
+        """测试V2Ray启动后立即退出时，错误信息包含其输出"""
+        monkeypatch.setenv("V2RAY_WAIT_TIME", "30")
+        process = mock_exec.return_value
+        process.stdout.feed_data(b"failed to load config\n")
+        process.exit(23)
+
+        with pytest.raises(RuntimeError, match="failed to load config"):
+            await asyncio.wait_for(v2ray_manager.start(), timeout=1)
+
+    async def test_stop_during_start_is_not_a_failure(self, v2ray_manager, mock_exec, monkeypatch):
+        """测试启动等待期间被主动停止时，start()正常返回而不报告启动失败"""
+        monkeypatch.setenv("V2RAY_WAIT_TIME", "30")
+
+        start = asyncio.create_task(v2ray_manager.start())
+        await asyncio.sleep(0.05)
+        assert not start.done()
+
+        await v2ray_manager._stop_process()
+        await asyncio.wait_for(start, timeout=1)
+
+        assert v2ray_manager.process is None
+        assert not v2ray_manager.is_running()
+
+    async def test_read_stream_logs_lines(self, v2ray_manager):
+        """测试从asyncio流逐行读取V2Ray输出，跳过空行"""
+        stream = asyncio.StreamReader()
+        stream.feed_data(b"V2Ray 5.0 started\r\n\n[Warning] failed to dial \xff\n")
+        stream.feed_eof()
+
+        lines = []
+        await v2ray_manager._read_stream(stream, lines.append)
+
+        assert lines == ["V2Ray 5.0 started", "[Warning] failed to dial �"]
+
+    async def test_read_stream_without_logging_detects_start(self, v2ray_manager):
+        """测试不记录日志时仍能识别启动完成，并保留原始的末尾行"""
+        stream = asyncio.StreamReader()
+        stream.feed_data(b"V2Ray 5.16.1 started\nnoise\n")
+        stream.feed_eof()
+        tail = collections.deque(maxlen=1)
+
+        await v2ray_manager._read_stream(stream, None, tail)
+
+        assert v2ray_manager._ready_event.is_set()
+        assert list(tail) == [b"noise\n"]
+
+    async def test_concurrent_restarts_coalesced(self, v2ray_manager):
+        """测试并发的重启请求合并为一次停止、生成配置、启动"""
+        with patch.object(v2ray_manager, '_stop_process', new_callable=AsyncMock) as mock_stop, \
+                patch.object(v2ray_manager, '_generate_client_config', new_callable=AsyncMock) as mock_generate, \
+                patch.object(v2ray_manager, 'start', new_callable=AsyncMock) as mock_start:
+            await asyncio.gather(*(v2ray_manager.restart() for _ in range(3)))
+
+            mock_stop.assert_awaited_once()
+            mock_generate.assert_awaited_once()
+            mock_start.assert_awaited_once()
+
+            # 上一次重启完成后的调用会触发新的重启
+            await v2ray_manager.restart()
+            assert mock_start.await_count == 2
+
+    async def test_stop_cancels_pending_restart(self, v2ray_manager):
+        """测试停止时取消尚未完成的重启，V2Ray不会在停止后被重新启动"""
+        with patch.object(v2ray_manager, 'start', new_callable=AsyncMock) as mock_start:
+            restart = asyncio.create_task(v2ray_manager.restart())
+            await asyncio.sleep(0)
+
             await v2ray_manager.stop()
-            if os.path.exists(config_file_path_verbose):
-                os.unlink(config_file_path_verbose)
+
+            with pytest.raises(asyncio.CancelledError):
+                await restart
+            mock_start.assert_not_called()